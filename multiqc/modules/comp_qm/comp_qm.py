@@ -5,7 +5,6 @@
 from __future__ import print_function
 from collections import OrderedDict
 import logging
-import re
 import json
 
 from multiqc import config
@@ -68,68 +67,49 @@ class MultiqcModule(BaseMultiqcModule):
         s_name = self.clean_s_name(f['s_name'],f['root'])
 
         log.debug(str(s_name))
-        log.debug("file contents")
-        read_data=f['f'].read() # would be a bad idea for very large files
-        log.debug(type(read_data))
 
         if s_name is not None:
-            #. --- MATCH MULLIKEN BLOCKS---
-            for match in re.finditer(r' Mulliken atomic charges.*?Sum of Mulliken atomic',read_data,re.DOTALL):
-                pass # the last match is the one I want
-            try:
-                log.debug("Mulliken match information: %s", match)
-                mulliken_charge_dictionary={} # dictionary to place parsed mulliken information, before placing in data source
-                if match is not None:
-                    log.debug(match.group(0)) # final match is what I want
-                    all_charges=match.group(0).split('\n')[2:-1] # split into lines and remove unneccesary lines
-                    for item in all_charges:
-                        log.debug("Mulliken atomic number: %s", item.split()[0])
-                        log.debug("Mulliken charge: %s",item.split()[2])
-                        mulliken_charge_dictionary[str(item.split()[0])]=item.split()[2]
-
-                    #. add data to the mulliken section
-                    self.add_data_source(f, section='mulliken')
-                    self.comp_qm_data['mulliken'][s_name] = mulliken_charge_dictionary
-                    log.debug(str(self.comp_qm_data['mulliken'][s_name]))
-
-            except:
+            #. read the file once, keeping only the last block of each kind
+            blocks = last_gaussian_blocks(f['f'])
+
+            #. --- MULLIKEN BLOCKS---
+            mulliken_charge_dictionary = blocks['mulliken']
+            if mulliken_charge_dictionary is not None:
+                #. add data to the mulliken section
+                self.add_data_source(f, section='mulliken')
+                self.comp_qm_data['mulliken'][s_name] = mulliken_charge_dictionary
+                log.debug(str(self.comp_qm_data['mulliken'][s_name]))
+            else:
                 log.debug("Mulliken: No Data found.")
 
-            #. --- MATCH DIST, ANGLE, DIHE ---
-            for matchr in re.finditer(r' Optimized Parameters.*?GradGrad',read_data,re.DOTALL):
-                pass # the last match is the one I want
-            try:
-                log.debug("Geometric Parameters match information: %s", match)
-                #..  dictionaries to place parsed mulliken information, before placing in data source
+            #. --- DIST, ANGLE, DIHE ---
+            parameters = blocks['parameters']
+            if parameters is not None:
+                #..  dictionaries to place parsed parameters, before placing in data source
                 bond_dictionary={}
                 angle_dictionary={}
                 torsion_dictionary={}
-                if matchr is not None:
-                    log.debug(matchr.group(0)) # final match is what I want
-                    all_vars=matchr.group(0).split('\n')[5:-2] # split into lines and remove unneccesary lines (-2 includes all)
-                    for item in all_vars:
-                        log.debug("Parameter name: %s",item.split()[1])
-                        log.debug("Parameter value: %s", item.split()[3])
-                        if "R" in item.split()[1]:
-                            bond_dictionary[str(item.split()[1])]=item.split()[3]
-                        elif "A" in item.split()[1]:
-                            angle_dictionary[str(item.split()[1])]=item.split()[3]
-                        elif "D" in item.split()[1]:
-                            torsion_dictionary[str(item.split()[1])]=item.split()[3]
-                        else:
-                            log.debug("Failed the bond, angle, torsion check - unknown parameter")
-
-                    #. add data to the bonds, angles, torsion section
-                    self.add_data_source(f, section='bonds')
-                    self.comp_qm_data['bonds'][s_name] = bond_dictionary
-                    log.debug(str(self.comp_qm_data['bonds'][s_name]))
-                    self.add_data_source(f, section='angles')
-                    self.comp_qm_data['angles'][s_name] = angle_dictionary
-                    log.debug(str(self.comp_qm_data['angles'][s_name]))
-                    self.add_data_source(f, section='torsions')
-                    self.comp_qm_data['torsions'][s_name] = torsion_dictionary
-                    log.debug(str(self.comp_qm_data['torsions'][s_name]))
-            except:
+                for name, value in parameters.items():
+                    if "R" in name:
+                        bond_dictionary[name]=value
+                    elif "A" in name:
+                        angle_dictionary[name]=value
+                    elif "D" in name:
+                        torsion_dictionary[name]=value
+                    else:
+                        log.debug("Failed the bond, angle, torsion check - unknown parameter %s", name)
+
+                #. add data to the bonds, angles, torsion section
+                self.add_data_source(f, section='bonds')
+                self.comp_qm_data['bonds'][s_name] = bond_dictionary
+                log.debug(str(self.comp_qm_data['bonds'][s_name]))
+                self.add_data_source(f, section='angles')
+                self.comp_qm_data['angles'][s_name] = angle_dictionary
+                log.debug(str(self.comp_qm_data['angles'][s_name]))
+                self.add_data_source(f, section='torsions')
+                self.comp_qm_data['torsions'][s_name] = torsion_dictionary
+                log.debug(str(self.comp_qm_data['torsions'][s_name]))
+            else:
                 log.debug("Parameters: No Data found.")
         s_name = None
 
@@ -241,3 +221,118 @@ class MultiqcModule(BaseMultiqcModule):
             anchor = 'comp_qm_geometry',
             plot = beeswarm.plot(self.comp_qm_data[geometry_descriptor], headers, config)
         )
+
+#. Blocks of Gaussian output to parse. A block runs from the 'start' text to
+#. the next 'end' text, either of which can be part way along a line. The
+#. first 'header' lines after the start line and the last 'footer' lines before
+#. the end line are skipped, and 'fields' are the columns with the name and value.
+gaussian_blocks = OrderedDict([
+    ('mulliken', {'start': ' Mulliken atomic charges', 'end': 'Sum of Mulliken atomic',
+                  'header': 1, 'footer': 0, 'fields': (0, 2)}),
+    ('parameters', {'start': ' Optimized Parameters', 'end': 'GradGrad',
+                    'header': 4, 'footer': 1, 'fields': (1, 3)}),
+])
+
+#. lines of an unfinished block to hold before parsing them, so that a block
+#. that never ends can't fill up memory
+max_pending_lines = 100000
+
+def last_gaussian_blocks(fh, blocks=gaussian_blocks, chunk_size=4194304):
+    """ Read a Gaussian log once and parse the last complete block of each
+    kind. Optimisations and IRCs print the same blocks at every step, so only
+    the block being read and the last complete one are kept. The file is read
+    in chunks of whole lines, skipping to the next start or end text with
+    str.find, and only the last block is split into fields.
+    :param fh: File handle, open for reading text
+    :param blocks: Dict of block names to block definitions
+    :return: Dict of block names to dicts of values (as strings), or to None if
+             there was no complete block or the last one had a line too short
+    """
+    states = [new_block_state(name, spec) for name, spec in blocks.items()]
+    tail = ''
+    while True:
+        chunk = fh.read(chunk_size)
+        text = tail + chunk
+        if chunk:
+            #. keep the last partial line for the next chunk
+            cut = text.rfind('\n') + 1
+            tail = text[cut:]
+            text = text[:cut]
+        for state in states:
+            scan_block_text(state, text)
+        if not chunk:
+            break
+    return OrderedDict([(state['name'], parse_last_block(state)) for state in states])
+
+def new_block_state(name, spec):
+    """ State of the reader for one kind of block """
+    state = dict(spec)
+    state.update({'name': name, 'open': False, 'last': None})
+    return state
+
+def scan_block_text(state, text):
+    """ Move the block state machine on through a chunk of whole lines """
+    pos = 0
+    while True:
+        if not state['open']:
+            i = text.find(state['start'], pos)
+            if i < 0:
+                return
+            state.update({'open': True, 'in_body': False, 'lines': 0, 'pending': [], 'values': {}})
+            pos = i + len(state['start'])
+        end = text.find(state['end'], pos)
+        stop = len(text) if end < 0 else end
+        if not state['in_body']:
+            #. the rest of the start line isn't part of the block
+            newline = text.find('\n', pos, stop)
+            if newline >= 0:
+                state['in_body'] = True
+                pos = newline + 1
+        if state['in_body']:
+            #. whole lines up to the line with the end text
+            body_end = stop if end < 0 else text.rfind('\n', pos, end) + 1
+            if body_end > pos:
+                #. chunks end with a newline, except a partial last line at the
+                #. end of the file, which is in a block that never finishes
+                lines = text[pos:body_end].split('\n')
+                lines.pop()
+                add_block_lines(state, lines)
+        if end < 0:
+            return
+        #. block complete - the footer lines still pending are dropped
+        footer = len(state['pending']) - state['footer']
+        state['last'] = (state['values'], state['pending'][:max(footer, 0)], state['fields'])
+        state['open'] = False
+        pos = end + len(state['end'])
+
+def add_block_lines(state, lines):
+    """ Add lines from inside a block, after any header lines """
+    skip = max(state['header'] - state['lines'], 0)
+    state['lines'] += len(lines)
+    if state['values'] is None or skip >= len(lines):
+        return
+    state['pending'].extend(lines[skip:])
+    if len(state['pending']) > max_pending_lines:
+        #. parse all but the possible footer lines now
+        keep = len(state['pending']) - state['footer']
+        state['values'] = parse_block_lines(state['values'], state['pending'][:keep], state['fields'])
+        state['pending'] = state['pending'][keep:]
+
+def parse_last_block(state):
+    """ Values from the last complete block, or None """
+    if state['last'] is None:
+        return None
+    return parse_block_lines(*state['last'])
+
+def parse_block_lines(values, lines, fields):
+    """ Add the name and value from each line of a block to values. A line too
+    short makes the whole block unusable, as it did with the old regex parser. """
+    if values is None:
+        return None
+    for line in lines:
+        line_fields = line.split()
+        try:
+            values[str(line_fields[fields[0]])] = line_fields[fields[1]]
+        except IndexError:
+            return None
+    return values
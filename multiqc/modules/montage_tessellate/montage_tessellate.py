@@ -3,18 +3,766 @@
 """ MultiQC module to parse output from Tessellate """
 
 from __future__ import print_function
+from array import array
 from collections import OrderedDict
+import functools
+import hashlib
+import io
 import logging
+import multiprocessing
+import numpy as np
+import os
 import re
+import time
 import json
 
 from multiqc import config
+from multiqc.utils import mqc_json, util_functions
 from multiqc.plots import table, bargraph, linegraph, scatter, heatmap, beeswarm
 from multiqc.modules.base_module import BaseMultiqcModule
 
 # Initialise the logger
 log = logging.getLogger(__name__)
 
+# Whitespace between JSON values, as skipped by the json module
+json_ws = re.compile(r'[ \t\n\r]*')
+json_delims = ' \t\n\r,]'
+
+def iter_json_array(fh, chunk_size=1048576):
+    """
+    Yield the items of a top-level JSON array one at a time, reading the
+    file in fixed size chunks. Only the current chunk and the items decoded
+    from it are held in memory, not the whole file. All of the complete
+    objects in a chunk are decoded with one json.loads() call where we can,
+    which is faster and shares dict keys between items, and one at a time
+    where we can't.
+    :param fh: File handle, positioned before the opening '['
+    :param chunk_size: Number of characters to read at a time
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    # Where we are in the array: before the '[', before the first item,
+    # before any other item or between an item and the next ',' or ']'
+    state = 'start'
+    while True:
+        pos = json_ws.match(buf, pos).end()
+        # Need more data to see the next token
+        if pos >= len(buf):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            buf = fh.read(chunk_size)
+            pos = 0
+            eof = len(buf) == 0
+            continue
+        c = buf[pos]
+        if state == 'start':
+            if c != '[':
+                raise ValueError("Expected a JSON array, found '{}'".format(c))
+            state = 'first'
+            pos += 1
+            continue
+        if state == 'sep' or (state == 'first' and c == ']'):
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError("Expected ',' or ']' in JSON array, found '{}'".format(c))
+            state = 'item'
+            pos += 1
+            continue
+        # Look for the last object in the buffer that is followed by a
+        # comma. If everything up to it decodes as a list, we have found
+        # a boundary between items that isn't inside a string or object.
+        cut = buf.rfind('},', pos)
+        tries = 0
+        while cut > pos and tries < 3:
+            try:
+                items = json.loads('[' + buf[pos:cut+1] + ']')
+            except ValueError:
+                cut = buf.rfind('},', pos, cut)
+                tries += 1
+                continue
+            for item in items:
+                yield item
+            items = None
+            pos = cut + 1
+            state = 'sep'
+            break
+        if state == 'sep':
+            continue
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+            # A number at the end of the buffer may carry on in the next chunk
+            if not eof and (end == len(buf) or buf[end] not in json_delims):
+                raise ValueError("Item may continue in the next chunk")
+        except ValueError:
+            if eof:
+                raise
+            chunk = fh.read(chunk_size)
+            eof = len(chunk) == 0
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+        pos = end
+        state = 'sep'
+
+# Ring sizes with a section of their own. Text files have no ring size.
+ring_sections = OrderedDict([('5', 'five'), ('6', 'six'), ('7', 'seven'), ('8', 'eight'), ('macro', 'macro')])
+unsized_ring = 'unsized'
+
+def new_frames():
+    """ Empty columnar store for the frames of one Tessellate file. Each
+    ring size gets compact arrays of the frame index (position in the
+    file), numeric pucker ID, conformer code and PDB ID code. The codes
+    index the 'conformers' and 'pdbids' lookup tables. """
+    return {
+        'input_format': None,
+        'conformers': [],
+        'conformer_codes': {},
+        'pdbids': [],
+        'pdbid_codes': {},
+        'rings': OrderedDict()
+    }
+
+def add_frame(frames, idx, ring, conformer, numeric=None, pdbid=None):
+    """ Add one frame to a columnar store from new_frames() """
+    try:
+        cols = frames['rings'][ring]
+    except KeyError:
+        cols = frames['rings'][ring] = {
+            'frame': array('l'),
+            'numeric': array('d'),
+            'conformer': array('i'),
+            'pdbid': array('i')
+        }
+    try:
+        code = frames['conformer_codes'][conformer]
+    except KeyError:
+        code = frames['conformer_codes'][conformer] = len(frames['conformers'])
+        frames['conformers'].append(conformer)
+    try:
+        pcode = frames['pdbid_codes'][pdbid]
+    except KeyError:
+        pcode = frames['pdbid_codes'][pdbid] = len(frames['pdbids'])
+        frames['pdbids'].append(pdbid)
+    try:
+        numeric = float(numeric)
+    except (TypeError, ValueError):
+        numeric = np.nan
+    cols['frame'].append(idx)
+    cols['numeric'].append(numeric)
+    cols['conformer'].append(code)
+    cols['pdbid'].append(pcode)
+
+def add_frames(frames, idx, ring, names, codes, numerics):
+    """ Add a batch of frames of one ring size to a columnar store from
+    new_frames(), without a Python call per frame
+    :param idx: frame index of the first frame
+    :param names: conformer names of the batch, in order of first appearance
+    :param codes: NumPy array of the conformer of each frame, as an index of names
+    :param numerics: NumPy array of numeric pucker IDs, NaN if missing
+    """
+    if len(codes) == 0:
+        return
+    try:
+        cols = frames['rings'][ring]
+    except KeyError:
+        cols = frames['rings'][ring] = {
+            'frame': array('l'),
+            'numeric': array('d'),
+            'conformer': array('i'),
+            'pdbid': array('i')
+        }
+    for name in names:
+        if name not in frames['conformer_codes']:
+            frames['conformer_codes'][name] = len(frames['conformers'])
+            frames['conformers'].append(name)
+    if None not in frames['pdbid_codes']:
+        frames['pdbid_codes'][None] = len(frames['pdbids'])
+        frames['pdbids'].append(None)
+    to_global = np.array([ frames['conformer_codes'][name] for name in names ], dtype=np.int64)
+    #. the array typecodes are also NumPy dtypes, so each batch is copied in as raw bytes
+    for col, values in [
+            ('frame', np.arange(idx, idx + len(codes))),
+            ('numeric', numerics),
+            ('conformer', to_global[codes]),
+            ('pdbid', np.full(len(codes), frames['pdbid_codes'][None]))]:
+        from_bytes = getattr(cols[col], 'frombytes', None) or cols[col].fromstring # Python 2
+        from_bytes(values.astype(cols[col].typecode).tobytes())
+
+def to_float(value):
+    """ Float from a string, NaN if it isn't a number """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+# One line of a Tessellate text file: a label, then the conformer and numeric
+# pucker ID as they appear in a Python tuple, eg. 12 ('4C1', 3)
+txt_frame_re = re.compile(br"^[^ \n]* +['(,]*([^ \n'(),]*)[^ \n]*(?: +['(,]*([^ \n'(),]*))?[^\n]*$", re.M)
+
+def iter_txt_frames(fh, chunk_size=4194304):
+    """ Read the frames of a Tessellate text file, one large chunk at a time
+    :param fh: binary file handle, after the header line
+    :return: generator of (conformer names, conformer codes, numerics), see txt_frames()
+    """
+    rest = b''
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        cut = chunk.rfind(b'\n') + 1
+        rest = chunk[cut:]
+        if cut > 0:
+            yield txt_frames(chunk[:cut])
+    if rest:
+        yield txt_frames(rest + b'\n')
+
+def txt_frames(block):
+    """ Conformers and numeric pucker IDs of the lines in a block of text.
+    When every line is exactly three tokens separated by single spaces,
+    which is what Tessellate writes, the tokens are found with NumPy on
+    the bytes of the whole block. Anything else goes through the regex.
+    :param block: bytes, whole lines ending with a newline
+    :return: (conformer names in order of first appearance, NumPy array of
+             conformer codes as an index of names, NumPy array of numerics)
+    """
+    stripped = block.translate(None, b"'(),")
+    b = np.frombuffer(stripped, dtype=np.uint8)
+    #. every whitespace byte must be a space, space, newline for each line, with no two together
+    seps = np.flatnonzero(b < 33)
+    if len(seps) % 3 == 0 and len(seps) > 0 and seps[0] > 0 and b.max() < 128 \
+            and np.all(np.diff(seps) > 1) \
+            and np.all(b[seps].reshape(-1, 3) == np.array([32, 32, 10], dtype=np.uint8)):
+        seps = seps.reshape(-1, 3)
+        #. pad so that gathering past the end of the last token stays inside the array
+        b = np.concatenate((b, np.zeros(32, dtype=np.uint8)))
+        conformers = txt_field(b, seps[:, 0] + 1, seps[:, 1])
+        numerics = txt_field(b, seps[:, 1] + 1, seps[:, 2])
+        if conformers is not None and numerics is not None:
+            first, codes = first_seen_codes(field_keys(conformers))
+            names = [ conformers[i].tobytes().rstrip(b'\0').decode('utf-8', 'replace') for i in first ]
+            return names, codes, field_numbers(numerics)
+    found = txt_frame_re.findall(block)
+    local = OrderedDict()
+    codes = np.array([ local.setdefault(c, len(local)) for c, n in found ], dtype=np.int64)
+    numerics = np.array([ to_float(n) for c, n in found ], dtype=np.float64)
+    return [ n.decode('utf-8', 'replace') for n in local ], codes, numerics
+
+def txt_field(b, starts, ends, max_width=32):
+    """ Gather one token from each line into a 2D array of bytes, padded with zeros
+    :param b: NumPy uint8 array of the text, with max_width zeros after the end
+    :return: n x width uint8 array, or None if a token is longer than max_width
+    """
+    width = int((ends - starts).max())
+    if width > max_width:
+        return None
+    idx = starts[:, None] + np.arange(width)
+    return b[idx] * (idx < ends[:, None])
+
+def field_keys(field):
+    """ One comparable value per row of a field from txt_field(): a
+    64 bit integer if the tokens are short enough, else a bytes string """
+    if field.shape[1] <= 8:
+        padded = np.zeros((len(field), 8), dtype=np.uint8)
+        padded[:, :field.shape[1]] = field
+        return padded.view(np.uint64).ravel()
+    return np.ascontiguousarray(field).view('S{}'.format(field.shape[1])).ravel()
+
+def field_numbers(field):
+    """ Numbers from a field from txt_field(). Whole numbers are worked out
+    digit by digit with NumPy, anything else is parsed one value at a time. """
+    digits = field - np.uint8(48)
+    present = field > 0
+    if field.shape[1] <= 15 and np.all(present[:, 0]) and np.all((digits <= 9) | ~present):
+        values = np.zeros(len(field), dtype=np.int64)
+        for col in range(field.shape[1]):
+            values = np.where(present[:, col], values * 10 + digits[:, col], values)
+        return values.astype(np.float64)
+    values = np.ascontiguousarray(field).view('S{}'.format(field.shape[1])).ravel()
+    try:
+        return values.astype(np.float64)
+    except ValueError:
+        return np.array([ to_float(v) for v in values.tolist() ])
+
+def first_seen_codes(values, max_distinct=64):
+    """ Codes for the distinct values of an array, in order of first appearance.
+    One pass over the array for each distinct value, which for the handful of
+    conformers in a file is faster than sorting.
+    :return: (list of the position of the first of each distinct value, NumPy array of codes)
+    """
+    codes = np.full(len(values), -1, dtype=np.int64)
+    first = []
+    pos = 0
+    while len(first) < max_distinct:
+        #. the next value without a code is usually close by
+        todo = np.flatnonzero(codes[pos:pos+4096] < 0)
+        if len(todo) == 0:
+            todo = np.flatnonzero(codes[pos:] < 0)
+            if len(todo) == 0:
+                return first, codes
+        pos += int(todo[0])
+        codes[values == values[pos]] = len(first)
+        first.append(pos)
+    uniq, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return first[order].tolist(), rank[inverse.ravel()]
+
+def finish_frames(frames):
+    """ Turn the arrays of a columnar store into NumPy arrays, drop the
+    code lookups that were only needed while parsing and add a colour
+    for every conformer """
+    for ring, cols in frames['rings'].items():
+        frames['rings'][ring] = {
+            'frame': np.array(cols['frame'], dtype=np.int64),
+            'numeric': np.array(cols['numeric'], dtype=np.float64),
+            'conformer': np.array(cols['conformer'], dtype=np.int32),
+            'pdbid': np.array(cols['pdbid'], dtype=np.int32)
+        }
+    del frames['conformer_codes']
+    del frames['pdbid_codes']
+    frames['colours'] = [ conformer_colour(c) for c in frames['conformers'] ]
+    return frames
+
+def conformer_colour(conformer):
+    """ Colour for a conformer, from the colorbrewer2.org 5-class Set3
+    qualitative scheme, by the family of the canonical conformer """
+    if 'E' in conformer:
+        return "#8dd3c7"
+    elif 'T' in conformer:
+        return "#ffffb3"
+    elif 'UAP' in conformer:
+        return "#bebada"
+    elif 'P' in conformer:
+        return "#fb8072"
+    return "#80b1d3"
+
+def first_seen_counts(codes):
+    """ Count each distinct code, in the order that they first appear
+    :return: list of (code, count) tuples
+    """
+    if len(codes) == 0:
+        return []
+    #. a few small codes in a long array, eg. the conformers of a trajectory:
+    #. count them and find the first of each without sorting
+    if len(codes) > 65536 and codes.min() >= 0 and codes.max() < 1024:
+        counts = np.bincount(codes)
+        uniq = np.flatnonzero(counts)
+        if len(uniq) <= 64:
+            first = np.array([ np.argmax(codes == code) for code in uniq ])
+            order = np.argsort(first, kind='mergesort')
+            return list(zip(uniq[order].tolist(), counts[uniq][order].tolist()))
+    uniq, first, counts = np.unique(codes, return_index=True, return_counts=True)
+    order = np.argsort(first)
+    return list(zip(uniq[order].tolist(), counts[order].tolist()))
+
+def conformer_counts(frames, rings):
+    """ Count the frames of each conformer across some ring sizes
+    :return: dict of conformer: count, in order of first appearance
+    """
+    cols = [ frames['rings'][r] for r in rings if r in frames['rings'] ]
+    if len(cols) == 0:
+        return {}
+    codes = np.concatenate([ c['conformer'] for c in cols ])
+    if len(cols) > 1:
+        # Back in file order, so that the conformers are in the same order as they were seen
+        codes = codes[np.argsort(np.concatenate([ c['frame'] for c in cols ]), kind='mergesort')]
+    names = frames['conformers']
+    return dict([ (names[code], n) for code, n in first_seen_counts(codes) ])
+
+def pdbid_conformer_matrix(frames, ring):
+    """ Count the frames of each conformer for each PDB ID in one ring size,
+    as a sparse matrix with rows for PDB IDs and columns for conformers
+    :return: dict with the 'pdbids' and 'conformers' that the row and column
+             numbers index, and NumPy arrays of the 'row', 'col' and 'count' of
+             each non-zero entry, in order of first appearance. None if there
+             are no frames with a PDB ID for this ring size.
+    """
+    if ring not in frames['rings']:
+        return None
+    cols = frames['rings'][ring]
+    #. frames without a PDB ID don't get a row
+    known = np.array([ pdbid is not None for pdbid in frames['pdbids'] ], dtype=bool)
+    pdbid = cols['pdbid'].astype(np.int64)
+    keep = known[pdbid] if len(known) > 0 else np.zeros(len(pdbid), dtype=bool)
+    if not keep.any():
+        return None
+    nconf = max(len(frames['conformers']), 1)
+    pairs = pdbid[keep] * nconf + cols['conformer'][keep]
+    found = first_seen_counts(pairs)
+    pairs = np.array([ pair for pair, n in found ], dtype=np.int64)
+    return {
+        'pdbids': frames['pdbids'],
+        'conformers': frames['conformers'],
+        'row': pairs // nconf,
+        'col': pairs % nconf,
+        'count': np.array([ n for pair, n in found ], dtype=np.int64)
+    }
+
+def merge_pdbid_matrices(pieces):
+    """ Join the PDB ID x conformer matrices of several samples into one,
+    with a row for each sample and PDB ID, named <s_name>_<pdbid>
+    :param pieces: list of (s_name, matrix from pdbid_conformer_matrix())
+    :return: dict with the 'rows' and 'conformers' names, and NumPy arrays of
+             the 'row', 'col' and 'count' of each non-zero entry
+    """
+    rows = OrderedDict()
+    conformers = OrderedDict()
+    row, col, count = [], [], []
+    for s_name, m in pieces:
+        row_codes = dict()
+        for r in m['row'].tolist():
+            if r not in row_codes:
+                row_codes[r] = rows.setdefault("_".join([s_name, str(m['pdbids'][r])]), len(rows))
+        col_codes = dict([ (c, conformers.setdefault(m['conformers'][c], len(conformers))) for c in set(m['col'].tolist()) ])
+        row.append(np.array([ row_codes[r] for r in m['row'].tolist() ], dtype=np.int64))
+        col.append(np.array([ col_codes[c] for c in m['col'].tolist() ], dtype=np.int64))
+        count.append(m['count'])
+    return {
+        'rows': list(rows.keys()),
+        'conformers': list(conformers.keys()),
+        'row': np.concatenate(row) if len(row) > 0 else np.zeros(0, dtype=np.int64),
+        'col': np.concatenate(col) if len(col) > 0 else np.zeros(0, dtype=np.int64),
+        'count': np.concatenate(count) if len(count) > 0 else np.zeros(0, dtype=np.int64)
+    }
+
+def pdbid_summary(matrix, rank='abundance'):
+    """ Per row numbers for a matrix from merge_pdbid_matrices(), without
+    making it dense: the number of rings, the number of distinct conformers,
+    the fraction of rings in the most common conformer and a score to rank by.
+    The score is the number of rings for 'abundance', or the variance of the
+    conformer fractions for 'variance', which is highest for PDB IDs with
+    most of their rings in one conformer.
+    :return: dict of NumPy arrays, one value per row
+    """
+    nrows = len(matrix['rows'])
+    nconf = max(len(matrix['conformers']), 1)
+    row, count = matrix['row'], matrix['count']
+    rings = np.bincount(row, weights=count, minlength=nrows)
+    #. rows can have more than one entry for a conformer if sample names and PDB IDs clash
+    cells = np.unique(row * nconf + matrix['col'], return_inverse=True)
+    cell_counts = np.bincount(cells[1].ravel(), weights=count)
+    cell_rows = cells[0] // nconf
+    fractions = cell_counts / rings[cell_rows]
+    top_fraction = np.zeros(nrows)
+    np.maximum.at(top_fraction, cell_rows, fractions)
+    summary = {
+        'rings': rings,
+        'conformers': np.bincount(cell_rows, minlength=nrows),
+        'top_fraction': top_fraction,
+    }
+    if rank == 'variance':
+        #. fractions sum to 1, so their mean is 1 / nconf
+        summary['score'] = np.bincount(cell_rows, weights=fractions ** 2, minlength=nrows) / nconf - (1.0 / nconf) ** 2
+    else:
+        summary['score'] = rings
+    return summary
+
+def conformer_populations(frames, ring, window=None, stride=None, max_points=500):
+    """ Fraction of frames in each conformer over a sliding window, for
+    one ring size of a sample, in sequence order. Counts in each window
+    are differences of the cumulative count of the conformer, so the cost
+    doesn't depend on the window size.
+    :param window: frames per window. Default is enough to give max_points windows
+    :param stride: frames between the starts of windows. Default is the window size.
+                   Made bigger if needed to keep to max_points windows.
+    :return: (window centres, OrderedDict of conformer: fractions), or None
+             if there are no frames for this ring size
+    """
+    if ring not in frames['rings'] or len(frames['rings'][ring]['conformer']) == 0:
+        return None
+    codes = frames['rings'][ring]['conformer']
+    n = len(codes)
+    if window is None:
+        window = -(-n // max_points)
+    window = max(1, min(int(window), n))
+    if stride is None:
+        stride = window
+    stride = max(1, int(stride), -(-(n - window + 1) // max_points))
+    starts = np.arange(0, n - window + 1, stride)
+    ends = starts + window
+    populations = OrderedDict()
+    for code, count in first_seen_counts(codes):
+        cumulative = np.concatenate(([0], np.cumsum(codes == code, dtype=np.int64)))
+        populations[frames['conformers'][code]] = (cumulative[ends] - cumulative[starts]) / float(window)
+    return starts + (window - 1) / 2.0, populations
+
+def ring_transitions(frames, ring):
+    """ Transition counts and dwell times for one ring size of a sample,
+    from the sequence of conformers in file order. Runs of the same
+    conformer are found by run-length encoding, so only changes of
+    conformer count as transitions and time spent in a conformer shows
+    up in the dwell times instead.
+    :return: dict with the conformers seen, in order of first appearance,
+             the matrix of transition counts (from row to column conformer),
+             the number of runs of each conformer and their mean length in
+             frames. None if there are no frames for this ring size.
+    """
+    if ring not in frames['rings'] or len(frames['rings'][ring]['conformer']) == 0:
+        return None
+    codes = frames['rings'][ring]['conformer']
+    seen = [ code for code, n in first_seen_counts(codes) ]
+    n = len(seen)
+    local = np.zeros(len(frames['conformers']), dtype=np.int64)
+    local[seen] = np.arange(n)
+    codes = local[codes]
+
+    # Run-length encode the sequence
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    run_codes = codes[starts]
+    run_lengths = np.diff(np.append(starts, len(codes)))
+
+    transitions = np.bincount(run_codes[:-1] * n + run_codes[1:], minlength=n * n).reshape(n, n)
+    runs = np.bincount(run_codes, minlength=n)
+    dwell = np.bincount(run_codes, weights=run_lengths, minlength=n) / runs
+    return {
+        'conformers': [ frames['conformers'][code] for code in seen ],
+        'transitions': transitions,
+        'runs': runs,
+        'dwell': dwell
+    }
+
+
+# Change this when the parsed frames or counts change, so that old cache entries aren't used
+parser_version = 2
+
+def parse_tessellate_file(path, c_dir=None):
+    """ Parse one Tessellate file and count its conformers, or load it from
+    the cache if it has been parsed before. A plain function of its arguments,
+    so that it can run in a worker process: workers started with 'spawn' or
+    'forkserver' don't see the config that was loaded in the main process.
+    :param c_dir: Cache directory, see cache_dir(), or None to not cache
+    :return: dict with the frames, see new_frames(), the conformer counts for
+             each section, a PDB ID x conformer matrix for each section and
+             whether it came from the cache. None if the file couldn't be read.
+    """
+    key = None
+    if c_dir is not None:
+        key = cache_key(path)
+        result = load_cached(c_dir, key)
+        if result is not None:
+            return result
+    result = read_tessellate_file(path)
+    if result is not None and key is not None:
+        save_cached(c_dir, key, result)
+    return result
+
+def read_tessellate_file(path):
+    """ Parse one Tessellate file and count its conformers, see parse_tessellate_file() """
+    frames = new_frames()
+    fileformat = None
+    try:
+        #. gzip, bzip2 and xz files are decompressed as they are read
+        with util_functions.open_file(path) as fh:
+            #. json file example
+            firstline = fh.readline().split() # check the format
+            if len(firstline)==3:
+                _,tessellate_version,fileformat = firstline
+            elif len(firstline)==4:
+                _,tessellate_version,fileformat,input_format = firstline
+                frames['input_format'] = input_format
+            else:
+                log.debug("Unable to read firstline of file")
+            if fileformat=="json":
+                #. stream the json list one frame at a time, so that the whole file is never in memory
+                for idx, itm in enumerate(iter_json_array(fh)):
+                    macro=None
+                    try:
+                        macro=itm["macro"]
+                    except:
+                        pass
+                    #. no per-frame debug logging - trajectories can have millions of frames
+                    ring = 'macro' if macro else str(itm["ringsize"])
+                    add_frame(frames, idx, ring, itm["conformer"], itm["numeric"], itm["pdbid"])
+        if fileformat=="txt":
+            idx = 0
+            #. read as bytes in large blocks, no ring size in text files
+            with util_functions.open_file(path, 'rb') as fh:
+                fh.readline()
+                for names, codes, numerics in iter_txt_frames(fh):
+                    add_frames(frames, idx, unsized_ring, names, codes, numerics)
+                    idx += len(codes)
+        elif fileformat!="json":
+            log.error("Unknown input file format %s",fileformat)
+    except util_functions.decompress_errors + (UnicodeDecodeError,) as e:
+        log.debug("Couldn't read {}: {}".format(path, e))
+        return None
+
+    finish_frames(frames)
+    counts = { 'all': conformer_counts(frames, [ r for r in frames['rings'] if r != 'macro' ]) }
+    pdbid_matrices = dict()
+    for ring, section in ring_sections.items():
+        counts[section] = conformer_counts(frames, [ring])
+        pdbid_matrices[section] = pdbid_conformer_matrix(frames, ring)
+    return { 'frames': frames, 'counts': counts, 'pdbid_matrices': pdbid_matrices, 'cached': False }
+
+def cache_dir():
+    """ Directory to cache parsed files in, from montage_tessellate_config: cache_dir """
+    d = getattr(config, 'montage_tessellate_config', {}).get('cache_dir')
+    if d is None:
+        return None
+    return os.path.expanduser(d)
+
+def cache_key(path):
+    """ Hash of everything that says whether a file has changed since it was cached """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    mtime = getattr(st, 'st_mtime_ns', repr(st.st_mtime))
+    return hashlib.sha1(json.dumps([path, st.st_size, mtime, parser_version]).encode('utf-8')).hexdigest()
+
+def save_cached(c_dir, key, result):
+    """ Save a parsed file to the cache as a NumPy .npz file. The columns of
+    each ring size and the PDB ID matrices go into one block of bytes, as each
+    array in an .npz file has a cost to load, with the lookup tables, counts
+    and where each array starts as JSON """
+    frames = result['frames']
+    arrays = OrderedDict()
+    for ring, cols in frames['rings'].items():
+        for col, values in cols.items():
+            arrays['ring_{}_{}'.format(ring, col)] = values
+    for section, matrix in result['pdbid_matrices'].items():
+        if matrix is not None:
+            for k in ['row', 'col', 'count']:
+                arrays['pdbid_{}_{}'.format(section, k)] = matrix[k]
+    meta = {
+        'input_format': frames['input_format'],
+        'conformers': frames['conformers'],
+        'pdbids': frames['pdbids'],
+        'colours': frames['colours'],
+        'rings': list(frames['rings'].keys()),
+        'counts': dict([ (section, list(counts.items())) for section, counts in result['counts'].items() ]),
+        'pdbid_sections': [ section for section, matrix in result['pdbid_matrices'].items() if matrix is not None ],
+        'arrays': [ [name, values.dtype.str, len(values)] for name, values in arrays.items() ],
+    }
+    try:
+        if not os.path.exists(c_dir):
+            os.makedirs(c_dir)
+        c_fn = os.path.join(c_dir, '{}.npz'.format(key))
+        # Write to a temporary name first, so that other runs never see half a file
+        tmp_fn = '{}.{}.tmp'.format(c_fn, os.getpid())
+        with io.open(tmp_fn, 'wb') as fh:
+            np.savez(fh, meta=np.array(json.dumps(meta)),
+                data=np.frombuffer(b''.join([ np.ascontiguousarray(v).tobytes() for v in arrays.values() ]), dtype=np.uint8))
+        os.rename(tmp_fn, c_fn)
+    except (OSError, IOError) as e:
+        log.debug("Could not save Tessellate file to the cache: {}".format(e))
+
+def load_cached(c_dir, key):
+    """ Load a parsed file from the cache
+    :return: the same as parse_tessellate_file(), or None if it isn't cached
+    """
+    c_fn = os.path.join(c_dir, '{}.npz'.format(key))
+    if not os.path.isfile(c_fn):
+        return None
+    try:
+        with np.load(c_fn, allow_pickle=False) as npz:
+            meta = json.loads(str(npz['meta']), object_pairs_hook=OrderedDict)
+            data = npz['data']
+        arrays = dict()
+        offset = 0
+        for name, dtype, length in meta['arrays']:
+            arrays[name] = np.frombuffer(data, dtype=dtype, count=length, offset=offset)
+            offset += arrays[name].nbytes
+        frames = {
+            'input_format': meta['input_format'],
+            'conformers': meta['conformers'],
+            'pdbids': meta['pdbids'],
+            'rings': OrderedDict([ (ring, dict([ (col, arrays['ring_{}_{}'.format(ring, col)])
+                for col in ['frame', 'numeric', 'conformer', 'pdbid'] ])) for ring in meta['rings'] ]),
+            'colours': meta['colours']
+        }
+        pdbid_matrices = dict([ (section, None) for section in ring_sections.values() ])
+        for section in meta['pdbid_sections']:
+            pdbid_matrices[section] = {
+                'pdbids': frames['pdbids'],
+                'conformers': frames['conformers'],
+                'row': arrays['pdbid_{}_row'.format(section)],
+                'col': arrays['pdbid_{}_col'.format(section)],
+                'count': arrays['pdbid_{}_count'.format(section)]
+            }
+        # Touch the entry so that eviction drops the least recently used first
+        os.utime(c_fn, None)
+    except Exception as e:
+        log.debug("Could not read Tessellate file from the cache: {}".format(e))
+        return None
+    counts = dict([ (section, dict(items)) for section, items in meta['counts'].items() ])
+    return { 'frames': frames, 'counts': counts, 'pdbid_matrices': pdbid_matrices, 'cached': True }
+
+# Cache entries, and the temporary files they are written to. Nothing else in
+# the cache directory is touched, in case it is shared with other files.
+cache_entry_re = re.compile(r'^[0-9a-f]{40}\.npz$')
+cache_tmp_re = re.compile(r'^[0-9a-f]{40}\.npz\.\d+\.tmp$')
+
+# Temporary files older than this (seconds) were left by a run that died
+stale_tmp_age = 6 * 60 * 60
+
+def tidy_cache(c_dir, max_size=1000000000):
+    """ Evict the least recently used entries until the cache fits within
+    max_size bytes, and remove temporary files left behind by runs that died.
+    Temporary files that other processes may still be writing are left alone.
+    """
+    if c_dir is None or not os.path.isdir(c_dir):
+        return
+    entries = list()
+    now = time.time()
+    for fn in os.listdir(c_dir):
+        path = os.path.join(c_dir, fn)
+        try:
+            st = os.stat(path)
+            if cache_tmp_re.match(fn) and now - st.st_mtime > stale_tmp_age:
+                os.remove(path)
+            elif cache_entry_re.match(fn):
+                entries.append( (st.st_mtime, st.st_size, path) )
+        except OSError:
+            continue
+    total_size = sum([ e[1] for e in entries ])
+    if max_size is None or total_size <= max_size:
+        return
+    num_removed = 0
+    for mtime, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+            num_removed += 1
+        except OSError:
+            pass
+    log.debug("Removed {} old files from the Tessellate cache".format(num_removed))
+
+def parse_tessellate_files(paths, processes=1, c_dir=None):
+    """ Parse Tessellate files, in a pool of worker processes if processes > 1.
+    Everything the workers need is passed to them, not read from the config.
+    :param c_dir: Cache directory, see cache_dir(), or None to not cache
+    :return: generator of the results of parse_tessellate_file(), in the order of paths
+    """
+    parse = functools.partial(parse_tessellate_file, c_dir=c_dir)
+    processes = min(processes, len(paths))
+    pool = None
+    if processes > 1:
+        try:
+            pool = multiprocessing.Pool(processes)
+        except Exception as e:
+            log.warning("Could not start processes to parse Tessellate files, parsing them one at a time: {}".format(e))
+    if pool is None:
+        for path in paths:
+            yield parse(path)
+        return
+    try:
+        #. several small files to a worker at a time, in order
+        for result in pool.imap(parse, paths, chunksize=max(1, len(paths) // (processes * 8))):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 class MultiqcModule(BaseMultiqcModule):
     """Tessellate module """
 
@@ -25,39 +773,75 @@ class MultiqcModule(BaseMultiqcModule):
         href="https://github.com/scientificomputing/tessellate",
         info="A program for tesselating ring cycles, identifying conformations from coordinates and molecular trajectories")
 
-        # Set up data structure
-        #self.comp_tessellate_data = dict()
+        # Set up data structure. Frames are held column by column in
+        # self.tessellate_frames, and the counts are worked out from them.
+        self.tessellate_frames = OrderedDict()
         self.comp_tessellate_data = {
             'five': {},
             'six': {},
             'seven': {},
             'eight': {},
             'macro': {},
-            'five_numeric': {},#. TODO BUGFIX data duplication and code whiff to be removed 
-            'six_numeric': {},#. TODO BUGFIX data duplication and code whiff to be removed 
-            'seven_numeric': {},#. TODO BUGFIX data duplication and code whiff to be removed 
-            'eight_numeric': {},#. TODO BUGFIX data duplication and code whiff to be removed
-            'all': {}, #. TODO BUGFIX data duplication and code whiff to be removed
-            'all_json': {} #TODO BUGFIX data duplication and code whiff to be removed 
+            'all': {}
         }
 
 
-        #. decide whether to create subsamples based on pdbid (bad idea for timeseries, good idea for PDB structures)
-        self.subsamples=False
+        #. PDB IDs are grouped into one sparse matrix per ring size, unless they should be samples of their own
+        tess_config = getattr(config, 'montage_tessellate_config', {})
+        self.pdbid_mode = tess_config.get('pdbid_mode', 'grouped')
+        self.pdbid_matrices = dict([ (section, []) for section in ring_sections.values() ])
+        #. the sample that each PDB ID subsample came from
+        self.subsample_parents = dict()
 
-        for f in self.find_log_files('montage_tessellate', filehandles=True):
-            self.parse_comp_tessellate_log(f)
+        #. parse the files in worker processes, then add them in the order they were found
+        files = list(self.find_log_files('montage_tessellate', filecontents=False))
+        paths = [ os.path.join(f['root'], f['fn']) for f in files ]
+        num_cached = 0
+        c_dir = cache_dir()
+        results = parse_tessellate_files(paths, processes=tess_config.get('processes', 1), c_dir=c_dir)
+        for result, f in zip(results, files):
+            if result is not None:
+                num_cached += result['cached']
+                self.add_frames_data(f, self.clean_s_name(f['s_name'],f['root']), result)
+        if c_dir is not None:
+            log.info("Tessellate cache: {} hits, {} misses".format(num_cached, len(files) - num_cached))
+            tidy_cache(c_dir, tess_config.get('cache_size', 1000000000))
 
         # Filter to strip out ignored sample names
-        self.comp_tessellate_data = self.ignore_samples(self.comp_tessellate_data)
+        #. the counts are keyed by section, so filter each one, along with
+        #. the PDB ID subsamples and matrix rows of samples that are ignored
+        self.tessellate_frames = self.ignore_samples(self.tessellate_frames)
+        for section, data in self.comp_tessellate_data.items():
+            self.comp_tessellate_data[section] = dict([ (s_name, counts) for s_name, counts in self.ignore_samples(data).items()
+                if self.subsample_parents.get(s_name, s_name) in self.tessellate_frames ])
+        for section, pieces in self.pdbid_matrices.items():
+            self.pdbid_matrices[section] = [ (s_name, matrix) for s_name, matrix in pieces if s_name in self.tessellate_frames ]
 
-        if len(self.comp_tessellate_data) == 0:
+        if len(self.tessellate_frames) == 0:
             raise UserWarning
 
-        log.info("Found {} reports".format(len(self.comp_tessellate_data)))
+        log.info("Found {} reports".format(len(self.tessellate_frames)))
 
         # Write parsed report data to a file
-        self.write_data_file(self.comp_tessellate_data, 'multiqc_comp_tessellate')
+        #. one table of conformer counts for all ring sizes, and one for each ring size
+        self.write_data_file(self.comp_tessellate_data['all'], 'multiqc_comp_tessellate')
+        for section in ring_sections.values():
+            if len(self.comp_tessellate_data[section])>0:
+                self.write_data_file(self.comp_tessellate_data[section], 'multiqc_comp_tessellate_{}'.format(section))
+        #. the frames themselves are written column by column as compact JSON, but not kept for multiqc_data.json
+        if config.data_dir is not None:
+            with io.open(os.path.join(config.data_dir, 'multiqc_comp_tessellate_frames.json'), 'wb') as fh:
+                mqc_json.dump(self.tessellate_frames, fh)
+
+        #. one matrix of PDB ID x conformer counts for each ring size, saved as compact JSON
+        for section in ring_sections.values():
+            self.pdbid_matrices[section] = merge_pdbid_matrices(self.pdbid_matrices[section])
+            if config.data_dir is not None and len(self.pdbid_matrices[section]['rows'])>0:
+                with io.open(os.path.join(config.data_dir, 'multiqc_comp_tessellate_pdbids_{}.json'.format(section)), 'wb') as fh:
+                    mqc_json.dump(self.pdbid_matrices[section], fh)
+
+        #. how rings move between conformers, for trajectories
+        self.tessellate_transitions = self.comp_tessellate_transition_data()
 
         # Simple Time Series Plot
         if len(self.comp_tessellate_data['all'])>0:
@@ -65,201 +849,61 @@ class MultiqcModule(BaseMultiqcModule):
         if len(self.comp_tessellate_data['five'])>0:
             self.comp_tessellate_conformer_chart(ring='five')
             self.comp_tessellate_conformer_scatter(ring='five')
+            self.comp_tessellate_population_plot(ring='five')
+            self.comp_tessellate_transitions_heatmap(ring='five')
+            self.comp_tessellate_dwell_table(ring='five')
+            self.comp_tessellate_pdbid_sections(ring='five')
         if len(self.comp_tessellate_data['six'])>0:
             self.comp_tessellate_conformer_chart(ring='six')
             self.comp_tessellate_conformer_scatter(ring='six')
+            self.comp_tessellate_population_plot(ring='six')
+            self.comp_tessellate_transitions_heatmap(ring='six')
+            self.comp_tessellate_dwell_table(ring='six')
+            self.comp_tessellate_pdbid_sections(ring='six')
         if len(self.comp_tessellate_data['seven'])>0:
             self.comp_tessellate_conformer_chart(ring='seven')
             self.comp_tessellate_conformer_scatter(ring='seven')
+            self.comp_tessellate_population_plot(ring='seven')
+            self.comp_tessellate_transitions_heatmap(ring='seven')
+            self.comp_tessellate_dwell_table(ring='seven')
+            self.comp_tessellate_pdbid_sections(ring='seven')
         if len(self.comp_tessellate_data['eight'])>0:
             self.comp_tessellate_conformer_chart(ring='eight')
             self.comp_tessellate_conformer_scatter(ring='eight')
+            self.comp_tessellate_population_plot(ring='eight')
+            self.comp_tessellate_transitions_heatmap(ring='eight')
+            self.comp_tessellate_dwell_table(ring='eight')
+            self.comp_tessellate_pdbid_sections(ring='eight')
         if len(self.comp_tessellate_data['macro'])>0:
             self.comp_tessellate_conformer_chart(ring='macro')
+            self.comp_tessellate_pdbid_sections(ring='macro')
 
-        #if len(self.comp_tessellate_data['all_json'])>0:
-        #    self.comp_tessellate_conformer_table()
-
-
-    def parse_comp_tessellate_log(self, f):
-        s_name = None
-        conformers={}
-        #numerics_all_size=[]
-        numerics_all_sizes={'5':[],'6':[],'7':[],'8':[],'macro':[]} #duplication to solve quickly, TODO BUGFIX
-        conformers_all_sizes={'5':{},'6':{},'7':{},'8':{},'macro':{}} #duplication to solve quickly, TODO BUGFIX
-        pdb_all_sizes={'5':{},'6':{},'7':{},'8':{},'macro':{}} #duplication to solve quickly, TODO BUGFIX
-
-        s_name = self.clean_s_name(f['s_name'],f['root'])
-        #. json file example
-        import json
-        firstline = f['f'].readline().split() # check the format
-        if len(firstline)==3:
-            _,tessellate_version,fileformat = firstline
-        elif len(firstline)==4:
-            _,tessellate_version,fileformat,input_format = firstline
-            if "pdb" in input_format:
-                self.subsamples=True
-        else:
-            log.debug("Unable to read firstline of file")
-        log.debug("Version %s %s", tessellate_version,fileformat)
-        if fileformat=="txt":
-            if s_name is not None:
-                for l in f['f']:
-                    chunked = l.split(" ")
-                    log.debug(chunked)
-                    if len(chunked)>1:
-                        #TODO improve use a sed or regexp
-                        conformer= chunked[1].strip("'").strip("(").strip("'").strip(",").strip("'")
-                        log.debug(conformer)
-                        try:
-                            if conformer in conformers.keys():
-                                log.debug("Add to conformer %s %s",conformer,conformers.keys())
-                                conformers[conformer]+=1
-                            else: #initialise count to 1 for this conformer
-                                log.debug("Initialise conformer %s %s",conformer,conformers.keys())
-                                conformers[conformer]=1
-                        except Exception as e:
-                            log.debug("Except conformer not included in dictionary %s", conformer)
-                            raise e
-        elif fileformat=="json":
-            all_json_data=json.loads("".join(f['f'].readlines()))
-            log.debug(all_json_data)
-            #. loop over json list
-            for itm in all_json_data:
-                conformer=ringsize=numeric=pdbid=macro=None
-                conformer=itm["conformer"]
-                ringsize=itm["ringsize"]
-                numeric=itm["numeric"]
-                pdbid=itm["pdbid"]
-                try:
-                    macro=itm["macro"]
-                except:
-                    pass
-                try:
-                    #. add data to numerics no matter what
-                    #.. Add a colorbrewer2.org scheme. 5-class Set3 for qualitative
-                    if 'E' in conformer:
-                        ringcolor="#8dd3c7"
-                    elif 'T' in conformer:
-                        ringcolor="#ffffb3"
-                    elif 'UAP' in conformer:
-                        ringcolor="#bebada"
-                    elif 'P' in conformer:
-                        ringcolor="#fb8072"
-                    else:
-                        ringcolor="#80b1d3"
-                    if macro:
-                        numerics_all_sizes['macro'].append({'x':len(numerics_all_sizes[str(ringsize)]),'y':numeric,'name':conformer, 'color':ringcolor})
-#                        if conformer in conformers.keys():
-#                            log.debug("Add to conformer %s %s",conformer,conformers.keys())
-#                            conformers[conformer]+=1
-#                
-#                        else: #initialise count to 1 for this conformer
-#                            log.debug("Initialise conformer %s %s",conformer,conformers.keys())
-#                            conformers[conformer]=1
-                    else:
-                        numerics_all_sizes[str(ringsize)].append({'x':len(numerics_all_sizes[str(ringsize)]),'y':numeric,'name':conformer, 'color':ringcolor})
-                        if conformer in conformers.keys():
-                            log.debug("Add to conformer %s %s",conformer,conformers.keys())
-                            conformers[conformer]+=1
-                
-                        else: #initialise count to 1 for this conformer
-                            log.debug("Initialise conformer %s %s",conformer,conformers.keys())
-                            conformers[conformer]=1
-                    if macro:
-                        if conformer in conformers_all_sizes["macro"].keys():
-                            conformers_all_sizes["macro"][conformer]+=1
-                
-                        else: #initialise count to 1 for this conformer
-                            conformers_all_sizes["macro"][conformer]=1
-                    else:
-                        if conformer in conformers_all_sizes[str(ringsize)].keys():
-                            conformers_all_sizes[str(ringsize)][conformer]+=1
-                
-                        else: #initialise count to 1 for this conformer
-                            conformers_all_sizes[str(ringsize)][conformer]=1
-    
-                    #. stratify by pdbid and start wondering if something like pandas could do this better...
-                    if self.subsamples:
-                        if macro:
-                            if pdbid in pdb_all_sizes['macro'].keys():
-                                if conformer in pdb_all_sizes['macro'][pdbid].keys():
-                                    pdb_all_sizes['macro'][pdbid][conformer]+=1
-                                else:
-                                    pdb_all_sizes['macro'][pdbid][conformer]=1
-                            else:
-                                pdb_all_sizes['macro'][pdbid]={conformer:1}
-                        else:
-                            if pdbid in pdb_all_sizes[str(ringsize)].keys():
-                                if conformer in pdb_all_sizes[str(ringsize)][pdbid].keys():
-                                    pdb_all_sizes[str(ringsize)][pdbid][conformer]+=1
-                                else:
-                                    pdb_all_sizes[str(ringsize)][pdbid][conformer]=1
-                            else:
-                                pdb_all_sizes[str(ringsize)][pdbid]={conformer:1}
-
-                except Exception as e:
-                    log.debug("Except conformer not included in dictionary %s", conformer)
-                    raise e
-        else:
-            log.error("Unknown input file format %s",fileformat)
 
-
-        #. add data to the tessellate section - all json data
-        self.add_data_source(f, section='all_json') #section='mulliken')
-        datadict = {str(idx): dict(key) for idx, key in enumerate(all_json_data)}
-        self.comp_tessellate_data['all_json'][s_name] = datadict
-
-        #. add data to the tessellate section
+    def add_frames_data(self, f, s_name, result):
+        """ Add the frames and conformer counts of a sample, from parse_tessellate_file() """
+        frames = result['frames']
+        self.tessellate_frames[s_name] = frames
+        #. decide whether to create subsamples based on pdbid (bad idea for timeseries, good idea for PDB structures)
+        pdb_scan = frames['input_format'] is not None and "pdb" in frames['input_format']
+        #. add data to the tessellate section - every ring size except macrocycles
         self.add_data_source(f, section='all') #section='mulliken')
-        self.comp_tessellate_data['all'][s_name] = conformers
-        log.debug("Data added for this log: %s",str(self.comp_tessellate_data['all'][s_name]))
-        #. add data to the tessellate 5 section
-        self.add_data_source(f, section='five') #section='mulliken')
-        if len(conformers_all_sizes['5'])>0:
-            self.comp_tessellate_data['five'][s_name] = conformers_all_sizes['5']
-            log.debug("Data added for this log: %s",str(self.comp_tessellate_data['five'][s_name]))
-        #. add data to the tessellate 6 section
-        self.add_data_source(f, section='six') #section='mulliken')
-        if len(conformers_all_sizes['6'])>0:
-            self.comp_tessellate_data['six'][s_name] = conformers_all_sizes['6']
-            log.debug("Data added for this log: %s",str(self.comp_tessellate_data['six'][s_name]))
-        #. add data to the tessellate 7 section
-        self.add_data_source(f, section='seven') #section='mulliken')
-        if len(conformers_all_sizes['7'])>0:
-            self.comp_tessellate_data['seven'][s_name] = conformers_all_sizes['7']
-            log.debug("Data added for this log: %s",str(self.comp_tessellate_data['seven'][s_name]))
-        #. add data to the tessellate 8 section
-        self.add_data_source(f, section='eight') #section='mulliken')
-        if len(conformers_all_sizes['8'])>0:
-            self.comp_tessellate_data['eight'][s_name] = conformers_all_sizes['8']
-            log.debug("Data added for this log: %s",str(self.comp_tessellate_data['eight'][s_name]))
-        if len(conformers_all_sizes['macro'])>0:
-            self.comp_tessellate_data['macro'][s_name] = conformers_all_sizes['macro']
-            log.debug("Data added for this log: %s",str(self.comp_tessellate_data['macro'][s_name]))
-        #. add numerics data for scatter plot
-        self.comp_tessellate_data['five_numeric'][s_name] = numerics_all_sizes['5']
-        self.comp_tessellate_data['six_numeric'][s_name] = numerics_all_sizes['6']
-        self.comp_tessellate_data['seven_numeric'][s_name] = numerics_all_sizes['7']
-        self.comp_tessellate_data['eight_numeric'][s_name] = numerics_all_sizes['8']
-        #. segregate data by pdbid as well....
-        #. loop over all pdb data size and each key
-        if self.subsamples:
-            for pdbkey in pdb_all_sizes['5']:
-                self.comp_tessellate_data['five']["_".join([s_name,pdbkey])] = pdb_all_sizes['5'][pdbkey]
-            for pdbkey in pdb_all_sizes['6']:
-                self.comp_tessellate_data['six']["_".join([s_name,pdbkey])] = pdb_all_sizes['6'][pdbkey]
-            for pdbkey in pdb_all_sizes['7']:
-                self.comp_tessellate_data['seven']["_".join([s_name,pdbkey])] = pdb_all_sizes['7'][pdbkey]
-            for pdbkey in pdb_all_sizes['8']:
-                self.comp_tessellate_data['eight']["_".join([s_name,pdbkey])] = pdb_all_sizes['8'][pdbkey]
-            for pdbkey in pdb_all_sizes['macro']:
-                self.comp_tessellate_data['macro']["_".join([s_name,pdbkey])] = pdb_all_sizes['macro'][pdbkey]
-    
-
-
-        s_name = None
-        conformers = {}
+        self.comp_tessellate_data['all'][s_name] = result['counts']['all']
+        #. add data to the section for each ring size
+        for ring, section in ring_sections.items():
+            if section != 'macro':
+                self.add_data_source(f, section=section)
+            if len(result['counts'][section])>0:
+                self.comp_tessellate_data[section][s_name] = result['counts'][section]
+            #. segregate data by pdbid as well....
+            matrix = result['pdbid_matrices'][section]
+            if pdb_scan and matrix is not None:
+                if self.pdbid_mode == 'samples':
+                    for r, c, n in zip(matrix['row'].tolist(), matrix['col'].tolist(), matrix['count'].tolist()):
+                        pdb_s_name = "_".join([s_name,str(matrix['pdbids'][r])])
+                        self.subsample_parents[pdb_s_name] = s_name
+                        self.comp_tessellate_data[section].setdefault(pdb_s_name, dict())[matrix['conformers'][c]] = n
+                else:
+                    self.pdbid_matrices[section].append( (s_name, matrix) )
 
     def comp_tessellate_timeseries_plot (self):
         """ Make the HighCharts HTML to plot the timeseries """
@@ -272,7 +916,7 @@ class MultiqcModule(BaseMultiqcModule):
         #. For ring pucker the first sample may/may not have all keys. Aggregate keys
         all_pucker_keys_found=[]
         for key in sample_keys:
-            all_pucker_keys_found.extend(list(self.comp_tessellate_data['all'][key].keys()))
+            all_pucker_keys_found.extend([ k for k in self.comp_tessellate_data['all'][key] if k not in all_pucker_keys_found ])
 
         log.debug("All pucker keys: %s", all_pucker_keys_found)
 
@@ -307,7 +951,7 @@ class MultiqcModule(BaseMultiqcModule):
         #. For ring pucker the first sample may/may not have all keys. Aggregate keys
         all_pucker_keys_found=[]
         for key in sample_keys:
-            all_pucker_keys_found.extend(list(self.comp_tessellate_data[ring][key].keys()))
+            all_pucker_keys_found.extend([ k for k in self.comp_tessellate_data[ring][key] if k not in all_pucker_keys_found ])
         log.debug("All pucker keys: %s", all_pucker_keys_found)
 
         for key in all_pucker_keys_found: # get all_keys
@@ -340,12 +984,17 @@ class MultiqcModule(BaseMultiqcModule):
 
     def comp_tessellate_conformer_scatter (self,ring="five",min=0.0,max=2.0):
         """ Make the scatter chart for any ring size"""
-        headers = OrderedDict()
-        ring_key=ring+"_numeric"
-        sample_keys=list(self.comp_tessellate_data[ring_key].keys())
-        log.debug("Sample keys: %s", sample_keys)
-        log.debug("Sample keys: %s", self.comp_tessellate_data[ring_key])
-        #. For ring pucker the first sample may/may not have all keys. Aggregate keys
+        ring_key=[r for r, section in ring_sections.items() if section == ring][0]
+        #. one point per frame, in sequence order within this ring size
+        plot_data = OrderedDict()
+        for s_name, frames in self.tessellate_frames.items():
+            if ring_key not in frames['rings']:
+                continue
+            cols = frames['rings'][ring_key]
+            names = frames['conformers']
+            colours = frames['colours']
+            plot_data[s_name] = [ {'x':x, 'y':y, 'name':names[c], 'color':colours[c]}
+                for x, (y, c) in enumerate(zip(cols['numeric'].tolist(), cols['conformer'].tolist())) ]
         # Config for the plot
         created_title =  'Tessellate: Pucker series for ' + ring
         config = {
@@ -359,41 +1008,223 @@ class MultiqcModule(BaseMultiqcModule):
         self.add_section (
             name = created_name,
             anchor = 'comp_tessellate_count_by_size',
-            plot = scatter.plot(self.comp_tessellate_data[ring_key], config)
+            plot = scatter.plot(plot_data, config)
+        )
+
+    def comp_tessellate_population_plot (self,ring="five"):
+        """ Make the line graph of conformer populations over a sliding window for any ring size.
+        Window size, stride and the maximum number of windows can be set with
+        montage_tessellate_config: population_window, population_stride and
+        population_max_points """
+        ring_key=[r for r, section in ring_sections.items() if section == ring][0]
+        tess_config = getattr(config, 'montage_tessellate_config', {})
+        #. one dataset per sample, with one line per conformer
+        plot_data = []
+        data_labels = []
+        colors = {}
+        for s_name, frames in self.tessellate_frames.items():
+            if frames['input_format'] is not None and 'pdb' in frames['input_format']:
+                continue
+            populations = conformer_populations(frames, ring_key,
+                window = tess_config.get('population_window'),
+                stride = tess_config.get('population_stride'),
+                max_points = tess_config.get('population_max_points', 500))
+            if populations is None:
+                continue
+            x, y = populations
+            plot_data.append({'x': x, 'y': y})
+            data_labels.append({'name': s_name})
+            for conformer in y:
+                colors[conformer] = conformer_colour(conformer)
+        if len(plot_data) == 0:
+            return
+
+        # Config for the plot
+        created_title =  'Tessellate: Conformer populations for ' + ring
+        pconfig = {
+            'id': 'comp_tessellate_populations_{}'.format(ring),
+            'title': created_title,
+            'xlab': 'Time or Sequence order',
+            'ylab': 'Fraction of frames',
+            'ymin': 0,
+            'ymax': 1,
+            'tt_label': '<b>{point.x:.1f}</b>: {point.y:.2f}',
+            'colors': colors,
+            'data_labels': data_labels,
+        }
+        self.add_section (
+            name = ring+' populations',
+            anchor = 'comp_tessellate_populations_{}'.format(ring),
+            description = 'Fraction of frames in each conformer over a sliding window, plotted at the centre of each window.',
+            plot = linegraph.plot(plot_data, pconfig)
         )
 
-    def comp_tessellate_conformer_table (self,min=0.0,max=2.0):
-        """ Make a table of all data """
+    def comp_tessellate_pdbid_sections (self,ring="five"):
+        """ Make the bar chart of the top PDB IDs and the beeswarm of
+        per PDB ID summaries for any ring size. The number of PDB IDs shown and
+        how they are ranked can be set with montage_tessellate_config:
+        pdbid_top_n and pdbid_rank (abundance or variance) """
+        matrix = self.pdbid_matrices.get(ring)
+        if matrix is None or len(matrix['rows']) == 0:
+            return
+        tess_config = getattr(config, 'montage_tessellate_config', {})
+        top_n = tess_config.get('pdbid_top_n', 50)
+        rank = tess_config.get('pdbid_rank', 'abundance')
+        summary = pdbid_summary(matrix, rank)
+
+        #. bar chart of the top PDB IDs, best first
+        top = np.argsort(-summary['score'], kind='mergesort')[:top_n]
+        top_data = OrderedDict([ (matrix['rows'][r], dict()) for r in top.tolist() ])
+        keep = np.isin(matrix['row'], top)
+        for r, c, n in zip(matrix['row'][keep].tolist(), matrix['col'][keep].tolist(), matrix['count'][keep].tolist()):
+            counts = top_data[matrix['rows'][r]]
+            counts[matrix['conformers'][c]] = counts.get(matrix['conformers'][c], 0) + n
+        cats = OrderedDict([ (c, {'name': c, 'color': conformer_colour(c)}) for c in matrix['conformers'] ])
+        pconfig = {
+            'id': 'comp_tessellate_pdbids_{}'.format(ring),
+            'title': 'Tessellate: Top PDB IDs for {} by {}'.format(ring, rank),
+            'ylab': '# Count',
+            'cpswitch_c_active': rank != 'variance',
+        }
+        self.add_section (
+            name = ring+' PDB IDs',
+            anchor = 'comp_tessellate_pdbids_{}'.format(ring),
+            description = 'The {} PDB IDs with the highest {}, of {:,} in total. '
+                'Counts for every PDB ID are saved to <code>multiqc_comp_tessellate_pdbids_{}.json</code>.'.format(
+                len(top), 'number of rings' if rank != 'variance' else 'variance of conformer fractions', len(matrix['rows']), ring),
+            plot = bargraph.plot(top_data, cats, pconfig)
+        )
+
+        #. distributions over all PDB IDs
+        summary_data = OrderedDict()
+        for name, rings, conformers, top_fraction in zip(matrix['rows'], summary['rings'].tolist(),
+                summary['conformers'].tolist(), summary['top_fraction'].tolist()):
+            summary_data[name] = {'rings': rings, 'conformers': conformers, 'top_fraction': top_fraction}
         headers = OrderedDict()
-        sample_keys=list(self.comp_tessellate_data['all_json'].keys())
-        log.debug("Sample keys: %s", sample_keys)
-        log.critical("all_json %s", self.comp_tessellate_data['all_json']) 
+        headers['rings'] = {
+            'title': 'Rings',
+            'description': 'Number of rings in the PDB ID',
+            'format': '{:,.0f}',
+            'min': 0,
+        }
+        headers['conformers'] = {
+            'title': 'Conformers',
+            'description': 'Number of distinct conformers in the PDB ID',
+            'format': '{:,.0f}',
+            'min': 0,
+        }
+        headers['top_fraction'] = {
+            'title': 'Top conformer',
+            'description': 'Fraction of rings in the most common conformer of the PDB ID',
+            'format': '{:,.2f}',
+            'min': 0,
+            'max': 1,
+        }
+        pconfig = {
+            'id': 'comp_tessellate_pdbid_summary_{}'.format(ring),
+            'namespace': 'Tessellate',
+        }
+        self.add_section (
+            name = ring+' PDB ID summary',
+            anchor = 'comp_tessellate_pdbid_summary_{}'.format(ring),
+            description = 'Distributions over all {:,} PDB IDs.'.format(len(matrix['rows'])),
+            plot = beeswarm.plot(summary_data, headers, pconfig)
+        )
 
-        #make an assumption that all json elements have the same headings
-        for key in self.comp_tessellate_data['all_json'][sample_keys[0]].keys(): # hack to get keys from first data set
-            headers[key] = {
-                'title': key,
-                'description': 'Ring pucker data',
-                'suffix': '',
-                'scale': 'Spectral', # 'RdBu',
-                'dmin': min,
-                'dmax': max,
-                'ceiling': max,
-                'floor': min,  # known issue with a negative range
-                'format':'{:,.2f}',
-                'shared_key':'tessellate'
-            }
+    def comp_tessellate_transition_data (self):
+        """ Work out the conformer transitions and dwell times for each
+        sample and ring size, and save them to files. PDB scans are not
+        time series, so are skipped. """
+        transitions = OrderedDict()
+        for ring, section in ring_sections.items():
+            if section == 'macro':
+                continue
+            transitions[section] = OrderedDict()
+            for s_name, frames in self.tessellate_frames.items():
+                if frames['input_format'] is not None and 'pdb' in frames['input_format']:
+                    continue
+                t = ring_transitions(frames, ring)
+                if t is not None:
+                    transitions[section][s_name] = t
 
-        # Config for the plot
-        created_title =  'Tessellate: Pucker table'
+        #. save the transition matrices and the dwell times
+        if any([ len(t)>0 for t in transitions.values() ]):
+            fdata = OrderedDict()
+            for section, samples in transitions.items():
+                for s_name, t in samples.items():
+                    fdata.setdefault(s_name, OrderedDict())[section] = {
+                        'conformers': t['conformers'],
+                        'transitions': t['transitions'].tolist()
+                    }
+            self.write_data_file(fdata, 'multiqc_comp_tessellate_transitions', data_format='json')
+        for section, samples in transitions.items():
+            if len(samples)>0:
+                fdata = OrderedDict()
+                for s_name, t in samples.items():
+                    fdata[s_name] = dict(zip(t['conformers'], t['dwell'].tolist()))
+                self.write_data_file(fdata, 'multiqc_comp_tessellate_dwell_{}'.format(section))
+        return transitions
+
+    def comp_tessellate_transitions_heatmap (self,ring="five"):
+        """ Make the heatmap of conformer transitions for any ring size, summed over samples """
+        samples = self.tessellate_transitions.get(ring, {})
+        if len(samples) == 0:
+            return
+        #. one list of conformers for all samples
+        conformers = []
+        for t in samples.values():
+            conformers.extend([ c for c in t['conformers'] if c not in conformers ])
+        c_idx = dict([ (c, i) for i, c in enumerate(conformers) ])
+        matrix = np.zeros((len(conformers), len(conformers)), dtype=np.int64)
+        for t in samples.values():
+            idx = np.array([ c_idx[c] for c in t['conformers'] ])
+            matrix[np.ix_(idx, idx)] += t['transitions']
+
+        created_title =  'Tessellate: Conformer transitions for ' + ring
         config = {
-            'id': 'comp_tessellate_table',
-            'title': created_title, #'Tessellate: Count of Puckers by size and by canonical conformer',
-            'namespace': 'Tessellate',
+            'id': 'comp_tessellate_transitions_{}'.format(ring),
+            'title': created_title,
+            'xTitle': 'To conformer',
+            'yTitle': 'From conformer',
+            'decimalPlaces': 0,
+            'min': 0,
         }
         self.add_section (
-            name = 'Pucker table',
-            anchor = 'comp_tessellate_table',
-            plot = table.plot(self.comp_tessellate_data['all_json'], headers, config)
+            name = ring+' transitions',
+            anchor = 'comp_tessellate_transitions_{}'.format(ring),
+            description = 'Number of times that a ring changed from one conformer (row) to another (column), '
+                'in sequence order, summed over {} sample{}.'.format(len(samples), '' if len(samples) == 1 else 's'),
+            plot = heatmap.plot(matrix, conformers, conformers, config)
         )
 
+    def comp_tessellate_dwell_table (self,ring="five"):
+        """ Make the table of mean dwell times in each conformer for any ring size """
+        samples = self.tessellate_transitions.get(ring, {})
+        if len(samples) == 0:
+            return
+        headers = OrderedDict()
+        data = OrderedDict()
+        for s_name, t in samples.items():
+            data[s_name] = dict(zip(t['conformers'], t['dwell'].tolist()))
+            for c in t['conformers']:
+                if c not in headers:
+                    headers[c] = {
+                        'title': c,
+                        'description': 'Mean number of frames spent in {} before changing conformer'.format(c),
+                        'scale': 'YlGn',
+                        'format': '{:,.1f}',
+                        'min': 0,
+                    }
+
+        # Config for the table
+        config = {
+            'id': 'comp_tessellate_dwell_{}'.format(ring),
+            'namespace': 'Tessellate',
+            'table_title': 'Tessellate: Dwell times for ' + ring,
+        }
+        self.add_section (
+            name = ring+' dwell times',
+            anchor = 'comp_tessellate_dwell_{}'.format(ring),
+            description = 'Mean length in frames of each run of the same conformer.',
+            plot = table.plot(data, headers, config)
+        )
@@ -12,7 +12,9 @@ import os
 import random
 import sys
 
-from multiqc.utils import config, report, util_functions
+import numpy as np
+
+from multiqc.utils import config, report, util_functions, mpl_pool, plot_cost
 logger = logging.getLogger(__name__)
 
 try:
@@ -73,11 +75,11 @@ def plot (data, cats=None, pconfig=None):
         try:
             cats[idx]
         except (IndexError):
-            cats.append(list())
+            found_cats = OrderedDict()
             for s in data[idx].keys():
                 for k in data[idx][s].keys():
-                    if k not in cats[idx]:
-                        cats[idx].append(k)
+                    found_cats[k] = True
+            cats.append(list(found_cats.keys()))
 
     # If we have cats in lists, turn them into dicts
     for idx, cat in enumerate(cats):
@@ -99,35 +101,28 @@ def plot (data, cats=None, pconfig=None):
             hc_samples = list(d.keys())
         else:
             hc_samples = sorted(list(d.keys()))
-        hc_data = list()
-        sample_dcount = dict()
-        for c in cats[idx].keys():
-            thisdata = list()
-            catcount = 0
-            for s in hc_samples:
-                if s not in sample_dcount:
-                    sample_dcount[s] = 0
-                try:
-                    thisdata.append(float(d[s][c]))
-                    catcount += 1
-                    sample_dcount[s] += 1
-                except (KeyError, ValueError):
-                    # Pad with NaNs when we have missing categories in a sample
-                    thisdata.append(float('nan'))
-            if catcount > 0:
-                if pconfig.get('hide_zero_cats', True) is False or max(x for x in thisdata if not math.isnan(x)) > 0:
-                    thisdict = { 'name': cats[idx][c]['name'], 'data': thisdata }
-                    if 'color' in cats[idx][c]:
-                        thisdict['color'] = cats[idx][c]['color']
-                    hc_data.append(thisdict)
+        cat_keys = list(cats[idx].keys())
+        values = dataset_matrix(d, hc_samples, cat_keys)
+        has_value = ~np.isnan(values)
+
+        # Drop categories with no data, or only zeros if hide_zero_cats is set
+        keep_cats = has_value.any(axis=0)
+        if pconfig.get('hide_zero_cats', True) is not False and len(hc_samples) > 0:
+            keep_cats &= np.where(has_value, values, -np.inf).max(axis=0) > 0
 
         # Remove empty samples
-        for s, c in sample_dcount.items():
-            if c == 0:
-                idx = hc_samples.index(s)
-                del hc_samples[idx]
-                for j, d in enumerate(hc_data):
-                    del hc_data[j]['data'][idx]
+        keep_samples = has_value.any(axis=1)
+        if not keep_samples.all():
+            hc_samples = [ s for s, keep in zip(hc_samples, keep_samples) if keep ]
+            values = values[keep_samples]
+
+        hc_data = list()
+        for j in np.flatnonzero(keep_cats):
+            c = cat_keys[j]
+            thisdict = { 'name': cats[idx][c]['name'], 'data': values[:,j].tolist() }
+            if 'color' in cats[idx][c]:
+                thisdict['color'] = cats[idx][c]['color']
+            hc_data.append(thisdict)
         if len(hc_data) > 0:
             plotsamples.append(hc_samples)
             plotdata.append(hc_data)
@@ -140,7 +135,7 @@ def plot (data, cats=None, pconfig=None):
     try:
         return get_template_mod().bargraph(plotdata, plotsamples, pconfig)
     except (AttributeError, TypeError):
-        if config.plots_force_flat or (not config.plots_force_interactive and len(plotsamples[0]) > config.plots_flat_numseries):
+        if plot_cost.use_flat(pconfig, 'bar_graph', [ (len(samples), len(samples) * len(pdata)) for pdata, samples in zip(plotdata, plotsamples) ]):
             try:
                 return matplotlib_bargraph(plotdata, plotsamples, pconfig)
             except:
@@ -155,6 +150,26 @@ def plot (data, cats=None, pconfig=None):
 
 
 
+def dataset_matrix(d, samples, cat_keys):
+    """ Values of one dataset as a samples x categories float
+    matrix, with NaN for missing or non-numeric values """
+    nan = float('nan')
+    rows = [ [ d[s].get(c, nan) for c in cat_keys ] for s in samples ]
+    try:
+        return np.array(rows, dtype=float).reshape(len(samples), len(cat_keys))
+    except (TypeError, ValueError):
+        # Some values can't be parsed - do them one at a time
+        values = np.full((len(samples), len(cat_keys)), np.nan)
+        for i, row in enumerate(rows):
+            for j, v in enumerate(row):
+                try:
+                    values[i, j] = float(v)
+                except (TypeError, ValueError):
+                    pass
+        return values
+
+
+
 def highcharts_bargraph (plotdata, plotsamples=None, pconfig=None):
     """
     Build the HTML needed for a HighCharts bar graph. Should be
@@ -272,10 +287,6 @@ def matplotlib_bargraph (plotdata, plotsamples, pconfig=None):
           '(see the <a href="http://multiqc.info/docs/#flat--interactive-plots" target="_blank">docs</a>).</small></p>'
     html += '<div class="mqc_mplplot_plotgroup" id="{}">'.format(pconfig['id'])
 
-    # Same defaults as HighCharts for consistency
-    default_colors = ['#7cb5ec', '#434348', '#90ed7d', '#f7a35c', '#8085e9',
-                      '#f15c80', '#e4d354', '#2b908f', '#f45b5b', '#91e8e1']
-
     # Counts / Percentages Switch
     if pconfig.get('cpswitch') is not False and not config.simple_output:
         if pconfig.get('cpswitch_c_active', True) is True:
@@ -342,119 +353,25 @@ def matplotlib_bargraph (plotdata, plotsamples, pconfig=None):
                 if pconfig.get('cpswitch_c_active', True) is not True:
                     hide_plot = True
 
-            # Set up figure
-            plt_height = len(plotsamples[pidx]) / 2.3
-            plt_height = max(6, plt_height) # At least 6" tall
-            plt_height = min(30, plt_height) # Cap at 30" tall
-            bar_width = 0.8
-
-            fig = plt.figure(figsize=(14, plt_height), frameon=False)
-            axes = fig.add_subplot(111)
-            y_ind = range(len(plotsamples[pidx]))
-
-            # Count totals for each sample
-            if plot_pct is True:
-                s_totals = [0 for _ in pdata[0]['data']]
-                for series_idx, d in enumerate(pdata):
-                    for sample_idx, v in enumerate(d['data']):
-                        s_totals[sample_idx] += v
-
-            # Plot bars
-            dlabels = []
-            for idx, d in enumerate(pdata):
-                # Plot percentages
-                values = d['data']
-                if len(values) < len(y_ind):
-                    values.extend([0] * (len(y_ind) - len(values)))
-                if plot_pct is True:
-                    for (key,var) in enumerate(values):
-                        s_total = s_totals[key]
-                        if s_total == 0:
-                            values[key] = 0
-                        else:
-                            values[key] = (float(var+0.0)/float(s_total))*100
-
-                # Get offset for stacked bars
-                if idx == 0:
-                    prevdata = [0] * len(plotsamples[pidx])
-                else:
-                    for i, p in enumerate(prevdata):
-                        prevdata[i] += pdata[idx-1]['data'][i]
-                # Default colour index
-                cidx = idx
-                while cidx >= len(default_colors):
-                    cidx -= len(default_colors)
-                # Save the name of this series
-                dlabels.append(d['name'])
-                # Add the series of bars to the plot
-                axes.barh(
-                    y_ind,
-                    values,
-                    bar_width,
-                    left = prevdata,
-                    color = d.get('color', default_colors[cidx]),
-                    align = 'center',
-                    linewidth = pconfig.get('borderWidth', 0)
-                )
-
-            # Tidy up axes
-            axes.tick_params(labelsize=8, direction='out', left=False, right=False, top=False, bottom=False)
-            axes.set_xlabel(pconfig.get('ylab', '')) # I know, I should fix the fact that the config is switched
-            axes.set_ylabel(pconfig.get('xlab', ''))
-            axes.set_yticks(y_ind) # Specify where to put the labels
-            axes.set_yticklabels(plotsamples[pidx]) # Set y axis sample name labels
-            axes.set_ylim((-0.5, len(y_ind)-0.5)) # Reduce padding around plot area
-            if plot_pct is True:
-                axes.set_xlim((0, 100))
-                # Add percent symbols
-                vals = axes.get_xticks()
-                axes.set_xticklabels(['{:.0f}%'.format(x) for x in vals])
-            else:
-                default_xlimits = axes.get_xlim()
-                axes.set_xlim((pconfig.get('ymin', default_xlimits[0]),pconfig.get('ymax', default_xlimits[1])))
-            if 'title' in pconfig:
-                top_gap = 1 + (0.5 / plt_height)
-                plt.text(0.5, top_gap, pconfig['title'], horizontalalignment='center', fontsize=16, transform=axes.transAxes)
-            axes.grid(True, zorder=0, which='both', axis='x', linestyle='-', color='#dedede', linewidth=1)
-            axes.set_axisbelow(True)
-            axes.spines['right'].set_visible(False)
-            axes.spines['top'].set_visible(False)
-            axes.spines['bottom'].set_visible(False)
-            axes.spines['left'].set_visible(False)
-            plt.gca().invert_yaxis() # y axis is reverse sorted otherwise
-
-            # Hide some labels if we have a lot of samples
-            show_nth = max(1, math.ceil(len(pdata[0]['data'])/150))
-            for idx, label in enumerate(axes.get_yticklabels()):
-                if idx % show_nth != 0:
-                    label.set_visible(False)
-
-            # Legend
-            bottom_gap = -1 * (1 - ((plt_height - 1.5) / plt_height))
-            lgd = axes.legend(dlabels, loc='lower center', bbox_to_anchor=(0, bottom_gap, 1, .102), ncol=5, mode='expand', fontsize=8, frameon=False)
-
             # Should this plot be hidden on report load?
             hidediv = ''
             if pidx > 0 or hide_plot:
                 hidediv = ' style="display:none;"'
 
-            # Save the plot to the data directory if export is requested
-            if config.export_plots:
-                for fformat in config.export_plot_formats:
-                    # Make the directory if it doesn't already exist
-                    plot_dir = os.path.join(config.plots_dir, fformat)
-                    if not os.path.exists(plot_dir):
-                        os.makedirs(plot_dir)
-                    # Save the plot
-                    plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
-                    fig.savefig(plot_fn, format=fformat, bbox_extra_artists=(lgd,), bbox_inches='tight')
-
-            # Output the figure to a base64 encoded string
+            # Draw the figure - possibly in another process, in which case we get a placeholder
+            b64_img = mpl_pool.render(render_bargraph, {
+                'pdata': pdata,
+                'plotsamples': plotsamples[pidx],
+                'pconfig': pconfig,
+                'plot_pct': plot_pct,
+                'pid': pid,
+                'export_plot_formats': config.export_plot_formats if config.export_plots else [],
+                'plots_dir': getattr(config, 'plots_dir', None),
+                'base64_plots': getattr(get_template_mod(), 'base64_plots', True) is True
+            })
+
+            # Embed the base64 encoded image
             if getattr(get_template_mod(), 'base64_plots', True) is True:
-                img_buffer = io.BytesIO()
-                fig.savefig(img_buffer, format='png', bbox_inches='tight')
-                b64_img = base64.b64encode(img_buffer.getvalue()).decode('utf8')
-                img_buffer.close()
                 html += '<div class="mqc_mplplot" id="{}"{}><img src="data:image/png;base64,{}" /></div>'.format(pid, hidediv, b64_img)
 
             # Link to the saved image
@@ -462,8 +379,6 @@ def matplotlib_bargraph (plotdata, plotsamples, pconfig=None):
                 plot_relpath = os.path.join(config.plots_dir_name, 'png', '{}.png'.format(pid))
                 html += '<div class="mqc_mplplot" id="{}"{}><img src="{}" /></div>'.format(pid, hidediv, plot_relpath)
 
-            plt.close(fig)
-
 
     # Close wrapping div
     html += '</div>'
@@ -472,3 +387,143 @@ def matplotlib_bargraph (plotdata, plotsamples, pconfig=None):
 
     return html
 
+
+def render_bargraph (spec):
+    """
+    Draw a single flat bar graph, described by a spec dict from
+    matplotlib_bargraph(). Saves any exported image files and returns the
+    base64 encoded PNG if requested. Only uses what is in the spec, so
+    that it can be run in a separate process.
+    """
+    pdata = spec['pdata']
+    plotsamples = spec['plotsamples']
+    pconfig = spec['pconfig']
+    plot_pct = spec['plot_pct']
+    pid = spec['pid']
+
+    # Same defaults as HighCharts for consistency
+    default_colors = ['#7cb5ec', '#434348', '#90ed7d', '#f7a35c', '#8085e9',
+                      '#f15c80', '#e4d354', '#2b908f', '#f45b5b', '#91e8e1']
+
+    # Set up figure
+    plt_height = len(plotsamples) / 2.3
+    plt_height = max(6, plt_height) # At least 6" tall
+    plt_height = min(30, plt_height) # Cap at 30" tall
+    bar_width = 0.8
+
+    fig = plt.figure(figsize=(14, plt_height), frameon=False)
+    axes = fig.add_subplot(111)
+    y_ind = range(len(plotsamples))
+
+    # Copy the values, padding out short series with zeros
+    series = list()
+    for d in pdata:
+        values = list(d['data'])
+        if len(values) < len(y_ind):
+            values.extend([0] * (len(y_ind) - len(values)))
+        series.append(values)
+
+    # Count totals for each sample
+    if plot_pct is True:
+        s_totals = [0 for _ in series[0]]
+        for values in series:
+            for sample_idx, v in enumerate(values):
+                s_totals[sample_idx] += v
+
+    # Plot bars
+    dlabels = []
+    for idx, d in enumerate(pdata):
+        # Plot percentages
+        values = series[idx]
+        if plot_pct is True:
+            for (key,var) in enumerate(values):
+                s_total = s_totals[key]
+                if s_total == 0:
+                    values[key] = 0
+                else:
+                    values[key] = (float(var+0.0)/float(s_total))*100
+
+        # Get offset for stacked bars
+        if idx == 0:
+            prevdata = [0] * len(plotsamples)
+        else:
+            for i, p in enumerate(prevdata):
+                prevdata[i] += series[idx-1][i]
+        # Default colour index
+        cidx = idx
+        while cidx >= len(default_colors):
+            cidx -= len(default_colors)
+        # Save the name of this series
+        dlabels.append(d['name'])
+        # Add the series of bars to the plot
+        axes.barh(
+            y_ind,
+            values,
+            bar_width,
+            left = prevdata,
+            color = d.get('color', default_colors[cidx]),
+            align = 'center',
+            linewidth = pconfig.get('borderWidth', 0)
+        )
+
+    # Tidy up axes
+    axes.tick_params(labelsize=8, direction='out', left=False, right=False, top=False, bottom=False)
+    axes.set_xlabel(pconfig.get('ylab', '')) # I know, I should fix the fact that the config is switched
+    axes.set_ylabel(pconfig.get('xlab', ''))
+    axes.set_yticks(y_ind) # Specify where to put the labels
+    axes.set_yticklabels(plotsamples) # Set y axis sample name labels
+    axes.set_ylim((-0.5, len(y_ind)-0.5)) # Reduce padding around plot area
+    if plot_pct is True:
+        axes.set_xlim((0, 100))
+        # Add percent symbols
+        vals = axes.get_xticks()
+        axes.set_xticklabels(['{:.0f}%'.format(x) for x in vals])
+    else:
+        default_xlimits = axes.get_xlim()
+        axes.set_xlim((pconfig.get('ymin', default_xlimits[0]),pconfig.get('ymax', default_xlimits[1])))
+    if 'title' in pconfig:
+        top_gap = 1 + (0.5 / plt_height)
+        plt.text(0.5, top_gap, pconfig['title'], horizontalalignment='center', fontsize=16, transform=axes.transAxes)
+    axes.grid(True, zorder=0, which='both', axis='x', linestyle='-', color='#dedede', linewidth=1)
+    axes.set_axisbelow(True)
+    axes.spines['right'].set_visible(False)
+    axes.spines['top'].set_visible(False)
+    axes.spines['bottom'].set_visible(False)
+    axes.spines['left'].set_visible(False)
+    plt.gca().invert_yaxis() # y axis is reverse sorted otherwise
+
+    # Hide some labels if we have a lot of samples
+    show_nth = max(1, math.ceil(len(series[0])/150))
+    for idx, label in enumerate(axes.get_yticklabels()):
+        if idx % show_nth != 0:
+            label.set_visible(False)
+
+    # Legend
+    bottom_gap = -1 * (1 - ((plt_height - 1.5) / plt_height))
+    lgd = axes.legend(dlabels, loc='lower center', bbox_to_anchor=(0, bottom_gap, 1, .102), ncol=5, mode='expand', fontsize=8, frameon=False)
+
+    # Save the plot to the data directory if export is requested
+    for fformat in spec['export_plot_formats']:
+        # Make the directory if it doesn't already exist
+        plot_dir = os.path.join(spec['plots_dir'], fformat)
+        if not os.path.exists(plot_dir):
+            try:
+                os.makedirs(plot_dir)
+            except OSError:
+                pass # Another rendering process got there first
+        # Save the plot
+        plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
+        fig.savefig(plot_fn, format=fformat, bbox_extra_artists=(lgd,), bbox_inches='tight')
+
+    # Output the figure to a base64 encoded string
+    b64_img = None
+    if spec['base64_plots']:
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format='png', bbox_inches='tight')
+        b64_img = base64.b64encode(img_buffer.getvalue()).decode('utf8')
+        img_buffer.close()
+
+    plt.close(fig)
+
+    return b64_img
+
@@ -2,11 +2,17 @@
 
 """ MultiQC functions to plot a beeswarm group """
 
+from __future__ import print_function
+import base64
+import io
 import logging
+import numpy as np
+import os
 import random
 
-from multiqc.utils import report
+from multiqc.utils import config, report, mpl_pool, plot_cost
 from multiqc.plots import table_object
+from multiqc.plots.linegraph import get_template_mod
 
 logger = logging.getLogger(__name__)
 
@@ -58,18 +64,9 @@ def make_plot(dt):
             });
 
             # Add the data
-            thisdata = []
-            these_snames = []
-            for (s_name, samp) in dt.data[idx].items():
-                if k in samp:
-
-                    val = samp[k]
-
-                    if 'modify' in header and callable(header['modify']):
-                        val = header['modify'](val)
-
-                    thisdata.append(val)
-                    these_snames.append(s_name)
+            column = dt.columns[idx][k]
+            thisdata = column['vals']
+            these_snames = column['s_names']
 
             data.append(thisdata)
             s_names.append(these_snames)
@@ -78,6 +75,24 @@ def make_plot(dt):
         logger.warning('Tried to make beeswarm plot, but had no data')
         return '<p class="text-danger">Error - was not able to plot data.</p>'
 
+    # Summarise the distributions if there are too many points to lay out
+    summary = dt.pconfig.get('summary')
+    if summary is None:
+        num_samples = len(set([s for snames in s_names for s in snames]))
+        summary = config.beeswarm_summary_samples is not None and num_samples >= config.beeswarm_summary_samples
+    if summary:
+        num_points = len(categories) * (config.beeswarm_summary_bins + config.beeswarm_summary_outliers)
+    else:
+        num_points = sum([ len(d) for d in data ])
+    if plot_cost.use_flat({ 'id': bs_id, 'title': dt.pconfig.get('title') }, 'beeswarm_summary' if summary else 'beeswarm', [ (len(categories), num_points) ]):
+        try:
+            return matplotlib_beeswarm(bs_id, categories, data)
+        except:
+            logger.error("############### Error making MatPlotLib figure! Falling back to HighCharts.")
+    if summary:
+        logger.debug('Summarising beeswarm plot {}'.format(bs_id))
+        return make_summary_plot(bs_id, categories, s_names, data)
+
     # Plot HTML
     html = """<div class="hc-plot-wrapper">
         <div id="{bid}" class="hc-plot not_rendered hc-beeswarm-plot"><small>loading..</small></div>
@@ -95,3 +110,178 @@ def make_plot(dt):
     return html
 
 
+def make_summary_plot(bs_id, categories, s_names, data):
+    """ Beeswarm plot with the points for each category replaced by a
+    density histogram and quantiles, plus the outliers as single points.
+    Every sample gets the index of the histogram bin it falls in, so
+    that highlighted samples can still be drawn. """
+
+    nbins = config.beeswarm_summary_bins
+    max_outliers = config.beeswarm_summary_outliers
+
+    # One list of sample names, shared by all categories
+    samples = sorted(set([s for snames in s_names for s in snames]))
+    s_idx = dict([ (s, i) for i, s in enumerate(samples) ])
+
+    summaries = []
+    for cat, snames, vals in zip(categories, s_names, data):
+        # Drop anything that isn't a number
+        x = np.empty(len(vals))
+        for i, v in enumerate(vals):
+            try:
+                x[i] = float(v)
+            except (TypeError, ValueError):
+                x[i] = np.nan
+        keep = np.isfinite(x)
+        x = x[keep]
+        idx = np.array([ s_idx[s] for s in snames ], dtype=int)[keep]
+
+        bins = [-1] * len(samples)
+        if len(x) == 0:
+            summaries.append({ 'n': 0, 'counts': [], 'quantiles': [], 'outliers': [], 'bins': bins })
+            continue
+
+        # Density histogram across the axis range
+        dmin = cat['min'] if cat['min'] is not None else x.min()
+        dmax = cat['max'] if cat['max'] is not None else x.max()
+        if dmax <= dmin:
+            dmax = dmin + 1
+        counts, edges = np.histogram(np.clip(x, dmin, dmax), bins=nbins, range=(dmin, dmax))
+        x_bins = np.clip(((x - dmin) / (dmax - dmin) * nbins).astype(int), 0, nbins - 1)
+        for i, b in zip(idx, x_bins):
+            bins[i] = int(b)
+
+        # Quantiles, then the points outside 1.5 x IQR from the box, most extreme first
+        q = np.percentile(x, [0, 5, 25, 50, 75, 95, 100])
+        iqr = q[4] - q[2]
+        is_out = (x < q[2] - 1.5 * iqr) | (x > q[4] + 1.5 * iqr)
+        out_idx = np.where(is_out)[0]
+        out_idx = out_idx[np.argsort(-np.abs(x[out_idx] - q[3]), kind='mergesort')][:max_outliers]
+        outliers = [ [int(idx[i]), float(x[i])] for i in sorted(out_idx) ]
+
+        summaries.append({
+            'n': int(len(x)),
+            'min': float(dmin),
+            'max': float(dmax),
+            'counts': counts.tolist(),
+            'quantiles': q.tolist(),
+            'outliers': outliers,
+            'bins': bins
+        })
+
+    html = """<div class="hc-plot-wrapper">
+        <div id="{bid}" class="hc-plot not_rendered hc-beeswarm-plot"><small>loading..</small></div>
+    </div>""".format(bid=bs_id)
+
+    report.num_hc_plots += 1
+
+    report.plot_data[bs_id] = {
+        'plot_type': 'beeswarm_summary',
+        'samples': samples,
+        'categories': categories,
+        'summaries': summaries
+    }
+
+    return html
+
+
+def matplotlib_beeswarm(bs_id, categories, data):
+    """ Beeswarm plot drawn as a flat image, with one strip of jittered
+    points for each category. Returns a HTML string. """
+
+    # Drop anything that isn't a number
+    values = list()
+    for vals in data:
+        x = np.empty(len(vals))
+        for i, v in enumerate(vals):
+            try:
+                x[i] = float(v)
+            except (TypeError, ValueError):
+                x[i] = np.nan
+        values.append(x[np.isfinite(x)])
+
+    html = '<p class="text-info"><small><span class="glyphicon glyphicon-picture" aria-hidden="true"></span> ' + \
+          'Flat image plot. Toolbox functions such as highlighting / hiding samples will not work ' + \
+          '(see the <a href="http://multiqc.info/docs/#flat--interactive-plots" target="_blank">docs</a>).</small></p>'
+
+    # Draw the figure - possibly in another process, in which case we get a placeholder
+    b64_img = mpl_pool.render(render_beeswarm, {
+        'values': values,
+        'categories': categories,
+        'pid': bs_id,
+        'export_plot_formats': config.export_plot_formats if config.export_plots else [],
+        'plots_dir': getattr(config, 'plots_dir', None),
+        'base64_plots': getattr(get_template_mod(), 'base64_plots', True) is True
+    })
+
+    # Embed the base64 encoded image
+    if getattr(get_template_mod(), 'base64_plots', True) is True:
+        html += '<div class="mqc_mplplot" id="{}"><img src="data:image/png;base64,{}" /></div>'.format(bs_id, b64_img)
+
+    # Link to the saved image
+    else:
+        plot_relpath = os.path.join(config.plots_dir_name, 'png', '{}.png'.format(bs_id))
+        html += '<div class="mqc_mplplot" id="{}"><img src="{}" /></div>'.format(bs_id, plot_relpath)
+
+    report.num_mpl_plots += 1
+
+    return html
+
+
+def render_beeswarm(spec):
+    """
+    Draw a flat beeswarm plot, described by a spec dict from
+    matplotlib_beeswarm(). Saves any exported image files and returns the
+    base64 encoded PNG if requested. Only uses what is in the spec, so that
+    it can be run in a separate process.
+    """
+    import matplotlib.pyplot as plt
+
+    values = spec['values']
+    categories = spec['categories']
+    pid = spec['pid']
+
+    # Same jitter every time, so that cached images match
+    rng = np.random.RandomState(0)
+
+    fig, axes = plt.subplots(len(categories), 1, squeeze=False, frameon=False,
+                             figsize=(14, max(2, 0.6 * len(categories) + 0.5)))
+    for ax, cat, x in zip(axes[:, 0], categories, values):
+        ax.scatter(x, rng.uniform(-1, 1, len(x)), s=4 if len(x) > 1000 else 9, color='#377eb8',
+                   alpha=0.5 if len(x) > 1000 else 0.8, linewidths=0, rasterized=len(x) > 1000)
+        if cat['min'] is not None or cat['max'] is not None:
+            xmin, xmax = ax.get_xlim()
+            ax.set_xlim((cat['min'] if cat['min'] is not None else xmin, cat['max'] if cat['max'] is not None else xmax))
+        ax.set_ylim((-1.5, 1.5))
+        ax.set_yticks([])
+        ax.set_ylabel(cat['title'], rotation=0, ha='right', va='center', fontsize=8)
+        ax.tick_params(labelsize=7, direction='out', left=False, right=False, top=False)
+        for side in ['top', 'left', 'right']:
+            ax.spines[side].set_visible(False)
+        ax.spines['bottom'].set_color('#cccccc')
+    plt.tight_layout()
+
+    # Save the plot to the data directory if export is requested
+    for fformat in spec['export_plot_formats']:
+        # Make the directory if it doesn't already exist
+        plot_dir = os.path.join(spec['plots_dir'], fformat)
+        if not os.path.exists(plot_dir):
+            try:
+                os.makedirs(plot_dir)
+            except OSError:
+                pass # Another rendering process got there first
+        # Save the plot
+        plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
+        fig.savefig(plot_fn, format=fformat, bbox_inches='tight')
+
+    # Output the figure to a base64 encoded string
+    b64_img = None
+    if spec['base64_plots']:
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format='png', bbox_inches='tight')
+        b64_img = base64.b64encode(img_buffer.getvalue()).decode('utf8')
+        img_buffer.close()
+
+    plt.close(fig)
+
+    return b64_img
@@ -3,10 +3,16 @@
 """ MultiQC functions to plot a heatmap """
 
 from __future__ import print_function
+import base64
+import io
 import logging
+import os
 import random
 
-from multiqc.utils import report
+import numpy as np
+
+from multiqc.utils import config, report, mpl_pool, plot_cost
+from multiqc.plots.linegraph import get_template_mod
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +20,7 @@ letters = 'abcdefghijklmnopqrstuvwxyz'
 
 def plot (data, xcats, ycats=None, pconfig=None):
     """ Plot a 2D heatmap.
-    :param data: List of lists, each a representing a row of values.
+    :param data: List of lists, each a representing a row of values. Can also be a 2D NumPy array.
     :param xcats: Labels for x axis
     :param ycats: Labels for y axis. Defaults to same as x.
     :param pconfig: optional dict with config key:value pairs.
@@ -27,7 +33,23 @@ def plot (data, xcats, ycats=None, pconfig=None):
     if ycats is None:
         ycats = xcats
 
-    # Make a plot
+    # Reorder the rows and columns so that similar samples sit together
+    if pconfig.get('order') is not None:
+        data, xcats, ycats = order_matrix(data, xcats, ycats, pconfig['order'])
+
+    # Make a plot - flat or interactive. Big heatmaps are split into
+    # tiles, only the overview and one tile are drawn at a time.
+    nrows = len(data)
+    ncols = max([ len(row) for row in data ]) if nrows > 0 else 0
+    points = nrows * ncols
+    max_cells, tile_size, overview_size = tile_config(pconfig)
+    if max_cells is not None and points > max_cells:
+        points = min(points, overview_size ** 2 + tile_size ** 2)
+    if plot_cost.use_flat(pconfig, 'heatmap', [ (1, points) ]):
+        try:
+            return matplotlib_heatmap(data, xcats, ycats, pconfig)
+        except:
+            logger.error("############### Error making MatPlotLib figure! Falling back to HighCharts.")
     return highcharts_heatmap(data, xcats, ycats, pconfig)
 
 
@@ -40,12 +62,6 @@ def highcharts_heatmap (data, xcats, ycats, pconfig=None):
     if pconfig is None:
         pconfig = {}
 
-    # Reformat the data for highcharts
-    pdata = []
-    for i, arr in enumerate(data):
-        for j, val in enumerate(arr):
-            pdata.append([j,i,val])
-
     # Get the plot ID
     if pconfig.get('id') is None:
         pconfig['id'] = 'mqc_hcplot_'+''.join(random.sample(letters, 10))
@@ -68,13 +84,281 @@ def highcharts_heatmap (data, xcats, ycats, pconfig=None):
 
     report.num_hc_plots += 1
 
-    report.plot_data[pconfig['id']] = {
+    # The values go in row by row, the browser turns them into HighCharts points
+    matrix = heatmap_matrix(data)
+    plot_data = {
         'plot_type': 'heatmap',
-        'data': pdata,
+        'rows': matrix.shape[0],
+        'cols': matrix.shape[1],
         'xcats': xcats,
         'ycats': ycats,
         'config': pconfig
     }
+    max_cells, tile_size, overview_size = tile_config(pconfig)
+    if max_cells is not None and matrix.size > max_cells:
+        plot_data.update(tile_matrix(matrix, tile_size, overview_size))
+        plot_data['max_cells'] = max_cells
+        # Fix the colour scale, as the browser never sees all of the values at once
+        if np.isfinite(matrix).any():
+            if pconfig.get('min') is None:
+                pconfig['min'] = float(np.nanmin(matrix))
+            if pconfig.get('max') is None:
+                pconfig['max'] = float(np.nanmax(matrix))
+    else:
+        plot_data['values'] = matrix_values(matrix)
+    report.plot_data[pconfig['id']] = plot_data
 
     return html
 
+
+def matplotlib_heatmap (data, xcats, ycats, pconfig=None):
+    """
+    Plot a heatmap with MatPlotLib and return a HTML string. Either embeds
+    a base64 encoded image within HTML or writes the plot and links to it.
+    """
+    if pconfig is None:
+        pconfig = {}
+
+    # Plot ID
+    if pconfig.get('id') is None:
+        pconfig['id'] = 'mqc_mplplot_'+''.join(random.sample(letters, 10))
+
+    # Sanitise plot ID and check for duplicates
+    pconfig['id'] = report.save_htmlid(pconfig['id'])
+
+    html = '<p class="text-info"><small><span class="glyphicon glyphicon-picture" aria-hidden="true"></span> ' + \
+          'Flat image plot. Toolbox functions such as highlighting / hiding samples will not work ' + \
+          '(see the <a href="http://multiqc.info/docs/#flat--interactive-plots" target="_blank">docs</a>).</small></p>'
+
+    # Draw the figure - possibly in another process, in which case we get a placeholder
+    b64_img = mpl_pool.render(render_heatmap, {
+        'matrix': heatmap_matrix(data),
+        'xcats': list(xcats),
+        'ycats': list(ycats),
+        'pconfig': pconfig,
+        'pid': pconfig['id'],
+        'export_plot_formats': config.export_plot_formats if config.export_plots else [],
+        'plots_dir': getattr(config, 'plots_dir', None),
+        'base64_plots': getattr(get_template_mod(), 'base64_plots', True) is True
+    })
+
+    # Embed the base64 encoded image
+    if getattr(get_template_mod(), 'base64_plots', True) is True:
+        html += '<div class="mqc_mplplot" id="{}"><img src="data:image/png;base64,{}" /></div>'.format(pconfig['id'], b64_img)
+
+    # Link to the saved image
+    else:
+        plot_relpath = os.path.join(config.plots_dir_name, 'png', '{}.png'.format(pconfig['id']))
+        html += '<div class="mqc_mplplot" id="{}"><img src="{}" /></div>'.format(pconfig['id'], plot_relpath)
+
+    report.num_mpl_plots += 1
+
+    return html
+
+
+def render_heatmap (spec):
+    """
+    Draw a flat heatmap, described by a spec dict from matplotlib_heatmap().
+    Saves any exported image files and returns the base64 encoded PNG if
+    requested. Only uses what is in the spec, so that it can be run in a
+    separate process.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
+
+    matrix = spec['matrix']
+    pconfig = spec['pconfig']
+    pid = spec['pid']
+
+    # Same colour scale as the HighCharts heatmap
+    colstops = pconfig.get('colstops', [
+        [0, '#313695'], [0.1, '#4575b4'], [0.2, '#74add1'], [0.3, '#abd9e9'],
+        [0.4, '#e0f3f8'], [0.5, '#ffffbf'], [0.6, '#fee090'], [0.7, '#fdae61'],
+        [0.8, '#f46d43'], [0.9, '#d73027'], [1, '#a50026']
+    ])
+    if pconfig.get('reverseColors'):
+        colstops = [ [1 - c[0], c[1]] for c in reversed(colstops) ]
+    cmap = LinearSegmentedColormap.from_list('mqc_heatmap', [ (float(c[0]), c[1]) for c in colstops ])
+    cmap.set_bad('#ffffff')
+
+    nrows, ncols = matrix.shape
+    width = min(max(6, ncols / 6.0 + 3), 20)
+    height = min(max(5, nrows / 6.0 + 2), 20)
+    fig = plt.figure(figsize=(width, height), frameon=False)
+    axes = fig.add_subplot(111)
+    img = axes.imshow(np.ma.masked_invalid(matrix), cmap=cmap, aspect='auto', interpolation='nearest',
+                      vmin=pconfig.get('min'), vmax=pconfig.get('max'))
+    if pconfig.get('legend', True):
+        fig.colorbar(img, ax=axes)
+
+    # Only label the axes if the labels can be read
+    if ncols <= 100:
+        axes.set_xticks(range(ncols))
+        axes.set_xticklabels(spec['xcats'], rotation=90, fontsize=8)
+    else:
+        axes.set_xticks([])
+    if nrows <= 100:
+        axes.set_yticks(range(nrows))
+        axes.set_yticklabels(spec['ycats'], fontsize=8)
+    else:
+        axes.set_yticks([])
+    axes.tick_params(direction='out', left=False, right=False, top=False, bottom=False)
+    axes.set_xlabel(pconfig.get('xTitle', ''))
+    axes.set_ylabel(pconfig.get('yTitle', ''))
+    if 'title' in pconfig:
+        axes.set_title(pconfig['title'], fontsize=16)
+    plt.tight_layout()
+
+    # Save the plot to the data directory if export is requested
+    for fformat in spec['export_plot_formats']:
+        # Make the directory if it doesn't already exist
+        plot_dir = os.path.join(spec['plots_dir'], fformat)
+        if not os.path.exists(plot_dir):
+            try:
+                os.makedirs(plot_dir)
+            except OSError:
+                pass # Another rendering process got there first
+        # Save the plot
+        plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
+        fig.savefig(plot_fn, format=fformat, bbox_inches='tight')
+
+    # Output the figure to a base64 encoded string
+    b64_img = None
+    if spec['base64_plots']:
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format='png', bbox_inches='tight')
+        b64_img = base64.b64encode(img_buffer.getvalue()).decode('utf8')
+        img_buffer.close()
+
+    plt.close(fig)
+
+    return b64_img
+
+
+def heatmap_matrix(data):
+    """ Heatmap data as a 2D float array, with NaN for missing values """
+    try:
+        matrix = np.array(data, dtype=float)
+    except (TypeError, ValueError):
+        # Ragged rows or values that aren't numbers - do them one at a time
+        ncols = max([ len(row) for row in data ]) if len(data) > 0 else 0
+        matrix = np.full((len(data), ncols), np.nan)
+        for i, row in enumerate(data):
+            for j, val in enumerate(row):
+                try:
+                    matrix[i, j] = float(val)
+                except (TypeError, ValueError):
+                    pass
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(data), -1)
+    return matrix
+
+
+def matrix_values(matrix):
+    """ Row-major list of the values in a matrix, with None for NaN """
+    vals = matrix.ravel().tolist()
+    if np.isnan(matrix).any():
+        vals = [ None if v != v else v for v in vals ]
+    return vals
+
+
+def tile_config(pconfig):
+    """ Cell count above which a heatmap is tiled, the tile size and the overview
+    size, from the plot config or else the heatmap_tile_* config options """
+    return (
+        pconfig.get('tile_cells', config.heatmap_tile_cells),
+        pconfig.get('tile_size', config.heatmap_tile_size),
+        pconfig.get('overview_size', config.heatmap_overview_size)
+    )
+
+def tile_matrix(matrix, tile_size, overview_size):
+    """
+    Split a large matrix into square tiles, so that the browser only has
+    to make points for the part that is zoomed in to, plus an overview
+    where each cell is the mean of a block of factor x factor values.
+    """
+    nrows, ncols = matrix.shape
+    tiles = list()
+    for r0 in range(0, nrows, tile_size):
+        tile_row = list()
+        for c0 in range(0, ncols, tile_size):
+            tile_row.append(matrix_values(matrix[r0:r0+tile_size, c0:c0+tile_size]))
+        tiles.append(tile_row)
+
+    factor = int(np.ceil(max(nrows, ncols) / float(overview_size)))
+    orows = int(np.ceil(nrows / float(factor)))
+    ocols = int(np.ceil(ncols / float(factor)))
+    padded = np.full((orows * factor, ocols * factor), np.nan)
+    padded[:nrows, :ncols] = matrix
+    blocks = padded.reshape(orows, factor, ocols, factor)
+    counts = np.isfinite(blocks).sum(axis=(1, 3))
+    sums = np.where(np.isfinite(blocks), blocks, 0).sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        overview = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+    return {
+        'tile_size': tile_size,
+        'tiles': tiles,
+        'overview': {
+            'factor': factor,
+            'rows': orows,
+            'cols': ocols,
+            'values': matrix_values(overview)
+        }
+    }
+
+
+def order_matrix(data, xcats, ycats, method):
+    """
+    Reorder the rows and columns of a heatmap so that similar rows and
+    columns sit next to each other. Square matrices with the same labels
+    on both axes (eg. sample correlations) keep the same order on both,
+    so the diagonal stays on the diagonal.
+    :param method: 'cluster' for hierarchical clustering (needs SciPy),
+                   'seriation' for spectral seriation
+    :return: data, xcats, ycats in the new order
+    """
+    if method not in ['cluster', 'seriation']:
+        logger.warning("Unknown heatmap order '{}', leaving heatmap unsorted".format(method))
+        return data, xcats, ycats
+    matrix = heatmap_matrix(data)
+    if matrix.shape != (len(ycats), len(xcats)):
+        logger.warning("Heatmap data doesn't match the number of labels, leaving heatmap unsorted")
+        return data, xcats, ycats
+
+    row_order = axis_order(matrix, method)
+    if list(xcats) == list(ycats):
+        col_order = row_order
+    else:
+        col_order = axis_order(matrix.T, method)
+    matrix = matrix[row_order][:, col_order]
+    return matrix, [ xcats[i] for i in col_order ], [ ycats[i] for i in row_order ]
+
+
+def axis_order(matrix, method):
+    """ New order for the rows of a matrix """
+    n = matrix.shape[0]
+    if n < 3:
+        return np.arange(n)
+    # Missing values take the column mean, so they don't pull rows apart
+    filled = matrix.copy()
+    col_means = np.nanmean(np.where(np.isfinite(filled), filled, np.nan), axis=0)
+    col_means = np.where(np.isfinite(col_means), col_means, 0)
+    missing = ~np.isfinite(filled)
+    filled[missing] = np.take(col_means, np.nonzero(missing)[1])
+
+    if method == 'cluster':
+        try:
+            from scipy.cluster import hierarchy
+            return hierarchy.leaves_list(hierarchy.linkage(filled, method='average'))
+        except ImportError:
+            logger.warning("SciPy is needed to cluster heatmaps, using seriation instead")
+
+    # Spectral seriation - order by the Fiedler vector of the similarity graph
+    sq = (filled ** 2).sum(axis=1)
+    dist = np.sqrt(np.maximum(sq[:, None] + sq[None, :] - 2 * filled.dot(filled.T), 0))
+    scale = np.median(dist[dist > 0]) if (dist > 0).any() else 1.0
+    sim = np.exp(-dist / scale)
+    laplacian = np.diag(sim.sum(axis=1)) - sim
+    evals, evecs = np.linalg.eigh(laplacian)
+    return np.argsort(evecs[:, 1], kind='mergesort')
@@ -11,7 +11,9 @@ import os
 import random
 import sys
 
-from multiqc.utils import config, report, util_functions
+import numpy as np
+
+from multiqc.utils import config, report, util_functions, mpl_pool, plot_cost
 logger = logging.getLogger(__name__)
 
 try:
@@ -39,7 +41,8 @@ def get_template_mod():
 
 def plot (data, pconfig=None):
     """ Plot a line graph with X,Y data.
-    :param data: 2D dict, first keys as sample names, then x:y data pairs
+    :param data: 2D dict, first keys as sample names, then x:y data pairs.
+                 Can also be arrays, see dataset_arrays() for the formats.
     :param pconfig: optional dict with config key:value pairs. See CONTRIBUTING.md
     :return: HTML and JS, ready to be inserted into the page
     """
@@ -52,16 +55,6 @@ def plot (data, pconfig=None):
     if type(data) is not list:
         data = [data]
 
-    # Smooth dataset if requested in config
-    if pconfig.get('smooth_points', None) is not None:
-        sumcounts = pconfig.get('smooth_points_sumcounts', True)
-        for i, d in enumerate(data):
-            if type(sumcounts) is list:
-                sumc = sumcounts[i]
-            else:
-                sumc = sumcounts
-            data[i] = smooth_line_data(d, pconfig['smooth_points'], sumc)
-
     # Add sane plotting config defaults
     for idx, yp in enumerate(pconfig.get('yPlotLines', [])):
         pconfig['yPlotLines'][idx]["width"] = pconfig['yPlotLines'][idx].get("width", 2)
@@ -78,44 +71,25 @@ def plot (data, pconfig=None):
         except (KeyError, IndexError):
             pass
 
-    # Generate the data dict structure expected by HighCharts series
+    # Generate the data structure expected by HighCharts series
+    # Numeric data is held as arrays of x and y values, anything else as [x, y] pairs
+    sumcounts = pconfig.get('smooth_points_sumcounts', True)
     plotdata = list()
-    for d in data:
-        thisplotdata = list()
-        for s in sorted(d.keys()):
-            pairs = list()
-            maxval = 0
-            if 'categories' in pconfig:
-                pconfig['categories'] = list()
-                for k in d[s].keys():
-                    pconfig['categories'].append(k)
-                    pairs.append(d[s][k])
-                    maxval = max(maxval, d[s][k])
-            else:
-                for k in sorted(d[s].keys()):
-                    if k is not None:
-                        if 'xmax' in pconfig and float(k) > float(pconfig['xmax']):
-                            continue
-                        if 'xmin' in pconfig and float(k) < float(pconfig['xmin']):
-                            continue
-                    if d[s][k] is not None:
-                        if 'ymax' in pconfig and float(d[s][k]) > float(pconfig['ymax']):
-                            continue
-                        if 'ymin' in pconfig and float(d[s][k]) < float(pconfig['ymin']):
-                            continue
-                    pairs.append([k, d[s][k]])
-                    try:
-                        maxval = max(maxval, d[s][k])
-                    except TypeError:
-                        pass
-            if maxval > 0 or pconfig.get('hide_empty') is not True:
-                this_series = { 'name': s, 'data': pairs }
-                try:
-                    this_series['color'] = pconfig['colors'][s]
-                except:
-                    pass
-                thisplotdata.append(this_series)
-        plotdata.append(thisplotdata)
+    for i, d in enumerate(data):
+        if type(sumcounts) is list:
+            sumc = sumcounts[i]
+        else:
+            sumc = sumcounts
+        arrays = None
+        if 'categories' not in pconfig:
+            arrays = dataset_arrays(d)
+        if arrays is not None:
+            plotdata.append(array_series(arrays, pconfig, sumc))
+        else:
+            # Smooth dataset if requested in config
+            if pconfig.get('smooth_points', None) is not None:
+                d = smooth_line_data(d, pconfig['smooth_points'], sumc)
+            plotdata.append(pair_series(d, pconfig))
 
     # Add on annotation data series
     try:
@@ -133,22 +107,185 @@ def plot (data, pconfig=None):
 
     # Make a plot - template custom, or interactive or flat
     try:
-        return get_template_mod().linegraph(plotdata, pconfig)
+        return get_template_mod().linegraph(pairs_plotdata(plotdata), pconfig)
     except (AttributeError, TypeError):
-        if config.plots_force_flat or (not config.plots_force_interactive and len(plotdata[0]) > config.plots_flat_numseries):
+        # Thin out very long lines, keeping the full data for multiqc_data
+        hc_plotdata = plotdata if config.plots_force_flat else downsample_plotdata(plotdata, pconfig)
+        if plot_cost.use_flat(pconfig, 'xy_line', [ (len(pdata), sum([ series_len(s) for s in pdata ])) for pdata in hc_plotdata ]):
             try:
                 return matplotlib_linegraph(plotdata, pconfig)
             except:
                 logger.error("############### Error making MatPlotLib figure! Falling back to HighCharts.")
-                return highcharts_linegraph(plotdata, pconfig)
+                return highcharts_linegraph(hc_plotdata, pconfig)
         else:
             # Use MatPlotLib to generate static plots if requested
             if config.export_plots:
                 matplotlib_linegraph(plotdata, pconfig)
+            html = highcharts_linegraph(hc_plotdata, pconfig)
+            if hc_plotdata is not plotdata:
+                save_plotdata(plotdata, pconfig)
             # Return HTML for HighCharts dynamic plot
-            return highcharts_linegraph(plotdata, pconfig)
+            return html
+
 
 
+def is_columnar(d):
+    """ Is this dataset in the columnar form, with x values shared by all samples? """
+    return isinstance(d, dict) and 'x' in d and 'y' in d and not isinstance(d['x'], dict) \
+        and set(d.keys()) <= set(['x', 'y', 'samples'])
+
+def dataset_arrays(d):
+    """
+    Turn a dataset into a list of ( sample name, x array, y array ), sorted
+    by sample name, with each sample sorted by x. Accepts any of:
+        {'x': x values, 'y': {sample: y values}}
+        {'x': x values, 'y': 2D samples x points matrix, 'samples': sample names}
+        {sample: (x values, y values)} or {sample: n x 2 array}
+        {sample: {x: y}}
+    :return: List of arrays, or None if a sample in a dict of dicts has
+             x values that aren't numbers or y values that aren't numbers / None.
+    """
+    arrays = list()
+    if is_columnar(d):
+        x = np.asarray(d['x'])
+        if isinstance(d['y'], dict):
+            items = d['y'].items()
+        else:
+            items = zip(d['samples'], d['y'])
+        for s_name, y in items:
+            arrays.append( (s_name, x, np.asarray(y)) )
+    else:
+        for s_name, v in d.items():
+            if isinstance(v, dict):
+                keys = list(v.keys())
+                x = np.array(keys)
+                if len(keys) > 0 and x.dtype.kind not in 'iuf':
+                    return None
+                y = np.array([ v[k] for k in keys ])
+                if y.dtype.kind == 'O':
+                    try:
+                        y = np.array([ v[k] for k in keys ], dtype=float)
+                    except (TypeError, ValueError):
+                        return None
+                elif len(keys) > 0 and y.dtype.kind not in 'iuf':
+                    return None
+            elif isinstance(v, tuple):
+                x, y = np.asarray(v[0]), np.asarray(v[1])
+            else:
+                v = np.asarray(v)
+                x, y = v[:,0], v[:,1]
+            arrays.append( (s_name, x, y) )
+
+    # Sort samples by name and points by x
+    sorted_arrays = list()
+    for s_name, x, y in sorted(arrays, key=lambda a: a[0]):
+        if y.dtype.kind not in 'iuf':
+            y = y.astype(float)
+        if len(x) > 1 and np.any(x[1:] < x[:-1]):
+            order = np.argsort(x, kind='mergesort')
+            x, y = x[order], y[order]
+        sorted_arrays.append( (s_name, x, y) )
+    return sorted_arrays
+
+def array_series(arrays, pconfig, sumcounts=True):
+    """ Smooth, filter and make HighCharts series from the arrays
+    of one dataset. Series keep their values as 'x' and 'y' arrays. """
+    series = list()
+    for s_name, x, y in arrays:
+        if pconfig.get('smooth_points', None) is not None:
+            x, y = smooth_arrays(x, y, pconfig['smooth_points'], sumcounts)
+        keep = None
+        for key, arr, too_far in [('xmax', x, np.greater), ('xmin', x, np.less),
+                                  ('ymax', y, np.greater), ('ymin', y, np.less)]:
+            if key in pconfig:
+                # Missing (NaN) values compare as False, so are always kept
+                out = too_far(arr, float(pconfig[key]))
+                keep = ~out if keep is None else keep & ~out
+        if keep is not None and not keep.all():
+            x, y = x[keep], y[keep]
+        if pconfig.get('hide_empty') is True:
+            if len(y) == 0 or np.all(np.isnan(y)) or not np.nanmax(y) > 0:
+                continue
+        this_series = { 'name': s_name, 'x': x, 'y': y }
+        try:
+            this_series['color'] = pconfig['colors'][s_name]
+        except:
+            pass
+        series.append(this_series)
+    return series
+
+def pair_series(d, pconfig):
+    """ Make HighCharts series of [x, y] pairs from a dict of dicts,
+    for categories and data that can't be held in arrays """
+    thisplotdata = list()
+    for s in sorted(d.keys()):
+        pairs = list()
+        maxval = 0
+        if 'categories' in pconfig:
+            pconfig['categories'] = list()
+            for k in d[s].keys():
+                pconfig['categories'].append(k)
+                pairs.append(d[s][k])
+                maxval = max(maxval, d[s][k])
+        else:
+            for k in sorted(d[s].keys()):
+                if k is not None:
+                    if 'xmax' in pconfig and float(k) > float(pconfig['xmax']):
+                        continue
+                    if 'xmin' in pconfig and float(k) < float(pconfig['xmin']):
+                        continue
+                if d[s][k] is not None:
+                    if 'ymax' in pconfig and float(d[s][k]) > float(pconfig['ymax']):
+                        continue
+                    if 'ymin' in pconfig and float(d[s][k]) < float(pconfig['ymin']):
+                        continue
+                pairs.append([k, d[s][k]])
+                try:
+                    maxval = max(maxval, d[s][k])
+                except TypeError:
+                    pass
+        if maxval > 0 or pconfig.get('hide_empty') is not True:
+            this_series = { 'name': s, 'data': pairs }
+            try:
+                this_series['color'] = pconfig['colors'][s]
+            except:
+                pass
+            thisplotdata.append(this_series)
+    return thisplotdata
+
+def y_list(y):
+    """ y values as a list, with NaN turned back into None """
+    vals = y.tolist()
+    if y.dtype.kind == 'f' and np.isnan(y).any():
+        vals = [ None if v != v else v for v in vals ]
+    return vals
+
+def series_pairs(series):
+    """ [x, y] pairs for a series, whether it holds arrays or pairs """
+    if 'y' in series and 'x' in series:
+        return [ [x, y] for x, y in zip(series['x'].tolist(), y_list(series['y'])) ]
+    return series['data']
+
+def series_len(series):
+    if 'y' in series and 'x' in series:
+        return len(series['y'])
+    return len(series['data'])
+
+def pairs_plotdata(plotdata):
+    """ Copy of plotdata with every series holding [x, y] pairs in 'data',
+    as expected by MatPlotLib plots, data files and custom templates """
+    new_plotdata = list()
+    for pdata in plotdata:
+        new_pdata = list()
+        for series in pdata:
+            if 'y' in series and 'x' in series:
+                pairs = series_pairs(series)
+                series = dict([ (k, v) for k, v in series.items() if k not in ['x', 'y'] ])
+                series['data'] = pairs
+            new_pdata.append(series)
+        new_plotdata.append(new_pdata)
+    return new_plotdata
+
 
 def highcharts_linegraph (plotdata, pconfig=None):
     """
@@ -197,11 +334,33 @@ def highcharts_linegraph (plotdata, pconfig=None):
 
     report.num_hc_plots += 1
 
+    # Series held as arrays just send their y values, with an index into a list
+    # of x arrays. Samples with the same x values share one copy of them.
+    xvals = list()
+    xrefs = dict()
+    hc_plotdata = list()
+    for pdata in plotdata:
+        hc_pdata = list()
+        for series in pdata:
+            if 'y' in series and 'x' in series:
+                series_y = series['y']
+                xkey = (series['x'].dtype.str, series['x'].tobytes())
+                if xkey not in xrefs:
+                    xrefs[xkey] = len(xvals)
+                    xvals.append(series['x'].tolist())
+                series = dict([ (k, v) for k, v in series.items() if k not in ['x', 'y'] ])
+                series['xref'] = xrefs[xkey]
+                series['y'] = y_list(series_y)
+            hc_pdata.append(series)
+        hc_plotdata.append(hc_pdata)
+
     report.plot_data[pconfig['id']] = {
         'plot_type': "xy_line",
-        'datasets': plotdata,
+        'datasets': hc_plotdata,
         'config': pconfig
     }
+    if len(xvals) > 0:
+        report.plot_data[pconfig['id']]['xvals'] = xvals
 
     return html
 
@@ -214,6 +373,7 @@ def matplotlib_linegraph (plotdata, pconfig=None):
     """
     if pconfig is None:
         pconfig = {}
+    plotdata = pairs_plotdata(plotdata)
 
     # Plot group ID
     if pconfig.get('id') is None:
@@ -238,10 +398,6 @@ def matplotlib_linegraph (plotdata, pconfig=None):
           '(see the <a href="http://multiqc.info/docs/#flat--interactive-plots" target="_blank">docs</a>).</small></p>'
     html += '<div class="mqc_mplplot_plotgroup" id="{}">'.format(pconfig['id'])
 
-    # Same defaults as HighCharts for consistency
-    default_colors = ['#7cb5ec', '#434348', '#90ed7d', '#f7a35c', '#8085e9',
-                      '#f15c80', '#e4d354', '#2b908f', '#f45b5b', '#91e8e1']
-
     # Buttons to cycle through different datasets
     if len(plotdata) > 1 and not config.simple_output:
         html += '<div class="btn-group mpl_switch_group mqc_mplplot_bargraph_switchds">\n'
@@ -267,14 +423,16 @@ def matplotlib_linegraph (plotdata, pconfig=None):
         sharedcats = True
         for d in pdata:
             fdata[d['name']] = OrderedDict()
+            # Check to see if all categories are the same
+            if len(d['data']) > 0 and type(d['data'][0]) is list:
+                cats = [x[0] for x in d['data']]
+                if lastcats is None:
+                    lastcats = cats
+                elif lastcats != cats:
+                    sharedcats = False
             for i, x in enumerate(d['data']):
                 if type(x) is list:
                     fdata[d['name']][str(x[0])] = x[1]
-                    # Check to see if all categories are the same
-                    if lastcats is None:
-                        lastcats = [x[0] for x in d['data']]
-                    elif lastcats != [x[0] for x in d['data']]:
-                        sharedcats = False
                 else:
                     try:
                         fdata[d['name']][pconfig['categories'][i]] = x
@@ -294,136 +452,24 @@ def matplotlib_linegraph (plotdata, pconfig=None):
         else:
             util_functions.write_data_file(fdata, pid)
 
-        # Set up figure
-        fig = plt.figure(figsize=(14, 6), frameon=False)
-        axes = fig.add_subplot(111)
-
-        # Go through data series
-        for idx, d in enumerate(pdata):
-
-            # Default colour index
-            cidx = idx
-            while cidx >= len(default_colors):
-                cidx -= len(default_colors)
-
-            # Line style
-            linestyle = 'solid'
-            if d.get('dashStyle', None) == 'Dash':
-                linestyle = 'dashed'
-
-            # Reformat data (again)
-            try:
-                axes.plot([x[0] for x in d['data']], [x[1] for x in d['data']], label=d['name'], color=d.get('color', default_colors[cidx]), linestyle=linestyle, linewidth=1, marker=None)
-            except TypeError:
-                # Categorical data on x axis
-                axes.plot(d['data'], label=d['name'], color=d.get('color', default_colors[cidx]), linewidth=1, marker=None)
-
-        # Tidy up axes
-        axes.tick_params(labelsize=8, direction='out', left=False, right=False, top=False, bottom=False)
-        axes.set_xlabel(pconfig.get('xlab', ''))
-        axes.set_ylabel(pconfig.get('ylab', ''))
-
-        # Dataset specific y label
-        try:
-            axes.set_ylabel(pconfig['data_labels'][pidx]['ylab'])
-        except:
-            pass
-
-        # Axis limits
-        default_ylimits = axes.get_ylim()
-        ymin = default_ylimits[0]
-        if 'ymin' in pconfig:
-            ymin = pconfig['ymin']
-        elif 'yCeiling' in pconfig:
-            ymin = min(pconfig['yCeiling'], default_ylimits[0])
-        ymax = default_ylimits[1]
-        if 'ymax' in pconfig:
-            ymax = pconfig['ymax']
-        elif 'yFloor' in pconfig:
-            ymax = max(pconfig['yCeiling'], default_ylimits[1])
-        if (ymax - ymin) < pconfig.get('yMinRange', 0):
-            ymax = ymin + pconfig['yMinRange']
-        axes.set_ylim((ymin, ymax))
-
-        # Dataset specific ymax
-        try:
-            axes.set_ylim((ymin, pconfig['data_labels'][pidx]['ymax']))
-        except:
-            pass
-
-        default_xlimits = axes.get_xlim()
-        xmin = default_xlimits[0]
-        if 'xmin' in pconfig:
-            xmin = pconfig['xmin']
-        elif 'xCeiling' in pconfig:
-            xmin = min(pconfig['xCeiling'], default_xlimits[0])
-        xmax = default_xlimits[1]
-        if 'xmax' in pconfig:
-            xmax = pconfig['xmax']
-        elif 'xFloor' in pconfig:
-            xmax = max(pconfig['xCeiling'], default_xlimits[1])
-        if (xmax - xmin) < pconfig.get('xMinRange', 0):
-            xmax = xmin + pconfig['xMinRange']
-        axes.set_xlim((xmin, xmax))
-
-        # Plot title
-        if 'title' in pconfig:
-            plt.text(0.5, 1.05, pconfig['title'], horizontalalignment='center', fontsize=16, transform=axes.transAxes)
-        axes.grid(True, zorder=10, which='both', axis='y', linestyle='-', color='#dedede', linewidth=1)
-
-        # X axis categories, if specified
-        if 'categories' in pconfig:
-            axes.set_xticks([i for i,v in enumerate(pconfig['categories'])])
-            axes.set_xticklabels(pconfig['categories'])
-
-        # Axis lines
-        xlim = axes.get_xlim()
-        axes.plot([xlim[0], xlim[1]], [0, 0], linestyle='-', color='#dedede', linewidth=2)
-        axes.set_axisbelow(True)
-        axes.spines['right'].set_visible(False)
-        axes.spines['top'].set_visible(False)
-        axes.spines['bottom'].set_visible(False)
-        axes.spines['left'].set_visible(False)
-
-        # Background colours, if specified
-        if 'yPlotBands' in pconfig:
-            xlim = axes.get_xlim()
-            for pb in pconfig['yPlotBands']:
-                axes.barh(pb['from'], xlim[1], height = pb['to']-pb['from'], left=xlim[0], color=pb['color'], linewidth=0, zorder=0)
-        if 'xPlotBands' in pconfig:
-            ylim = axes.get_ylim()
-            for pb in pconfig['xPlotBands']:
-                axes.bar(pb['from'], ylim[1], width = pb['to']-pb['from'], bottom=ylim[0], color=pb['color'], linewidth=0, zorder=0)
-
-        # Tight layout - makes sure that legend fits in and stuff
-        if len(pdata) <= 15:
-            axes.legend(loc='lower center', bbox_to_anchor=(0, -0.22, 1, .102), ncol=5, mode='expand', fontsize=8, frameon=False)
-            plt.tight_layout(rect=[0,0.08,1,0.92])
-        else:
-            plt.tight_layout(rect=[0,0,1,0.92])
-
         # Should this plot be hidden on report load?
         hidediv = ''
         if pidx > 0:
             hidediv = ' style="display:none;"'
 
-        # Save the plot to the data directory if export is requests
-        if config.export_plots:
-            for fformat in config.export_plot_formats:
-                # Make the directory if it doesn't already exist
-                plot_dir = os.path.join(config.plots_dir, fformat)
-                if not os.path.exists(plot_dir):
-                    os.makedirs(plot_dir)
-                # Save the plot
-                plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
-                fig.savefig(plot_fn, format=fformat, bbox_inches='tight')
-
-        # Output the figure to a base64 encoded string
+        # Draw the figure - possibly in another process, in which case we get a placeholder
+        b64_img = mpl_pool.render(render_linegraph, {
+            'pdata': pdata,
+            'pconfig': pconfig,
+            'pidx': pidx,
+            'pid': pid,
+            'export_plot_formats': config.export_plot_formats if config.export_plots else [],
+            'plots_dir': getattr(config, 'plots_dir', None),
+            'base64_plots': getattr(get_template_mod(), 'base64_plots', True) is True
+        })
+
+        # Embed the base64 encoded image
         if getattr(get_template_mod(), 'base64_plots', True) is True:
-            img_buffer = io.BytesIO()
-            fig.savefig(img_buffer, format='png', bbox_inches='tight')
-            b64_img = base64.b64encode(img_buffer.getvalue()).decode('utf8')
-            img_buffer.close()
             html += '<div class="mqc_mplplot" id="{}"{}><img src="data:image/png;base64,{}" /></div>'.format(pid, hidediv, b64_img)
 
         # Save to a file and link <img>
@@ -431,8 +477,6 @@ def matplotlib_linegraph (plotdata, pconfig=None):
             plot_relpath = os.path.join(config.plots_dir_name, 'png', '{}.png'.format(pid))
             html += '<div class="mqc_mplplot" id="{}"{}><img src="{}" /></div>'.format(pid, hidediv, plot_relpath)
 
-        plt.close(fig)
-
 
     # Close wrapping div
     html += '</div>'
@@ -442,6 +486,157 @@ def matplotlib_linegraph (plotdata, pconfig=None):
     return html
 
 
+def render_linegraph (spec):
+    """
+    Draw a single flat line graph, described by a spec dict from
+    matplotlib_linegraph(). Saves any exported image files and returns the
+    base64 encoded PNG if requested. Only uses what is in the spec, so
+    that it can be run in a separate process.
+    """
+    pdata = spec['pdata']
+    pconfig = spec['pconfig']
+    pidx = spec['pidx']
+    pid = spec['pid']
+
+    # Same defaults as HighCharts for consistency
+    default_colors = ['#7cb5ec', '#434348', '#90ed7d', '#f7a35c', '#8085e9',
+                      '#f15c80', '#e4d354', '#2b908f', '#f45b5b', '#91e8e1']
+
+    # Set up figure
+    fig = plt.figure(figsize=(14, 6), frameon=False)
+    axes = fig.add_subplot(111)
+
+    # Go through data series
+    for idx, d in enumerate(pdata):
+
+        # Default colour index
+        cidx = idx
+        while cidx >= len(default_colors):
+            cidx -= len(default_colors)
+
+        # Line style
+        linestyle = 'solid'
+        if d.get('dashStyle', None) == 'Dash':
+            linestyle = 'dashed'
+
+        # Reformat data (again)
+        try:
+            axes.plot([x[0] for x in d['data']], [x[1] for x in d['data']], label=d['name'], color=d.get('color', default_colors[cidx]), linestyle=linestyle, linewidth=1, marker=None)
+        except TypeError:
+            # Categorical data on x axis
+            axes.plot(d['data'], label=d['name'], color=d.get('color', default_colors[cidx]), linewidth=1, marker=None)
+
+    # Tidy up axes
+    axes.tick_params(labelsize=8, direction='out', left=False, right=False, top=False, bottom=False)
+    axes.set_xlabel(pconfig.get('xlab', ''))
+    axes.set_ylabel(pconfig.get('ylab', ''))
+
+    # Dataset specific y label
+    try:
+        axes.set_ylabel(pconfig['data_labels'][pidx]['ylab'])
+    except:
+        pass
+
+    # Axis limits
+    default_ylimits = axes.get_ylim()
+    ymin = default_ylimits[0]
+    if 'ymin' in pconfig:
+        ymin = pconfig['ymin']
+    elif 'yCeiling' in pconfig:
+        ymin = min(pconfig['yCeiling'], default_ylimits[0])
+    ymax = default_ylimits[1]
+    if 'ymax' in pconfig:
+        ymax = pconfig['ymax']
+    elif 'yFloor' in pconfig:
+        ymax = max(pconfig['yCeiling'], default_ylimits[1])
+    if (ymax - ymin) < pconfig.get('yMinRange', 0):
+        ymax = ymin + pconfig['yMinRange']
+    axes.set_ylim((ymin, ymax))
+
+    # Dataset specific ymax
+    try:
+        axes.set_ylim((ymin, pconfig['data_labels'][pidx]['ymax']))
+    except:
+        pass
+
+    default_xlimits = axes.get_xlim()
+    xmin = default_xlimits[0]
+    if 'xmin' in pconfig:
+        xmin = pconfig['xmin']
+    elif 'xCeiling' in pconfig:
+        xmin = min(pconfig['xCeiling'], default_xlimits[0])
+    xmax = default_xlimits[1]
+    if 'xmax' in pconfig:
+        xmax = pconfig['xmax']
+    elif 'xFloor' in pconfig:
+        xmax = max(pconfig['xCeiling'], default_xlimits[1])
+    if (xmax - xmin) < pconfig.get('xMinRange', 0):
+        xmax = xmin + pconfig['xMinRange']
+    axes.set_xlim((xmin, xmax))
+
+    # Plot title
+    if 'title' in pconfig:
+        plt.text(0.5, 1.05, pconfig['title'], horizontalalignment='center', fontsize=16, transform=axes.transAxes)
+    axes.grid(True, zorder=10, which='both', axis='y', linestyle='-', color='#dedede', linewidth=1)
+
+    # X axis categories, if specified
+    if 'categories' in pconfig:
+        axes.set_xticks([i for i,v in enumerate(pconfig['categories'])])
+        axes.set_xticklabels(pconfig['categories'])
+
+    # Axis lines
+    xlim = axes.get_xlim()
+    axes.plot([xlim[0], xlim[1]], [0, 0], linestyle='-', color='#dedede', linewidth=2)
+    axes.set_axisbelow(True)
+    axes.spines['right'].set_visible(False)
+    axes.spines['top'].set_visible(False)
+    axes.spines['bottom'].set_visible(False)
+    axes.spines['left'].set_visible(False)
+
+    # Background colours, if specified
+    if 'yPlotBands' in pconfig:
+        xlim = axes.get_xlim()
+        for pb in pconfig['yPlotBands']:
+            axes.barh(pb['from'], xlim[1], height = pb['to']-pb['from'], left=xlim[0], color=pb['color'], linewidth=0, zorder=0)
+    if 'xPlotBands' in pconfig:
+        ylim = axes.get_ylim()
+        for pb in pconfig['xPlotBands']:
+            axes.bar(pb['from'], ylim[1], width = pb['to']-pb['from'], bottom=ylim[0], color=pb['color'], linewidth=0, zorder=0)
+
+    # Tight layout - makes sure that legend fits in and stuff
+    if len(pdata) <= 15:
+        axes.legend(loc='lower center', bbox_to_anchor=(0, -0.22, 1, .102), ncol=5, mode='expand', fontsize=8, frameon=False)
+        plt.tight_layout(rect=[0,0.08,1,0.92])
+    else:
+        plt.tight_layout(rect=[0,0,1,0.92])
+
+    # Save the plot to the data directory if export is requested
+    for fformat in spec['export_plot_formats']:
+        # Make the directory if it doesn't already exist
+        plot_dir = os.path.join(spec['plots_dir'], fformat)
+        if not os.path.exists(plot_dir):
+            try:
+                os.makedirs(plot_dir)
+            except OSError:
+                pass # Another rendering process got there first
+        # Save the plot
+        plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
+        fig.savefig(plot_fn, format=fformat, bbox_inches='tight')
+
+    # Output the figure to a base64 encoded string
+    b64_img = None
+    if spec['base64_plots']:
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format='png', bbox_inches='tight')
+        b64_img = base64.b64encode(img_buffer.getvalue()).decode('utf8')
+        img_buffer.close()
+
+    plt.close(fig)
+
+    return b64_img
+
+
+
 def smooth_line_data(data, numpoints, sumcounts=True):
     """
     Function to take an x-y dataset and use binning to
@@ -474,4 +669,177 @@ def smooth_line_data(data, numpoints, sumcounts=True):
                 smoothed[s_name][x] = v
                 p = 0
                 binvals = []
+        # Don't lose the points in the last, partially filled bin
+        if len(binvals) > 0:
+            if sumcounts is True:
+                v = sum(binvals)
+            else:
+                v = sum(binvals) / len(binvals)
+            smoothed[s_name][x] = v
     return smoothed
+
+
+def smooth_arrays(x, y, numpoints, sumcounts=True):
+    """
+    smooth_line_data() for one sample held as arrays sorted by x. Bins
+    points in exactly the same way, with a NumPy reduction per bin.
+    """
+    n = len(x)
+    if n <= numpoints:
+        return x, y
+    binsize = n / numpoints
+    if binsize < 1:
+        binsize = 1
+    # Each bin takes this many points, then the x value of the one after
+    binlen = int(np.ceil(binsize))
+    period = binlen + 1
+    in_bin = (np.arange(n) % period) < binlen
+    binned_y = y[in_bin]
+    starts = np.arange(0, len(binned_y), binlen)
+    sums = np.add.reduceat(binned_y, starts) if len(binned_y) > 0 else binned_y
+    keys = x[period - 1::period]
+    if sumcounts is True:
+        vals = sums
+    else:
+        vals = sums[:len(keys)] / binsize
+    # The last, partially filled bin takes the last x value
+    if len(sums) > len(keys):
+        keys = np.append(keys, x[-1])
+        if sumcounts is not True:
+            vals = np.append(vals, sums[-1] / float(len(binned_y) - starts[-1]))
+    return keys, vals
+
+
+def downsample_plotdata(plotdata, pconfig):
+    """
+    Reduce the number of points sent to HighCharts when a plot has more
+    than linegraph_points_budget points in total. Each long series is cut
+    down to its share of the budget with LTTB or min / max per bucket,
+    both of which keep peaks. Returns plotdata itself if nothing changed.
+    """
+    budget = pconfig.get('downsample_budget', config.linegraph_points_budget)
+    method = pconfig.get('downsample_method', config.linegraph_downsample_method)
+    if budget is None or method is None or 'categories' in pconfig:
+        return plotdata
+    if method not in ['lttb', 'minmax']:
+        logger.warning("Unknown line graph downsampling method '{}', using 'lttb'".format(method))
+        method = 'lttb'
+
+    num_points = sum([ series_len(s) for pdata in plotdata for s in pdata ])
+    if num_points <= budget:
+        return plotdata
+    num_series = sum([ len(pdata) for pdata in plotdata ])
+    threshold = max(int(budget / num_series), config.linegraph_min_points)
+
+    new_plotdata = list()
+    num_kept = 0
+    for pdata in plotdata:
+        new_pdata = list()
+        for series in pdata:
+            xy = series_array(series) if series_len(series) > threshold else None
+            if xy is None:
+                new_pdata.append(series)
+                num_kept += series_len(series)
+                continue
+            if method == 'minmax':
+                keep = minmax_indices(xy[1], threshold)
+            else:
+                keep = lttb_indices(xy[0], xy[1], threshold)
+            new_series = series.copy()
+            if 'data' in series:
+                new_series['data'] = [ series['data'][i] for i in keep ]
+            else:
+                new_series['x'] = series['x'][keep]
+                new_series['y'] = series['y'][keep]
+            new_pdata.append(new_series)
+            num_kept += len(keep)
+        new_plotdata.append(new_pdata)
+    logger.debug("Downsampled line graph {} from {} to {} points ({})".format(
+        pconfig.get('id'), num_points, num_kept, method))
+    return new_plotdata
+
+
+def series_array(series):
+    """ x and y values of a series as float arrays. Returns None if
+    any point is missing or not numeric, as gaps can't be downsampled. """
+    try:
+        if 'data' in series:
+            xy = np.array(series['data'], dtype=float)
+            if xy.ndim != 2 or xy.shape[1] != 2:
+                return None
+            x, y = xy[:,0], xy[:,1]
+        else:
+            x, y = series['x'].astype(float), series['y'].astype(float)
+    except (TypeError, ValueError):
+        return None
+    if not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+        return None
+    return x, y
+
+
+def bucket_ids(n, num_buckets):
+    """ Bucket number for each of the n - 2 points between the first
+    and last, split into num_buckets buckets of (near) equal size """
+    return (np.arange(n - 2) * num_buckets) // (n - 2)
+
+
+def lttb_indices(x, y, numpoints):
+    """
+    Largest-Triangle-Three-Buckets. Keeps the first and last points and,
+    from each bucket in between, the point making the largest triangle
+    with its neighbours. The neighbours are the centroids of the buckets
+    either side, rather than the previously chosen point, so every bucket
+    is worked out at once.
+    :return: Sorted array of the indices of points to keep
+    """
+    n = len(x)
+    if numpoints >= n or numpoints < 3:
+        return np.arange(n)
+    nb = numpoints - 2
+    bids = bucket_ids(n, nb)
+    counts = np.bincount(bids, minlength=nb)
+    cx = np.bincount(bids, weights=x[1:-1], minlength=nb) / counts
+    cy = np.bincount(bids, weights=y[1:-1], minlength=nb) / counts
+    # Previous and next anchors - the end points for the first and last buckets
+    ax = np.concatenate(([x[0]], cx[:-1]))[bids]
+    ay = np.concatenate(([y[0]], cy[:-1]))[bids]
+    bx = np.concatenate((cx[1:], [x[-1]]))[bids]
+    by = np.concatenate((cy[1:], [y[-1]]))[bids]
+    area = np.abs((ax - bx) * (y[1:-1] - ay) - (ax - x[1:-1]) * (by - ay))
+    # The last point of each bucket when sorted by area is the biggest triangle
+    order = np.lexsort((area, bids))
+    ends = np.cumsum(counts) - 1
+    return np.concatenate(([0], np.sort(order[ends]) + 1, [n - 1]))
+
+
+def minmax_indices(y, numpoints):
+    """
+    Keep the first and last points plus the lowest and highest
+    point in each bucket, so that no peak or trough is lost.
+    :return: Sorted array of the indices of points to keep
+    """
+    n = len(y)
+    if numpoints >= n or numpoints < 4:
+        return np.arange(n)
+    nb = (numpoints - 2) // 2
+    bids = bucket_ids(n, nb)
+    counts = np.bincount(bids, minlength=nb)
+    order = np.lexsort((y[1:-1], bids))
+    ends = np.cumsum(counts)
+    keep = np.unique(np.concatenate((order[ends - counts], order[ends - 1]))) + 1
+    return np.concatenate(([0], keep, [n - 1]))
+
+
+def save_plotdata(plotdata, pconfig):
+    """ Write the full resolution data for a downsampled plot to multiqc_data """
+    for pidx, pdata in enumerate(plotdata):
+        try:
+            name = pconfig['data_labels'][pidx]['name']
+        except:
+            name = pidx+1
+        fn = 'mqc_{}_{}'.format(pconfig['id'], name)
+        fdata = OrderedDict()
+        for d in pdata:
+            fdata[d['name']] = OrderedDict([ (str(x[0]), x[1]) for x in series_pairs(d) ])
+        report.saved_raw_data[fn] = fdata
+        util_functions.write_data_file(fdata, fn)
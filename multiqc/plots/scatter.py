@@ -2,10 +2,17 @@
 
 """ MultiQC functions to plot a scatter plot """
 
+from __future__ import print_function
+import base64
+import io
 import logging
+import os
 import random
 
-from multiqc.utils import report
+import numpy as np
+
+from multiqc.utils import config, report, mpl_pool, plot_cost
+from multiqc.plots.linegraph import get_template_mod
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +31,19 @@ def plot (data, pconfig=None):
     if type(data) is not list:
         data = [data]
 
+    # Too many points to plot one by one - bin them instead
+    num_points = [ sum([ len(v) if type(v) is list else 1 for v in ds.values() ]) for ds in data ]
+    density = pconfig.get('density')
+    if density is None:
+        density = config.scatter_density_points is not None and sum(num_points) > config.scatter_density_points
+    if density:
+        nbins = pconfig.get('density_bins', config.scatter_density_bins)
+        flat = plot_cost.use_flat(pconfig, 'scatter_density', [ (1, min(n, nbins * nbins)) for n in num_points ])
+        if not flat:
+            return make_density_plot(data, pconfig)
+    else:
+        flat = plot_cost.use_flat(pconfig, 'scatter', [ (1, n) for n in num_points ])
+
     # Generate the data dict structure expected by HighCharts series
     plotdata = list()
     for ds in data:
@@ -32,17 +52,17 @@ def plot (data, pconfig=None):
             if type(ds[s_name]) is not list:
                 ds[s_name] = [ ds[s_name] ]
             for k in ds[s_name]:
-                if k['x'] is not None:
-                    if 'xmax' in pconfig and float(k['x']) > float(pconfig['xmax']):
+                if k.get('x') is not None:
+                    if 'xmax' in pconfig and to_float(k['x']) > float(pconfig['xmax']):
                         continue
-                    if 'xmin' in pconfig and float(k['x']) < float(pconfig['xmin']):
+                    if 'xmin' in pconfig and to_float(k['x']) < float(pconfig['xmin']):
                         continue
-                if k['y'] is not None:
-                    if 'ymax' in pconfig and float(k['y']) > float(pconfig['ymax']):
+                if k.get('y') is not None:
+                    if 'ymax' in pconfig and to_float(k['y']) > float(pconfig['ymax']):
                         continue
-                    if 'ymin' in pconfig and float(k['y']) < float(pconfig['ymin']):
+                    if 'ymin' in pconfig and to_float(k['y']) < float(pconfig['ymin']):
                         continue
-                this_series = { 'x': k['x'], 'y': k['y'] }
+                this_series = { 'x': k.get('x'), 'y': k.get('y') }
                 try:
                     this_series['name'] = "{}: {}".format(s_name, k['name'])
                 except KeyError:
@@ -64,10 +84,17 @@ def plot (data, pconfig=None):
     except KeyError:
         pass
 
-    # Make a plot
+    # Make a plot - flat or interactive
+    if flat:
+        try:
+            return matplotlib_scatter_plot(plotdata, pconfig)
+        except:
+            logger.error("############### Error making MatPlotLib figure! Falling back to HighCharts.")
+            if density:
+                return make_density_plot(data, pconfig)
     return highcharts_scatter_plot(plotdata, pconfig)
 
-def highcharts_scatter_plot (plotdata, pconfig=None):
+def highcharts_scatter_plot (plotdata, pconfig=None, plot_type='scatter'):
     """
     Build the HTML needed for a HighCharts scatter plot. Should be
     called by scatter.plot(), which properly formats input data.
@@ -111,10 +138,286 @@ def highcharts_scatter_plot (plotdata, pconfig=None):
     report.num_hc_plots += 1
 
     report.plot_data[pconfig['id']] = {
-        'plot_type': "scatter",
+        'plot_type': plot_type,
         'datasets': plotdata,
         'config': pconfig
     }
 
     return html
 
+
+def matplotlib_scatter_plot (plotdata, pconfig=None):
+    """
+    Plot a scatter plot with MatPlotLib and return a HTML string. Either embeds
+    a base64 encoded image within HTML or writes the plot and links to it.
+    Should be called by scatter.plot(), which properly formats input data.
+    """
+    if pconfig is None:
+        pconfig = {}
+
+    # Plot group ID
+    if pconfig.get('id') is None:
+        pconfig['id'] = 'mqc_mplplot_'+''.join(random.sample(letters, 10))
+
+    # Sanitise plot ID and check for duplicates
+    pconfig['id'] = report.save_htmlid(pconfig['id'])
+
+    # Individual plot IDs
+    pids = []
+    for k in range(len(plotdata)):
+        try:
+            name = pconfig['data_labels'][k]['name']
+        except:
+            name = k+1
+        pids.append(report.save_htmlid('mqc_{}_{}'.format(pconfig['id'], name)))
+
+    html = '<p class="text-info"><small><span class="glyphicon glyphicon-picture" aria-hidden="true"></span> ' + \
+          'Flat image plot. Toolbox functions such as highlighting / hiding samples will not work ' + \
+          '(see the <a href="http://multiqc.info/docs/#flat--interactive-plots" target="_blank">docs</a>).</small></p>'
+    html += '<div class="mqc_mplplot_plotgroup" id="{}">'.format(pconfig['id'])
+
+    # Buttons to cycle through different datasets
+    if len(plotdata) > 1 and not config.simple_output:
+        html += '<div class="btn-group mpl_switch_group mqc_mplplot_bargraph_switchds">\n'
+        for k, p in enumerate(plotdata):
+            active = 'active' if k == 0 else ''
+            try:
+                name = pconfig['data_labels'][k]['name']
+            except:
+                name = k+1
+            html += '<button class="btn btn-default btn-sm {a}" data-target="#{pid}">{n}</button>\n'.format(a=active, pid=pids[k], n=name)
+        html += '</div>\n\n'
+
+    for pidx, pdata in enumerate(plotdata):
+        pid = pids[pidx]
+
+        # Points as arrays, annotation series as lines
+        points = [ p for p in pdata if 'x' in p and 'y' in p ]
+        lines = [ p for p in pdata if 'data' in p ]
+        x = np.array([ to_float(p['x']) for p in points ], dtype=float)
+        y = np.array([ to_float(p['y']) for p in points ], dtype=float)
+        colors = [ p.get('color', pconfig.get('marker_colour', 'rgba(124, 181, 236, .5)')) for p in points ]
+
+        hidediv = ' style="display:none;"' if pidx > 0 else ''
+
+        # Draw the figure - possibly in another process, in which case we get a placeholder
+        b64_img = mpl_pool.render(render_scatter_plot, {
+            'x': x,
+            'y': y,
+            'colors': colors,
+            'lines': lines,
+            'pconfig': pconfig,
+            'pidx': pidx,
+            'pid': pid,
+            'export_plot_formats': config.export_plot_formats if config.export_plots else [],
+            'plots_dir': getattr(config, 'plots_dir', None),
+            'base64_plots': getattr(get_template_mod(), 'base64_plots', True) is True
+        })
+
+        # Embed the base64 encoded image
+        if getattr(get_template_mod(), 'base64_plots', True) is True:
+            html += '<div class="mqc_mplplot" id="{}"{}><img src="data:image/png;base64,{}" /></div>'.format(pid, hidediv, b64_img)
+
+        # Link to the saved image
+        else:
+            plot_relpath = os.path.join(config.plots_dir_name, 'png', '{}.png'.format(pid))
+            html += '<div class="mqc_mplplot" id="{}"{}><img src="{}" /></div>'.format(pid, hidediv, plot_relpath)
+
+    # Close wrapping div
+    html += '</div>'
+
+    report.num_mpl_plots += 1
+
+    return html
+
+
+def render_scatter_plot (spec):
+    """
+    Draw a single flat scatter plot, described by a spec dict from
+    matplotlib_scatter_plot(). Saves any exported image files and returns
+    the base64 encoded PNG if requested. Only uses what is in the spec, so
+    that it can be run in a separate process.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import to_rgba
+
+    pconfig = spec['pconfig']
+    pid = spec['pid']
+
+    fig = plt.figure(figsize=(8, 8) if pconfig.get('square') else (14, 6), frameon=False)
+    axes = fig.add_subplot(111)
+
+    # HighCharts style rgba() strings into MatPlotLib colours
+    colors = list()
+    for c in spec['colors']:
+        try:
+            if c.startswith('rgb'):
+                vals = [ float(v) for v in c[c.index('(')+1:c.index(')')].split(',') ]
+                c = tuple([ v / 255.0 for v in vals[:3] ] + vals[3:4])
+            colors.append(to_rgba(c))
+        except (ValueError, AttributeError):
+            colors.append(to_rgba('#7cb5ec', 0.5))
+
+    # Lots of points get smaller markers and are drawn as pixels in vector formats
+    size = pconfig.get('marker_size', 5) ** 2 if len(spec['x']) < 10000 else 4
+    axes.scatter(spec['x'], spec['y'], s=size, c=colors, linewidths=0, rasterized=len(spec['x']) > 10000, zorder=2)
+    for line in spec['lines']:
+        try:
+            axes.plot([ p[0] for p in line['data'] ], [ p[1] for p in line['data'] ],
+                      color=line.get('color', '#999999'), linewidth=1, zorder=3,
+                      linestyle='dashed' if line.get('dashStyle') == 'Dash' else 'solid')
+        except (TypeError, IndexError, KeyError, ValueError):
+            pass
+
+    # Tidy up axes
+    axes.tick_params(labelsize=8, direction='out', left=False, right=False, top=False, bottom=False)
+    axes.set_xlabel(pconfig.get('xlab', ''))
+    axes.set_ylabel(pconfig.get('ylab', ''))
+    try:
+        axes.set_ylabel(pconfig['data_labels'][spec['pidx']]['ylab'])
+    except:
+        pass
+    if pconfig.get('xLog'):
+        axes.set_xscale('log')
+    if pconfig.get('yLog'):
+        axes.set_yscale('log')
+    xmin, xmax = axes.get_xlim()
+    axes.set_xlim((pconfig.get('xmin', xmin), pconfig.get('xmax', xmax)))
+    ymin, ymax = axes.get_ylim()
+    axes.set_ylim((pconfig.get('ymin', ymin), pconfig.get('ymax', ymax)))
+    if 'title' in pconfig:
+        plt.text(0.5, 1.05, pconfig['title'], horizontalalignment='center', fontsize=16, transform=axes.transAxes)
+    axes.grid(True, zorder=0, which='both', linestyle='-', color='#dedede', linewidth=1)
+    axes.set_axisbelow(True)
+    plt.tight_layout(rect=[0,0,1,0.92])
+
+    # Save the plot to the data directory if export is requested
+    for fformat in spec['export_plot_formats']:
+        # Make the directory if it doesn't already exist
+        plot_dir = os.path.join(spec['plots_dir'], fformat)
+        if not os.path.exists(plot_dir):
+            try:
+                os.makedirs(plot_dir)
+            except OSError:
+                pass # Another rendering process got there first
+        # Save the plot
+        plot_fn = os.path.join(plot_dir, '{}.{}'.format(pid, fformat))
+        fig.savefig(plot_fn, format=fformat, bbox_inches='tight')
+
+    # Output the figure to a base64 encoded string
+    b64_img = None
+    if spec['base64_plots']:
+        img_buffer = io.BytesIO()
+        fig.savefig(img_buffer, format='png', bbox_inches='tight')
+        b64_img = base64.b64encode(img_buffer.getvalue()).decode('utf8')
+        img_buffer.close()
+
+    plt.close(fig)
+
+    return b64_img
+
+
+def to_float(value):
+    """ A point's x or y value as a float, or NaN if it is missing or not a
+    number, so that it is dropped along with NaN and infinite values """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def make_density_plot(data, pconfig):
+    """ Scatter plot with the points binned into a grid of squares (drawn as
+    a heatmap) or hexagons (drawn as markers sized by count). Every sample
+    gets the indices of the cells its points fall in, so that highlighted
+    samples can still be drawn. """
+    bin_type = pconfig.get('density_type', config.scatter_density_type)
+    if bin_type not in ['hist', 'hexbin']:
+        logger.warning("Unknown scatter density type '{}', using 'hist'".format(bin_type))
+        bin_type = 'hist'
+    nbins = pconfig.get('density_bins', config.scatter_density_bins)
+
+    plotdata = list()
+    for ds in data:
+        # Every point as arrays of x, y and sample index
+        samples = list(ds.keys())
+        xs, ys, s_idx = list(), list(), list()
+        for i, s_name in enumerate(samples):
+            points = ds[s_name] if type(ds[s_name]) is list else [ ds[s_name] ]
+            for k in points:
+                xs.append(to_float(k.get('x')))
+                ys.append(to_float(k.get('y')))
+                s_idx.append(i)
+        x = np.array(xs, dtype=float) if len(xs) > 0 else np.empty(0)
+        y = np.array(ys, dtype=float) if len(ys) > 0 else np.empty(0)
+        s_idx = np.array(s_idx, dtype=int)
+        keep = np.isfinite(x) & np.isfinite(y)
+        for key, arr, too_far in [('xmax', x, np.greater), ('xmin', x, np.less),
+                                  ('ymax', y, np.greater), ('ymin', y, np.less)]:
+            if key in pconfig:
+                keep &= ~too_far(arr, float(pconfig[key]))
+        x, y, s_idx = x[keep], y[keep], s_idx[keep]
+        plotdata.append(density_cells(x, y, s_idx, samples, bin_type, nbins))
+
+    # Add on annotation data series
+    try:
+        plotdata[0]['extra'] = list(pconfig['extra_series'])
+    except KeyError:
+        pass
+
+    return highcharts_scatter_plot(plotdata, pconfig, 'scatter_density')
+
+def density_cells(x, y, s_idx, samples, bin_type, nbins):
+    """ Bin points into cells, returning the centre and count of every
+    cell with points in it, and the cells that each sample is found in """
+    cells = { 'type': bin_type, 'n': int(len(x)), 'samples': samples,
+              'cells': [], 'cellsize': [1, 1], 'sample_cells': [ [] for s in samples ] }
+    if len(x) == 0:
+        return cells
+    xmin, xmax = x.min(), x.max()
+    ymin, ymax = y.min(), y.max()
+    if xmax <= xmin:
+        xmax = xmin + 1
+    if ymax <= ymin:
+        ymax = ymin + 1
+
+    if bin_type == 'hexbin':
+        # Two offset lattices, each point goes to the nearest hexagon centre. As matplotlib hexbin.
+        nx = nbins
+        ny = max(int(round(nbins / np.sqrt(3))), 1)
+        sx = (xmax - xmin) / nx
+        sy = (ymax - ymin) / ny
+        ix = (x - xmin) / sx
+        iy = (y - ymin) / sy
+        ix1, iy1 = np.round(ix), np.round(iy)
+        ix2, iy2 = np.floor(ix), np.floor(iy)
+        d1 = (ix - ix1) ** 2 + 3.0 * (iy - iy1) ** 2
+        d2 = (ix - ix2 - 0.5) ** 2 + 3.0 * (iy - iy2 - 0.5) ** 2
+        lattice = (d2 < d1).astype(int)
+        ci = np.where(lattice == 1, ix2, ix1).astype(int)
+        cj = np.where(lattice == 1, iy2, iy1).astype(int)
+        keys = (ci * (ny + 2) + cj) * 2 + lattice
+        uniq, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        u_lattice = uniq % 2
+        u_ci = (uniq // 2) // (ny + 2)
+        u_cj = (uniq // 2) % (ny + 2)
+        cx = xmin + (u_ci + 0.5 * u_lattice) * sx
+        cy = ymin + (u_cj + 0.5 * u_lattice) * sy
+        cells['cellsize'] = [float(sx), float(sy)]
+    else:
+        # Square 2D histogram
+        sx = (xmax - xmin) / nbins
+        sy = (ymax - ymin) / nbins
+        ci = np.clip(((x - xmin) / sx).astype(int), 0, nbins - 1)
+        cj = np.clip(((y - ymin) / sy).astype(int), 0, nbins - 1)
+        uniq, inverse, counts = np.unique(ci * nbins + cj, return_inverse=True, return_counts=True)
+        cx = xmin + (uniq // nbins + 0.5) * sx
+        cy = ymin + (uniq % nbins + 0.5) * sy
+        cells['cellsize'] = [float(sx), float(sy)]
+
+    cells['cells'] = [ [ float(a), float(b), int(c) ] for a, b, c in zip(cx, cy, counts) ]
+
+    # Unique cells for each sample
+    pairs = np.unique(s_idx * len(uniq) + inverse.ravel())
+    for si, cell in zip((pairs // len(uniq)).tolist(), (pairs % len(uniq)).tolist()):
+        cells['sample_cells'][si].append(cell)
+    return cells
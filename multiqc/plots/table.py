@@ -4,6 +4,7 @@
 
 from collections import defaultdict, OrderedDict
 import logging
+import numpy as np
 import random
 
 from multiqc.utils import config, report, util_functions, mqc_colour
@@ -28,12 +29,18 @@ def plot (data, headers=None, pconfig=None):
 
     # Collect unique sample names
     s_names = set()
-    for d in dt.data:
-        for s_name in d.keys():
-            s_names.add(s_name)
-
-    # Make a beeswarm plot if we have lots of samples
-    if len(s_names) >= config.max_table_rows and pconfig.get('no_beeswarm') is not True:
+    for section_columns in dt.columns:
+        for col in section_columns.values():
+            s_names.update(col['s_names'])
+
+    # Make a virtual table or a beeswarm plot if we have lots of samples
+    virtual = pconfig.get('virtual')
+    if virtual is None:
+        virtual = config.virtual_tables
+    if len(s_names) >= config.max_table_rows and virtual is True:
+        logger.debug('Plotting virtual table, {} samples'.format(len(s_names)))
+        return make_table ( dt, virtual=True )
+    elif len(s_names) >= config.max_table_rows and pconfig.get('no_beeswarm') is not True:
         logger.debug('Plotting beeswarm instead of table, {} samples'.format(len(s_names)))
         warning = '<p class="text-muted"><span class="glyphicon glyphicon-exclamation-sign" ' \
             'title="A beeswarm plot has been generated instead because of the large number of samples. '\
@@ -44,10 +51,13 @@ def plot (data, headers=None, pconfig=None):
         return make_table ( dt )
 
 
-def make_table (dt):
+def make_table (dt, virtual=False):
     """
     Build the HTML needed for a MultiQC table.
     :param data: MultiQC datatable object
+    :param virtual: Leave the table body empty and save the cells as
+                    column arrays in the plot data, for the JavaScript
+                    to render just the rows that are scrolled into view
     """
 
     table_id = dt.pconfig.get('id', 'table_{}'.format(''.join(random.sample(letters, 4))) )
@@ -62,6 +72,17 @@ def make_table (dt):
     if table_title is None:
         table_title = table_id.replace("_", " ").title()
 
+    # Cells are built column by column, rows are just an ordered set of sample names
+    t_cols = dict()
+    v_cols = OrderedDict()
+
+    # This is horrible, but Python locale settings are worse
+    if config.thousandsSep_format is None:
+        config.thousandsSep_format = '<span class="mqc_thousandSep"></span>'
+    if config.decimalPoint_format is None:
+        config.decimalPoint_format = '.'
+    locale_chars = { ord('.'): config.decimalPoint_format, ord(','): config.thousandsSep_format }
+
     for idx, k, header in dt.get_headers_in_order():
 
         rid = report.save_htmlid(header['rid'])
@@ -122,145 +143,151 @@ def make_table (dt):
         else:
             c_scale = mqc_colour.mqc_colour_scale(header['scale'], header['dmin'], header['dmax'])
 
-        # Add the data table cells
-        for (s_name, samp) in dt.data[idx].items():
-            if k in samp:
-                val = samp[k]
-                kname = '{}_{}'.format(header['namespace'], rid)
-                dt.raw_vals[s_name][kname] = val
-
-                if 'modify' in header and callable(header['modify']):
-                    val = header['modify'](val)
-
-                try:
-                    dmin = header['dmin']
-                    dmax = header['dmax']
-                    percentage = ((float(val) - dmin) / (dmax - dmin)) * 100
-                    percentage = min(percentage, 100)
-                    percentage = max(percentage, 0)
-                except (ZeroDivisionError,ValueError):
-                    percentage = 0
+        # Get the values for this column
+        kname = '{}_{}'.format(header['namespace'], rid)
+        column = dt.columns[idx][k]
+        col_snames = column['s_names']
+        col_vals = column['vals']
+        for s_name, val in zip(col_snames, column['raw']):
+            dt.raw_vals[s_name][kname] = val
 
+        # Remove header if we don't have any filled cells for it
+        if len(col_snames) == 0:
+            t_headers.pop(rid, None)
+            t_modal_headers.pop(rid, None)
+            logger.debug('Removing header {} from general stats table, as no data'.format(k))
+            continue
+
+        # Virtual tables keep the values for the JavaScript to build the cells from
+        if virtual:
+            v_cols[rid] = virtual_column(header, c_scale, column, locale_chars)
+            for s_name in col_snames:
+                if s_name not in t_rows:
+                    t_rows[s_name] = True
+            continue
+
+        # Build the data table cells for the whole column
+        if not header['scale']:
+            cell_tpl = '<td class="{rid} {h}">{{}}</td>'.format(rid=rid, h=hide)
+            cells = [ cell_tpl.format(val) for val in col_vals ]
+        else:
+            if c_scale is not None:
+                col_colours = [ ' background-color:{};'.format(c) for c in c_scale.get_colours_for_values(col_vals, column['values'], column['mask']) ]
+            else:
+                col_colours = [''] * len(col_vals)
+            cell_tpl = '<td class="data-coloured {rid} {h}"><div class="wrapper"><span class="bar" style="width:{{}}%;{{}}"></span>' \
+                '<span class="val">{{}}{suffix}</span></div></td>'.format(rid=rid, h=hide, suffix=header.get('suffix', '').replace('{', '{{').replace('}', '}}'))
+            fmt = header['format'].format
+            percentages = column_percentages(column, header['dmin'], header['dmax'])
+            cells = list()
+            for val, percentage, col in zip(col_vals, percentages, col_colours):
                 try:
-                    valstring = str(header['format'].format(val))
+                    valstring = str(fmt(val))
                 except ValueError:
                     try:
-                        valstring = str(header['format'].format(float(val)))
+                        valstring = str(fmt(float(val)))
                     except ValueError:
                         valstring = str(val)
                 except:
                     valstring = str(val)
 
-                # This is horrible, but Python locale settings are worse
-                if config.thousandsSep_format is None:
-                    config.thousandsSep_format = '<span class="mqc_thousandSep"></span>'
-                if config.decimalPoint_format is None:
-                    config.decimalPoint_format = '.'
-                valstring = valstring.replace('.', 'DECIMAL').replace(',', 'THOUSAND')
-                valstring = valstring.replace('DECIMAL', config.decimalPoint_format).replace('THOUSAND', config.thousandsSep_format)
-
-                # Percentage suffixes etc
-                valstring += header.get('suffix', '')
-
-                # Build HTML
-                if not header['scale']:
-                    if s_name not in t_rows:
-                        t_rows[s_name] = dict()
-                    t_rows[s_name][rid] = '<td class="{rid} {h}">{v}</td>'.format(rid=rid, h=hide, v=val)
-                else:
-                    if c_scale is not None:
-                        col = ' background-color:{};'.format(c_scale.get_colour(val))
-                    else:
-                        col = ''
-                    bar_html = '<span class="bar" style="width:{}%;{}"></span>'.format(percentage, col)
-                    val_html = '<span class="val">{}</span>'.format(valstring)
-                    wrapper_html = '<div class="wrapper">{}{}</div>'.format(bar_html, val_html)
-
-                    if s_name not in t_rows:
-                        t_rows[s_name] = dict()
-                    t_rows[s_name][rid] = '<td class="data-coloured {rid} {h}">{c}</td>'.format(rid=rid, h=hide, c=wrapper_html)
+                cells.append(cell_tpl.format(percentage, col, valstring.translate(locale_chars)))
 
-        # Remove header if we don't have any filled cells for it
-        if sum([len(rows) for rows in t_rows.values()]) == 0:
-            t_headers.pop(rid, None)
-            t_modal_headers.pop(rid, None)
-            logger.debug('Removing header {} from general stats table, as no data'.format(k))
+        t_cols[rid] = dict(zip(col_snames, cells))
+        for s_name in col_snames:
+            if s_name not in t_rows:
+                t_rows[s_name] = True
 
     #
     # Put everything together
     #
 
     # Buttons above the table
-    html = ''
+    html = list()
     if not config.simple_output:
 
         # Copy Table Button
-        html += """
+        if virtual:
+            html.append("""
+        <button type="button" class="mqc_table_copy_btn mqc_vtable_copy_btn btn btn-default btn-sm" data-target="#{tid}">
+            <span class="glyphicon glyphicon-copy"></span> Copy table
+        </button>
+        """.format(tid=table_id))
+        else:
+            html.append("""
         <button type="button" class="mqc_table_copy_btn btn btn-default btn-sm" data-clipboard-target="#{tid}">
             <span class="glyphicon glyphicon-copy"></span> Copy table
         </button>
-        """.format(tid=table_id)
+        """.format(tid=table_id))
 
         # Configure Columns Button
         if len(t_headers) > 2:
-            html += """
+            html.append("""
             <button type="button" class="mqc_table_configModal_btn btn btn-default btn-sm" data-toggle="modal" data-target="#{tid}_configModal">
                 <span class="glyphicon glyphicon-th"></span> Configure Columns
             </button>
-            """.format(tid=table_id)
+            """.format(tid=table_id))
 
         # Sort By Highlight button
-        html += """
+        html.append("""
         <button type="button" class="mqc_table_sortHighlight btn btn-default btn-sm" data-target="#{tid}" data-direction="desc" style="display:none;">
             <span class="glyphicon glyphicon-sort-by-attributes-alt"></span> Sort by highlight
         </button>
-        """.format(tid=table_id)
+        """.format(tid=table_id))
 
         # Scatter Plot Button
         if len(t_headers) > 2:
-            html += """
+            html.append("""
             <button type="button" class="mqc_table_makeScatter btn btn-default btn-sm" data-toggle="modal" data-target="#tableScatterModal" data-table="#{tid}">
                 <span class="glyphicon glyphicon glyphicon-stats"></span> Plot
             </button>
-            """.format(tid=table_id)
+            """.format(tid=table_id))
 
         # "Showing x of y columns" text
-        html += """
+        html.append("""
         <small id="{tid}_numrows_text" class="mqc_table_numrows_text">Showing <sup id="{tid}_numrows" class="mqc_table_numrows">{nrows}</sup>/<sub>{nrows}</sub> rows and <sup id="{tid}_numcols" class="mqc_table_numcols">{ncols_vis}</sup>/<sub>{ncols}</sub> columns.</small>
-        """.format(tid=table_id, nrows=len(t_rows), ncols_vis = (len(t_headers)+1)-hidden_cols, ncols=len(t_headers))
+        """.format(tid=table_id, nrows=len(t_rows), ncols_vis = (len(t_headers)+1)-hidden_cols, ncols=len(t_headers)))
 
     # Build the table itself
     collapse_class = 'mqc-table-collapse' if len(t_rows) > 10 and config.collapse_tables else ''
-    html += """
+    virtual_class = ''
+    if virtual:
+        # Virtual tables need a fixed height box to scroll within
+        collapse_class = 'mqc-table-collapse'
+        virtual_class = ' mqc_table_virtual'
+    html.append("""
         <div id="{tid}_container" class="mqc_table_container">
             <div class="table-responsive mqc-table-responsive {cc}">
-                <table id="{tid}" class="table table-condensed mqc_table" data-title="{title}">
-        """.format( tid=table_id, title=table_title, cc=collapse_class)
+                <table id="{tid}" class="table table-condensed mqc_table{vc}" data-title="{title}">
+        """.format( tid=table_id, title=table_title, cc=collapse_class, vc=virtual_class))
 
     # Build the header row
     col1_header = dt.pconfig.get('col1_header', 'Sample Name')
-    html += '<thead><tr><th class="rowheader">{}</th>{}</tr></thead>'.format(col1_header, ''.join(t_headers.values()))
+    html.append('<thead><tr><th class="rowheader">{}</th>{}</tr></thead>'.format(col1_header, ''.join(t_headers.values())))
 
     # Build the table body
-    html += '<tbody>'
+    html.append('<tbody>')
     t_row_keys = t_rows.keys()
     if dt.pconfig.get('sortRows') is not False:
         t_row_keys = sorted(t_row_keys)
-    for s_name in t_row_keys:
-        html += '<tr>'
-        # Sample name row header
-        html += '<th class="rowheader" data-original-sn="{sn}">{sn}</th>'.format(sn=s_name)
-        for k in t_headers:
-            html += t_rows[s_name].get(k, empty_cells[k])
-        html += '</tr>'
-    html += '</tbody></table></div>'
-    if len(t_rows) > 10 and config.collapse_tables:
-        html += '<div class="mqc-table-expand"><span class="glyphicon glyphicon-chevron-down" aria-hidden="true"></span></div>'
-    html += '</div>'
+    if virtual:
+        # Rows are built in the browser from column-oriented JSON
+        report.plot_data[table_id] = virtual_plot_data(t_row_keys, v_cols)
+    else:
+        row_cols = [ (t_cols[rid], empty_cells[rid]) for rid in t_headers ]
+        for s_name in t_row_keys:
+            # Sample name row header
+            html.append('<tr><th class="rowheader" data-original-sn="{sn}">{sn}</th>'.format(sn=s_name))
+            html.extend([ col.get(s_name, empty) for col, empty in row_cols ])
+            html.append('</tr>')
+    html.append('</tbody></table></div>')
+    if len(t_rows) > 10 and config.collapse_tables and not virtual:
+        html.append('<div class="mqc-table-expand"><span class="glyphicon glyphicon-chevron-down" aria-hidden="true"></span></div>')
+    html.append('</div>')
 
     # Build the bootstrap modal to customise columns and order
     if not config.simple_output:
-        html += """
+        html.append("""
     <!-- MultiQC Table Columns Modal -->
     <div class="modal fade" id="{tid}_configModal" tabindex="-1">
       <div class="modal-dialog modal-lg">
@@ -293,7 +320,7 @@ def make_table (dt):
             </table>
         </div>
         <div class="modal-footer"> <button type="button" class="btn btn-default" data-dismiss="modal">Close</button> </div>
-    </div> </div> </div>""".format( tid=table_id, title=table_title, trows=''.join(t_modal_headers.values()) )
+    </div> </div> </div>""".format( tid=table_id, title=table_title, trows=''.join(t_modal_headers.values()) ))
 
     # Save the raw values to a file if requested
     if dt.pconfig.get('save_file') is True:
@@ -301,10 +328,102 @@ def make_table (dt):
         util_functions.write_data_file(dt.raw_vals, fn )
         report.saved_raw_data[fn] = dt.raw_vals
 
-    return html
-
-
-
-
+    return ''.join(html)
 
 
+def column_percentages(column, dmin, dmax):
+    """
+    Work out the widths of the bars behind the values in a table column,
+    as a percentage of the way from dmin to dmax, between 0 and 100.
+    :param column: Column dict from the datatable
+    :return: list of percentages, one for each value
+    """
+    if dmax - dmin == 0:
+        return [0] * len(column['vals'])
+    with np.errstate(all='ignore'):
+        pct = ((column['values'] - dmin) / (dmax - dmin)) * 100
+    percentages = pct.tolist()
+    for i in np.flatnonzero(pct > 100):
+        percentages[i] = 100
+    for i in np.flatnonzero(pct < 0):
+        percentages[i] = 0
+    # Values that aren't plain numbers may not convert at all
+    for i in np.flatnonzero(~column['mask']):
+        try:
+            float(column['vals'][i])
+        except ValueError:
+            percentages[i] = 0
+    return percentages
+
+
+def virtual_column(header, c_scale, column, locale_chars):
+    """
+    Collect the values for one column of a virtual table.
+    Cell colours are stored as indexes into a list of the colours used.
+    :param column: Column dict from the datatable
+    :return: dict with the column config and values keyed by sample name
+    """
+    col_snames = column['s_names']
+    col_vals = column['vals']
+    vals = dict()
+    colours = dict()
+    palette = OrderedDict()
+    if header['scale'] and c_scale is not None:
+        for s_name, c in zip(col_snames, c_scale.get_colours_for_values(col_vals, column['values'], column['mask'])):
+            if c != '':
+                colours[s_name] = palette.setdefault(c, len(palette))
+    finite = np.isfinite(column['values'])
+    nums = dict(zip(col_snames, np.where(finite, column['values'], 0).tolist()))
+    for i in np.flatnonzero(~finite):
+        nums[col_snames[i]] = None
+    fmt = header['format'].format
+    for s_name, val in zip(col_snames, col_vals):
+        if not header['scale']:
+            vals[s_name] = '{}'.format(val)
+            continue
+        try:
+            valstring = str(fmt(val))
+        except ValueError:
+            try:
+                valstring = str(fmt(float(val)))
+            except ValueError:
+                valstring = str(val)
+        except:
+            valstring = str(val)
+        vals[s_name] = valstring.translate(locale_chars)
+
+    return {
+        'scale': bool(header['scale']),
+        'dmin': header['dmin'],
+        'dmax': header['dmax'],
+        'suffix': header.get('suffix', ''),
+        'palette': list(palette.keys()),
+        'vals': vals,
+        'nums': nums,
+        'colours': colours
+    }
+
+
+def virtual_plot_data(s_names, v_cols):
+    """
+    Build the plot data for a virtual table, with one array per
+    column in the same order as the list of sample names.
+    """
+    s_names = list(s_names)
+    columns = OrderedDict()
+    for rid, col in v_cols.items():
+        columns[rid] = {
+            'scale': col['scale'],
+            'dmin': col['dmin'],
+            'dmax': col['dmax'],
+            'suffix': col['suffix'],
+            'palette': col['palette'],
+            'vals': [ col['vals'].get(s_name) for s_name in s_names ],
+            'nums': [ col['nums'].get(s_name) for s_name in s_names ],
+            'colours': [ col['colours'].get(s_name) for s_name in s_names ]
+        }
+    return {
+        'plot_type': 'table',
+        'samples': s_names,
+        'columns': columns
+    }
@@ -4,18 +4,30 @@
 
 from collections import defaultdict, OrderedDict
 import logging
+import numpy as np
 import re
 
 from multiqc.utils import config, report
 
 logger = logging.getLogger(__name__)
 
+# Python number types that can go straight into a NumPy float array
+try:
+    plain_number_types = (float, int, long)
+except NameError:
+    plain_number_types = (float, int)
+
 class datatable (object):
     """ Data table class. Prepares and holds data and configuration
-    for either a table or a beeswarm plot. """
+    for either a table or a beeswarm plot.
+
+    As well as the headers, the values are held column by column in
+    self.columns: a list with one dict per table section, giving a
+    column dict for every header key. See make_column(). """
 
     def __init__ (self, data, headers=None, pconfig=None):
-        """ Prepare data for use in a table or plot """
+        """ Prepare data for use in a table or plot. The data and headers
+        that are passed in are not changed. """
         if headers is None:
             headers = []
         if pconfig is None:
@@ -28,155 +40,147 @@ class datatable (object):
             headers = [headers]
 
         sectcols = ['55,126,184', '77,175,74', '152,78,163', '255,127,0', '228,26,28', '255,255,51', '166,86,40', '247,129,191', '153,153,153']
-        shared_keys = defaultdict(lambda: dict())
+        self.data = list()
+        self.headers = list()
+        self.columns = list()
 
         # Go through each table section
         for idx, d in enumerate(data):
 
-            # Get the header keys
+            # Ensure that sample names and keys are strings, not numeric.
+            # Only copy the data if we have to.
+            key_types = set(map(type, d)) | set(map(type, set().union(*d.values())))
+            if not key_types.issubset(set([str])):
+                d = OrderedDict([ (str(s_name), OrderedDict([ (str(k), v) for k, v in samp.items() ])) for s_name, samp in d.items() ])
+            self.data.append(d)
+
+            # Get the header keys, copying the header config
             try:
-                keys = headers[idx].keys()
-                assert len(keys) > 0
+                hs = headers[idx]
+                assert len(hs.keys()) > 0
+                section_headers = OrderedDict() if type(hs) is OrderedDict else dict()
+                for k, header in hs.items():
+                    section_headers[str(k)] = dict(header)
             except (IndexError, AttributeError, AssertionError):
-                keys = list()
-                for samp in d.values():
-                    for k in samp.keys():
-                        if k not in keys:
-                            keys.append(k)
-                try:
-                    headers[idx]
-                except IndexError:
-                    headers.append(list)
-                headers[idx] = OrderedDict()
-                for k in keys:
-                    headers[idx][k] = {}
-
-            # Ensure that keys are strings, not numeric
-            keys = [str(k) for k in keys]
-            for k in list(headers[idx].keys()):
-                headers[idx][str(k)] = headers[idx].pop(k)
-            # Ensure that all sample names are strings as well
-            data[idx] = {str(k):v for k,v in data[idx].items()}
-            for s_name in data[idx].keys():
-                for k in list(data[idx][s_name].keys()):
-                    data[idx][s_name][str(k)] = data[idx][s_name].pop(k)
-
-            # Check that we have some data in each column
-            empties = list()
-            for k in keys:
-                n = 0
+                section_headers = OrderedDict()
                 for samp in d.values():
-                    if k in samp:
-                        n += 1
-                if n == 0:
-                    empties.append(k)
-            for k in empties:
-                keys = [j for j in keys if j != k]
-                del headers[idx][k]
-
-            for k in keys:
+                    for k in samp:
+                        if k not in section_headers:
+                            section_headers[k] = {}
+            self.headers.append(section_headers)
+
+            # Collect the values column by column, dropping columns with no data
+            section_columns = dict()
+            items = list(d.items())
+            for k in list(section_headers.keys()):
+                s_names = [ s_name for s_name, samp in items if k in samp ]
+                if len(s_names) == 0:
+                    del section_headers[k]
+                    continue
+                section_columns[k] = [ s_names, [ samp[k] for s_name, samp in items if k in samp ] ]
+            self.columns.append(section_columns)
+
+            for k, header in section_headers.items():
                 # Unique id to avoid overwriting by other datasets
-                headers[idx][k]['rid'] = report.save_htmlid(re.sub(r'\W+', '_', k))
+                header['rid'] = report.save_htmlid(re.sub(r'\W+', '_', k))
 
                 # Applying defaults presets for data keys if shared_key is set to base_count or read_count
-                shared_key = headers[idx][k].get('shared_key', None)
+                shared_key = header.get('shared_key', None)
                 if shared_key in ['read_count', 'base_count']:
                     if shared_key == 'read_count':
                         multiplier = config.read_count_multiplier
                     else:
                         multiplier = config.base_count_multiplier
-                    if headers[idx][k].get('modify') is None:
-                        headers[idx][k]['modify'] = lambda x: x * multiplier
-                    if headers[idx][k].get('min') is None:
-                        headers[idx][k]['min'] = 0
-                    if headers[idx][k].get('format') is None:
+                    if header.get('modify') is None:
+                        header['modify'] = lambda x: x * multiplier
+                    if header.get('min') is None:
+                        header['min'] = 0
+                    if header.get('format') is None:
                         if multiplier == 1:
-                            headers[idx][k]['format'] = '{:,.0f}'
+                            header['format'] = '{:,.0f}'
 
                 # Use defaults / data keys if headers not given
-                headers[idx][k]['namespace']   = headers[idx][k].get('namespace', pconfig.get('namespace', ''))
-                headers[idx][k]['title']       = headers[idx][k].get('title', k)
-                headers[idx][k]['description'] = headers[idx][k].get('description', headers[idx][k]['title'])
-                headers[idx][k]['scale']       = headers[idx][k].get('scale', pconfig.get('scale', 'GnBu'))
-                headers[idx][k]['format']      = headers[idx][k].get('format', pconfig.get('format', '{:,.1f}'))
-                headers[idx][k]['colour']      = headers[idx][k].get('colour', pconfig.get('colour', None))
-                headers[idx][k]['hidden']      = headers[idx][k].get('hidden', pconfig.get('hidden', None))
-                headers[idx][k]['max']         = headers[idx][k].get('max', pconfig.get('max', None))
-                headers[idx][k]['min']         = headers[idx][k].get('min', pconfig.get('min', None))
-                headers[idx][k]['ceiling']     = headers[idx][k].get('ceiling', pconfig.get('ceiling', None))
-                headers[idx][k]['floor']       = headers[idx][k].get('floor', pconfig.get('floor', None))
-                headers[idx][k]['minRange']    = headers[idx][k].get('minRange', pconfig.get('minRange', None))
-                headers[idx][k]['shared_key']  = headers[idx][k].get('shared_key', pconfig.get('shared_key', None))
-                headers[idx][k]['modify']      = headers[idx][k].get('modify', pconfig.get('modify', None))
-                headers[idx][k]['placement']   = float( headers[idx][k].get('placement', 1000) )
-
-                if headers[idx][k]['colour'] is None:
+                header['namespace']   = header.get('namespace', pconfig.get('namespace', ''))
+                header['title']       = header.get('title', k)
+                header['description'] = header.get('description', header['title'])
+                header['scale']       = header.get('scale', pconfig.get('scale', 'GnBu'))
+                header['format']      = header.get('format', pconfig.get('format', '{:,.1f}'))
+                header['colour']      = header.get('colour', pconfig.get('colour', None))
+                header['hidden']      = header.get('hidden', pconfig.get('hidden', None))
+                header['max']         = header.get('max', pconfig.get('max', None))
+                header['min']         = header.get('min', pconfig.get('min', None))
+                header['ceiling']     = header.get('ceiling', pconfig.get('ceiling', None))
+                header['floor']       = header.get('floor', pconfig.get('floor', None))
+                header['minRange']    = header.get('minRange', pconfig.get('minRange', None))
+                header['shared_key']  = header.get('shared_key', pconfig.get('shared_key', None))
+                header['modify']      = header.get('modify', pconfig.get('modify', None))
+                header['placement']   = float( header.get('placement', 1000) )
+
+                if header['colour'] is None:
                     cidx = idx
                     while cidx >= len(sectcols):
                         cidx -= len(sectcols)
-                    headers[idx][k]['colour'] = sectcols[cidx]
+                    header['colour'] = sectcols[cidx]
 
                 # Overwrite hidden if set in user config
                 try:
                     # Config has True = visibile, False = Hidden. Here we're setting "hidden" which is inverse
-                    headers[idx][k]['hidden'] = not config.table_columns_visible[ headers[idx][k]['namespace'] ][k]
+                    header['hidden'] = not config.table_columns_visible[ header['namespace'] ][k]
                 except KeyError:
                     pass
 
                 # Also overwite placement if set in config
                 try:
-                    headers[idx][k]['placement'] = float(config.table_columns_placement[ headers[idx][k]['namespace'] ][k])
+                    header['placement'] = float(config.table_columns_placement[ header['namespace'] ][k])
                 except (KeyError, ValueError):
                     pass
 
+                # Apply any modify function and convert the column to numbers
+                modify = header['modify'] if callable(header['modify']) else None
+                col = make_column(section_columns[k][0], section_columns[k][1], modify)
+                section_columns[k] = col
+
                 # Work out max and min value if not given
                 setdmax = False
                 setdmin = False
                 try:
-                    headers[idx][k]['dmax'] = float(headers[idx][k]['max'])
+                    header['dmax'] = float(header['max'])
                 except TypeError:
-                    headers[idx][k]['dmax'] = 0
+                    header['dmax'] = 0
                     setdmax = True
 
                 try:
-                    headers[idx][k]['dmin'] = float(headers[idx][k]['min'])
+                    header['dmin'] = float(header['min'])
                 except TypeError:
-                    headers[idx][k]['dmin'] = 0
+                    header['dmin'] = 0
                     setdmin = True
 
                 # Figure out the min / max if not supplied
                 if setdmax or setdmin:
-                    for s_name, samp in data[idx].items():
-                        try:
-                            val = float(samp[k])
-                            if callable(headers[idx][k]['modify']):
-                                val = float(headers[idx][k]['modify'](val))
-                            if setdmax:
-                                headers[idx][k]['dmax'] = max(headers[idx][k]['dmax'], val)
-                            if setdmin:
-                                headers[idx][k]['dmin'] = min(headers[idx][k]['dmin'], val)
-                        except ValueError:
-                            val = samp[k] # couldn't convert to float - keep as a string
-                        except KeyError:
-                            pass # missing data - skip
+                    nums = col['values'][~np.isnan(col['values'])]
+                    if len(nums) > 0:
+                        if setdmax and nums.max() > header['dmax']:
+                            header['dmax'] = float(nums.max())
+                        if setdmin and nums.min() < header['dmin']:
+                            header['dmin'] = float(nums.min())
                     # Limit auto-generated scales with floor, ceiling and minRange.
-                    if headers[idx][k]['ceiling'] is not None and headers[idx][k]['max'] is None:
-                        headers[idx][k]['dmax'] = min(headers[idx][k]['dmax'], float(headers[idx][k]['ceiling']))
-                    if headers[idx][k]['floor'] is not None and headers[idx][k]['min'] is None:
-                        headers[idx][k]['dmin'] = max(headers[idx][k]['dmin'], float(headers[idx][k]['floor']))
-                    if headers[idx][k]['minRange'] is not None:
-                        drange = headers[idx][k]['dmax'] - headers[idx][k]['dmin']
-                        if drange < float(headers[idx][k]['minRange']):
-                            headers[idx][k]['dmax'] = headers[idx][k]['dmin'] + float(headers[idx][k]['minRange'])
+                    if header['ceiling'] is not None and header['max'] is None:
+                        header['dmax'] = min(header['dmax'], float(header['ceiling']))
+                    if header['floor'] is not None and header['min'] is None:
+                        header['dmin'] = max(header['dmin'], float(header['floor']))
+                    if header['minRange'] is not None:
+                        drange = header['dmax'] - header['dmin']
+                        if drange < float(header['minRange']):
+                            header['dmax'] = header['dmin'] + float(header['minRange'])
 
         # Collect settings for shared keys
         shared_keys = defaultdict(lambda: dict())
-        for idx, hs in enumerate(headers):
-            for k in hs.keys():
-                sk = headers[idx][k]['shared_key']
+        for hs in self.headers:
+            for header in hs.values():
+                sk = header['shared_key']
                 if sk is not None:
-                    shared_keys[sk]['dmax']  = max(headers[idx][k]['dmax'], shared_keys[sk].get('dmax', headers[idx][k]['dmax']))
-                    shared_keys[sk]['dmin']  = max(headers[idx][k]['dmin'], shared_keys[sk].get('dmin', headers[idx][k]['dmin']))
+                    shared_keys[sk]['dmax']  = max(header['dmax'], shared_keys[sk].get('dmax', header['dmax']))
+                    shared_keys[sk]['dmin']  = max(header['dmin'], shared_keys[sk].get('dmin', header['dmin']))
 
         # Overwrite shared key settings and at the same time assign to buckets for sorting
         # Within each section of headers, sort explicitly by 'title' if the dict
@@ -185,22 +189,20 @@ class datatable (object):
         # Of course, the user can shuffle these manually.
         self.headers_in_order = defaultdict(list)
 
-        for idx, hs in enumerate(headers):
+        for idx, hs in enumerate(self.headers):
             keys_in_section = hs.keys()
             if type(hs) is not OrderedDict:
-                keys_in_section = sorted(keys_in_section, key=lambda k: headers[idx][k]['title'])
+                keys_in_section = sorted(keys_in_section, key=lambda k: hs[k]['title'])
 
             for k in keys_in_section:
-                sk = headers[idx][k]['shared_key']
+                sk = hs[k]['shared_key']
                 if sk is not None:
-                    headers[idx][k]['dmax'] = shared_keys[sk]['dmax']
-                    headers[idx][k]['dmin'] = shared_keys[sk]['dmin']
+                    hs[k]['dmax'] = shared_keys[sk]['dmax']
+                    hs[k]['dmin'] = shared_keys[sk]['dmin']
 
-                self.headers_in_order[headers[idx][k]['placement']].append((idx, k))
+                self.headers_in_order[hs[k]['placement']].append((idx, k))
 
         # Assign to class
-        self.data = data
-        self.headers = headers
         self.pconfig = pconfig
 
     def get_headers_in_order(self):
@@ -213,3 +215,104 @@ class datatable (object):
             for idx, k in self.headers_in_order[bucket]:
                 res.append( (idx, k, self.headers[idx][k]) )
         return res
+
+
+def make_column(s_names, raw, modify=None):
+    """
+    Hold the values of one table column in NumPy arrays, so that scales
+    and colours can be worked out for the whole column at once.
+    :param s_names: List of sample names that have a value
+    :param raw: List of values, as given by the module
+    :param modify: Optional header 'modify' function
+    :return: dict with the sample names, the raw values, the values to
+             display ('vals', after any modify function), the same values
+             as a float array ('values', NaN if not a number) and a boolean
+             'mask' that is True where the value is a plain int or float.
+             Anything else (strings, None etc.) is left to be handled one
+             value at a time from 'vals'.
+    """
+    raw_types = set(map(type, raw))
+    plain = raw_types.issubset(plain_number_types)
+
+    vals = raw
+    values = None
+    if modify is not None:
+        vals = None
+        if plain and len(raw) > 0:
+            vals, values = modify_column(raw, modify, raw_types)
+        if vals is None:
+            vals = [ modify(v) for v in raw ]
+            plain = set(map(type, vals)).issubset(plain_number_types)
+
+    if plain:
+        if values is None:
+            values = np.array(vals, dtype=float)
+        mask = np.ones(len(vals), dtype=bool)
+    else:
+        # Mixed types - convert what we can
+        values = np.empty(len(vals))
+        mask = np.zeros(len(vals), dtype=bool)
+        for i, v in enumerate(vals):
+            if type(v) in plain_number_types:
+                mask[i] = True
+            try:
+                values[i] = float(v)
+            except (TypeError, ValueError):
+                values[i] = np.nan
+
+    return {
+        's_names': s_names,
+        'raw': raw,
+        'vals': vals,
+        'values': values,
+        'mask': mask
+    }
+
+
+def modify_column(raw, modify, raw_types):
+    """
+    Try to run a header 'modify' function on a whole column of plain
+    numbers at once. Arithmetic on a float array gives exactly the same
+    results as on each Python float. Functions that give ints for ints
+    (eg. x * 2) are run on an int array instead, and functions that don't
+    work on arrays at all (eg. float(x)) one value at a time.
+    :return: tuple of (list of modified values, float array) or (None, None)
+    """
+    x = np.array(raw, dtype=float)
+    values = run_modify(modify, x)
+    if values is None:
+        return None, None
+    values = values.astype(float)
+    vals = values.tolist()
+    if raw_types != set([float]):
+        # Ints are only safe if the function gives floats for them, and
+        # if they are small enough to be exactly the same as floats
+        ints = np.flatnonzero([ type(v) is not float for v in raw ])
+        if type(modify(raw[ints[0]])) is not float or np.abs(x[ints]).max() >= 2**53:
+            # Functions that give ints for ints can be run on an int array,
+            # as long as the numbers are small enough not to overflow
+            ivals = None
+            if len(ints) == len(raw) and np.abs(x).max() < 2**31:
+                ivals = run_modify(modify, np.array(raw, dtype=np.int64))
+            if ivals is not None and ivals.dtype.kind in 'iu':
+                vals = ivals.tolist()
+            else:
+                for i in ints:
+                    vals[i] = modify(raw[i])
+                    if type(vals[i]) not in plain_number_types:
+                        return None, None
+                    values[i] = float(vals[i])
+    return vals, values
+
+
+def run_modify(modify, x):
+    """ Run a modify function on a NumPy array, returning None if
+    it doesn't work or doesn't give an array of numbers back """
+    try:
+        with np.errstate(all='ignore'):
+            values = modify(x)
+    except Exception:
+        return None
+    if not isinstance(values, np.ndarray) or values.shape != x.shape or values.dtype.kind not in 'fiu':
+        return None
+    return values
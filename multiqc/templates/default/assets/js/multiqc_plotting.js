@@ -25,6 +25,8 @@ $(function () {
 
   // Decompress the JSON plot data
   mqc_plots = JSON.parse(LZString.decompressFromBase64(mqc_compressed_plotdata));
+  expand_xy_line_data();
+  $(document).trigger('mqc_plotdata_loaded');
 
   // HighCharts Defaults
   window.HCDefaults = $.extend(true, {}, Highcharts.getOptions(), {});
@@ -221,6 +223,29 @@ $(function () {
 
 });
 
+// Line graph series can be saved as just their y values, with an index into
+// a list of x values shared between series. Turn them back into [x, y] pairs.
+function expand_xy_line_data(){
+  $.each(mqc_plots, function(target, plot){
+    if(plot['plot_type'] != 'xy_line' || plot['xvals'] === undefined){ return true; }
+    for (var i = 0; i < plot['datasets'].length; i++){
+      for (var j = 0; j < plot['datasets'][i].length; j++){
+        var series = plot['datasets'][i][j];
+        if(series['y'] === undefined){ continue; }
+        var x = plot['xvals'][series['xref']];
+        var data = new Array(x.length);
+        for (var k = 0; k < x.length; k++){
+          data[k] = [x[k], series['y'][k]];
+        }
+        series['data'] = data;
+        delete series['y'];
+        delete series['xref'];
+      }
+    }
+    delete plot['xvals'];
+  });
+}
+
 // Call to render any plot
 function plot_graph(target, ds, max_num){
   if(mqc_plots[target] === undefined){ return false; }
@@ -252,6 +277,11 @@ function plot_graph(target, ds, max_num){
         $('#'+target).addClass('not_rendered gt_max_num_ds').html('<button class="btn btn-default btn-lg render_plot">Show plot</button>');
       }
     }
+    // Binned scatter plots - fixed size, so always plot
+    else if(mqc_plots[target]['plot_type'] == 'scatter_density'){
+      plot_scatter_density(target, ds);
+      $('#'+target).removeClass('not_rendered');
+    }
     // Beeswarm graphs
     else if(mqc_plots[target]['plot_type'] == 'beeswarm'){
       if(max_num === undefined || mqc_plots[target]['samples'][0].length < max_num){
@@ -261,6 +291,11 @@ function plot_graph(target, ds, max_num){
         $('#'+target).addClass('not_rendered gt_max_num_ds').html('<button class="btn btn-default btn-lg render_plot">Show plot</button>');
       }
     }
+    // Summarised beeswarm graphs - fixed size, so always plot
+    else if(mqc_plots[target]['plot_type'] == 'beeswarm_summary'){
+      plot_beeswarm_summary_graph(target, ds);
+      $('#'+target).removeClass('not_rendered');
+    }
     // Heatmap plots
     else if(mqc_plots[target]['plot_type'] == 'heatmap'){
       if(max_num === undefined || mqc_plots[target]['xcats'][0].length < max_num){
@@ -836,6 +871,190 @@ function plot_scatter_plot (target, ds){
   });
 }
 
+// Scatter plot with the points binned - squares drawn as a heatmap,
+// hexagons as markers sized by the number of points in them
+function plot_scatter_density(target, ds){
+  if(mqc_plots[target] === undefined || mqc_plots[target]['plot_type'] !== 'scatter_density'){
+    return false;
+  }
+  var config = mqc_plots[target]['config'];
+  if(ds === undefined){ ds = 0; }
+  var data = mqc_plots[target]['datasets'][ds];
+  var samples = data['samples'].slice();
+
+  if(config['marker_colour'] === undefined){ config['marker_colour'] = 'rgba(124, 181, 236, .5)'; }
+  if(config['marker_size'] === undefined){ config['marker_size'] = 5; }
+  if (config['xDecimals'] === undefined){ config['xDecimals'] = true; }
+  if (config['yDecimals'] === undefined){ config['yDecimals'] = true; }
+
+  // Rename samples
+  if(window.mqc_rename_f_texts.length > 0){
+    for (var i = 0; i < samples.length; i++) {
+      $.each(window.mqc_rename_f_texts, function(idx, f_text){
+        if(window.mqc_rename_regex_mode){
+          var re = new RegExp(f_text,"g");
+          samples[i] = samples[i].replace(re, window.mqc_rename_t_texts[idx]);
+        } else {
+          samples[i] = samples[i].replace(f_text, window.mqc_rename_t_texts[idx]);
+        }
+      });
+    }
+  }
+
+  // Hide samples - only affects the highlighted points, not the binned counts
+  var hidden = {};
+  var num_hidden = 0;
+  $('#'+target).closest('.mqc_hcplot_plotgroup').parent().find('.samples-hidden-warning').remove();
+  if(window.mqc_hide_f_texts.length > 0){
+    for (var i = 0; i < samples.length; i++) {
+      var match = false;
+      for (var k = 0; k < window.mqc_hide_f_texts.length; k++) {
+        var f_text = window.mqc_hide_f_texts[k];
+        if(window.mqc_hide_regex_mode){
+          if(samples[i].match(f_text)){ match = true; }
+        } else {
+          if(samples[i].indexOf(f_text) > -1){ match = true; }
+        }
+      }
+      if(window.mqc_hide_mode == 'show'){
+        match = !match;
+      }
+      if(match){
+        hidden[i] = true;
+        num_hidden += 1;
+      }
+    }
+    if(num_hidden > 0) {
+      var alert = '<div class="samples-hidden-warning alert alert-warning"><span class="glyphicon glyphicon-info-sign"></span> <strong>Warning:</strong> '+num_hidden+' samples hidden from the highlights. The binned counts include all samples. <a href="#mqc_hidesamples" class="alert-link" onclick="mqc_toolbox_openclose(\'#mqc_hidesamples\', true); return false;">See toolbox.</a></div>';
+      $('#'+target).closest('.mqc_hcplot_plotgroup').before(alert);
+    }
+  }
+
+  // Highlighted samples are drawn in the middle of each cell they have points in
+  var highlights = [];
+  if(window.mqc_highlight_f_texts.length > 0){
+    for (var i = 0; i < samples.length; i++) {
+      if(hidden[i]){ continue; }
+      var colour = undefined;
+      $.each(window.mqc_highlight_f_texts, function(idx, f_text){
+        if(f_text == ''){ return true; }
+        if((window.mqc_highlight_regex_mode && samples[i].match(f_text)) || (!window.mqc_highlight_regex_mode && samples[i].indexOf(f_text) > -1)){
+          colour = window.mqc_highlight_f_cols[idx];
+        }
+      });
+      if(colour === undefined){ continue; }
+      for (var c = 0; c < data['sample_cells'][i].length; c++){
+        var cell = data['cells'][data['sample_cells'][i][c]];
+        highlights.push({ 'x': cell[0], 'y': cell[1], 'name': samples[i], 'color': colour });
+      }
+    }
+  }
+
+  // The binned points
+  var maxcount = 1;
+  for (var c = 0; c < data['cells'].length; c++){
+    maxcount = Math.max(maxcount, data['cells'][c][2]);
+  }
+  var series = [];
+  if(data['type'] == 'hexbin'){
+    var cells = [];
+    for (var c = 0; c < data['cells'].length; c++){
+      cells.push({
+        'x': data['cells'][c][0],
+        'y': data['cells'][c][1],
+        'count': data['cells'][c][2],
+        'marker': { 'radius': Math.max(1, config['marker_size'] * 2 * Math.sqrt(data['cells'][c][2] / maxcount)) }
+      });
+    }
+    series.push({ type: 'scatter', color: config['marker_colour'], data: cells });
+  } else {
+    series.push({
+      type: 'heatmap',
+      data: data['cells'],
+      colsize: data['cellsize'][0],
+      rowsize: data['cellsize'][1]
+    });
+  }
+  series.push({ type: 'scatter', data: highlights, marker: { radius: 3, lineWidth: 1, lineColor: '#333333' } });
+  if(data['extra'] !== undefined){
+    series.push({ type: 'scatter', data: data['extra'] });
+  }
+
+  var chart_options = {
+    chart: {
+      zoomType: 'xy',
+      plotBorderWidth: 1,
+      height: config['square'] ? 500 : undefined,
+      width: config['square'] ? 500 : undefined
+    },
+    title: {
+      text: config['title'],
+      x: 30 // fudge to center over plot area rather than whole plot
+    },
+    xAxis: {
+      title: { text: config['xlab'] },
+      type: config['xLog'] ? 'logarithmic' : 'linear',
+      gridLineWidth: 1,
+      ceiling: config['xCeiling'],
+      floor: config['xFloor'],
+      max: config['xmax'],
+      min: config['xmin'],
+      minRange: config['xMinRange'],
+      allowDecimals: config['xDecimals'],
+      plotBands: config['xPlotBands'],
+      plotLines: config['xPlotLines']
+    },
+    yAxis: {
+      title: { text: config['ylab'] },
+      type: config['yLog'] ? 'logarithmic' : 'linear',
+      ceiling: config['yCeiling'],
+      floor: config['yFloor'],
+      max: config['ymax'],
+      min: config['ymin'],
+      minRange: config['yMinRange'],
+      allowDecimals: config['yDecimals'],
+      plotBands: config['yPlotBands'],
+      plotLines: config['yPlotLines']
+    },
+    plotOptions: {
+      series: {
+        animation: false,
+        turboThreshold: 0,
+        stickyTracking: false
+      }
+    },
+    legend: {
+      enabled: data['type'] != 'hexbin',
+      align: 'right',
+      layout: 'vertical',
+      verticalAlign: 'middle'
+    },
+    tooltip: {
+      useHTML: true,
+      formatter: function(){
+        var xy = 'X: <strong>~'+Highcharts.numberFormat(this.point.x, 2)+'</strong><br/>Y: <strong>~'+Highcharts.numberFormat(this.point.y, 2)+'</strong>';
+        var count = this.series.type == 'heatmap' ? this.point.value : this.point.count;
+        if(count !== undefined){
+          return xy+'<br/><strong>'+count+'</strong> points';
+        }
+        return '<span style="text-decoration:underline; font-weight:bold;">'+this.point.name+'</span><br/>'+xy;
+      }
+    },
+    series: series
+  };
+  // Colour scale for the counts in the squares
+  if(data['type'] != 'hexbin'){
+    chart_options['colorAxis'] = {
+      type: maxcount > 10 ? 'logarithmic' : 'linear',
+      min: 1,
+      max: maxcount,
+      minColor: '#f7fbff',
+      maxColor: '#08306b'
+    };
+  }
+  Highcharts.chart(target, chart_options);
+}
+
 // Beeswarm plot
 function plot_beeswarm_graph(target, ds){
   if(mqc_plots[target] === undefined || mqc_plots[target]['plot_type'] !== 'beeswarm'){
@@ -1146,6 +1365,270 @@ function plot_beeswarm_graph(target, ds){
   }
 }
 
+// Summarised beeswarm plot - density, quantiles and outliers for each category
+function plot_beeswarm_summary_graph(target, ds){
+  if(mqc_plots[target] === undefined || mqc_plots[target]['plot_type'] !== 'beeswarm_summary'){
+    return false;
+  }
+  var samples = mqc_plots[target]['samples'].slice();
+  var categories = mqc_plots[target]['categories'];
+  var summaries = mqc_plots[target]['summaries'];
+
+  // Rename samples
+  if(window.mqc_rename_f_texts.length > 0){
+    for (var i = 0; i < samples.length; i++) {
+      $.each(window.mqc_rename_f_texts, function(idx, f_text){
+        if(window.mqc_rename_regex_mode){
+          var re = new RegExp(f_text,"g");
+          samples[i] = samples[i].replace(re, window.mqc_rename_t_texts[idx]);
+        } else {
+          samples[i] = samples[i].replace(f_text, window.mqc_rename_t_texts[idx]);
+        }
+      });
+    }
+  }
+
+  // Highlight samples
+  var baseColour = 'rgb(55,126,184)';
+  var seriesColours = {};
+  if(window.mqc_highlight_f_texts.length > 0){
+    baseColour = 'rgb(80,80,80)';
+    for (var i = 0; i < samples.length; i++) {
+      $.each(window.mqc_highlight_f_texts, function(idx, f_text){
+        if((window.mqc_highlight_regex_mode && samples[i].match(f_text)) || (!window.mqc_highlight_regex_mode && samples[i].indexOf(f_text) > -1)){
+          seriesColours[i] = window.mqc_highlight_f_cols[idx];
+        }
+      });
+    }
+  }
+
+  // Hide samples - only affects the individual points, not the summaries
+  var hidden = {};
+  var num_hidden = 0;
+  $('#'+target).closest('.hc-plot-wrapper').parent().find('.samples-hidden-warning').remove();
+  if(window.mqc_hide_f_texts.length > 0){
+    for (var i = 0; i < samples.length; i++) {
+      var match = false;
+      for (var k = 0; k < window.mqc_hide_f_texts.length; k++) {
+        var f_text = window.mqc_hide_f_texts[k];
+        if(window.mqc_hide_regex_mode){
+          if(samples[i].match(f_text)){ match = true; }
+        } else {
+          if(samples[i].indexOf(f_text) > -1){ match = true; }
+        }
+      }
+      if(window.mqc_hide_mode == 'show'){
+        match = !match;
+      }
+      if(match){
+        hidden[i] = true;
+        num_hidden += 1;
+      }
+    }
+    if(num_hidden > 0) {
+      var alert = '<div class="samples-hidden-warning alert alert-warning"><span class="glyphicon glyphicon-info-sign"></span> <strong>Warning:</strong> '+num_hidden+' samples hidden from the points. The distributions are summarised from all samples. <a href="#mqc_hidesamples" class="alert-link" onclick="mqc_toolbox_openclose(\'#mqc_hidesamples\', true); return false;">See toolbox.</a></div>';
+      $('#'+target).closest('.hc-plot-wrapper').before(alert);
+    }
+  }
+
+  // Figure out how tall to make each plot
+  var ph_min = 40;
+  var ph_max = 100;
+  var pheight = 600 / categories.length;
+  pheight = Math.min(ph_max, Math.max(ph_min, pheight));
+
+  $('#'+target).html('<div class="beeswarm-hovertext"><em class="placeholder">Hover over a data point for more information</em></div><div class="beeswarm-plots"></div>');
+  $('#'+target).parent().css('height', ((pheight*categories.length)+40)+'px');
+
+  for (var i = 0; i < categories.length; i++) {
+    var summary = summaries[i];
+    var borderCol = categories[i]['bordercol'];
+    if (borderCol == undefined){
+      borderCol = '#cccccc';
+    }
+    if (categories[i]['namespace'] == ''){
+      var label = categories[i]['title'];
+      var label_long = categories[i]['description'];
+    } else{
+      var label = categories[i]['namespace'] + '<br/>' + categories[i]['title'];
+      var label_long = categories[i]['namespace'] + ': ' + categories[i]['description'];
+    }
+    var plotLines = [];
+    var plotBands = [];
+    var density = [];
+    var points = [];
+
+    if(summary['n'] > 0){
+      var minx = summary['min'];
+      var maxx = summary['max'];
+      var nbins = summary['counts'].length;
+      var binwidth = (maxx - minx) / nbins;
+      var maxcount = Math.max.apply(null, summary['counts']);
+      for (var b = 0; b < nbins; b++) {
+        var h = 0.9 * summary['counts'][b] / maxcount;
+        density.push({'x': minx + ((b + 0.5) * binwidth), 'low': -h, 'high': h});
+      }
+      var q = summary['quantiles'];
+      plotBands.push({ from: q[2], to: q[4], color: 'rgba(0,0,0,0.08)', zIndex: 1 });
+      plotLines.push({ value: q[3], width: 2, color: '#333333', zIndex: 4 });
+      plotLines.push({ value: q[1], width: 1, color: '#999999', dashStyle: 'Dash', zIndex: 4 });
+      plotLines.push({ value: q[5], width: 1, color: '#999999', dashStyle: 'Dash', zIndex: 4 });
+
+      // Outliers, with their real values
+      var is_outlier = {};
+      for (var o = 0; o < summary['outliers'].length; o++) {
+        var s_idx = summary['outliers'][o][0];
+        is_outlier[s_idx] = true;
+        if(hidden[s_idx]){ continue; }
+        points.push({
+          'x': summary['outliers'][o][1],
+          'y': ((o % 7) - 3) / 10,
+          'name': samples[s_idx],
+          'color': (s_idx in seriesColours) ? seriesColours[s_idx] : baseColour
+        });
+      }
+      // Highlighted samples are placed in the middle of their bin
+      var side = 0;
+      $.each(seriesColours, function(s_idx, col){
+        var b = summary['bins'][s_idx];
+        if(b < 0 || is_outlier[s_idx] || hidden[s_idx]){ return true; }
+        side += 1;
+        points.push({
+          'x': minx + ((b + 0.5) * binwidth),
+          'y': ((side % 7) - 3) / 10,
+          'name': samples[s_idx],
+          'color': col,
+          'binned': true
+        });
+      });
+    }
+
+    // Draw the density as two mirrored areas, as there's no arearange without highcharts-more
+    var upper = $.map(density, function(d){ return [[d['x'], d['high']]]; });
+    var lower = $.map(density, function(d){ return [[d['x'], d['low']]]; });
+
+    $('<div class="beeswarm-plot" />')
+      .appendTo('#'+target+' .beeswarm-plots')
+      .css({
+        'border-left': '2px solid '+borderCol,
+        'height': (100/categories.length)+'%'
+      })
+      .highcharts({
+        chart: {
+          spacingTop: 0,
+          marginBottom: 0,
+          marginRight: 20,
+          marginLeft: 180,
+          backgroundColor: 'transparent',
+          events: {
+            load: function(chart) {
+              setTimeout(function(){
+                chart.target.reflow();
+              }, 200);
+            }
+          }
+        },
+        title: {
+          text: label,
+          align: 'left',
+          verticalAlign: 'middle',
+          y: 10,
+          useHTML: true,
+          style: { fontSize: '12px' }
+        },
+        yAxis: {
+          max: 1,
+          min: -1,
+          gridLineWidth: 0,
+          title: {text: null},
+          labels: {enabled: false},
+          lineWidth: 0
+        },
+        xAxis: {
+          lineWidth: 0,
+          tickWidth: 0,
+          tickPixelInterval: 200,
+          labels: {
+            reserveSpace: false,
+            y: (-1*(pheight/2))+5,
+            zIndex: 1,
+            style: { color: '#999999' }
+          },
+          min: summary['min'],
+          max: summary['max'],
+          plotLines: plotLines,
+          plotBands: plotBands
+        },
+        tooltip: {
+          valueSuffix: categories[i]['suffix'],
+          valueDecimals: categories[i]['decimalPlaces'],
+          formatter: function(){
+            var value = Highcharts.numberFormat(this.point.x, this.series.tooltipOptions.valueDecimals);
+            if(this.point.binned){ value = '~'+value; }
+            var suff = this.series.tooltipOptions.valueSuffix;
+            var ttstring = '<span style="float:right;">'+this.series.name+'</span><samp>'+this.point.name+'</samp>: &nbsp; <strong>'+value+' '+suff+'</strong>';
+            $('#'+target+' .beeswarm-hovertext').html(ttstring);
+            return false;
+          }
+        },
+        plotOptions: {
+          area: {
+            color: borderCol,
+            fillOpacity: 0.5,
+            lineWidth: 0,
+            marker: { enabled: false },
+            enableMouseTracking: false,
+            threshold: 0
+          },
+          scatter: {
+            name: label_long,
+            turboThreshold: 0,
+            stickyTracking: false,
+            marker: {
+              radius: 2.5,
+              states: { hover: { radiusPlus: 4, lineWidthPlus: 2, lineColor: '#333333' } }
+            },
+            point: {
+              events: {
+                mouseOver: function (e) {
+                  var hovName = this.name;
+                  $('#'+target+' .beeswarm-plot').each(function(){
+                    var plot = $(this).highcharts();
+                    var pts = plot.series[2].data;
+                    for (var p = 0; p < pts.length; ++p) {
+                      if(pts[p].name == hovName){ pts[p].setState('hover'); }
+                    }
+                  });
+                },
+                mouseOut: function () {
+                  $('#'+target+' .beeswarm-plot').each(function(){
+                    var plot = $(this).highcharts();
+                    var pts = plot.series[2].data;
+                    for (var p = 0; p < pts.length; ++p) { pts[p].setState(); }
+                  });
+                  $('#'+target+' .beeswarm-hovertext').html('<em class="placeholder">Hover over a data point for more information</em>');
+                }
+              }
+            }
+          }
+        },
+        legend: { enabled: false },
+        credits: { enabled: false },
+        exporting: { enabled: false },
+        series: [
+          { type: 'area', data: upper },
+          { type: 'area', data: lower },
+          {
+            type: 'scatter',
+            data: points,
+            // Workaround for HighCharts bug. See https://github.com/highcharts/highcharts/issues/1440
+            marker: { states: { hover: { fillColor: {} } } }
+          }
+        ]
+      });
+  }
+}
+
 // Heatmap plot
 function plot_heatmap(target, ds){
   if(mqc_plots[target] === undefined || mqc_plots[target]['plot_type'] !== 'heatmap'){
@@ -1155,9 +1638,13 @@ function plot_heatmap(target, ds){
 
   if(config['square'] === undefined){ config['square'] = true; }
 
-  // Make a clone of the data, so that we can mess with it,
-  // while keeping the original data in tact
-  var data = JSON.parse(JSON.stringify(mqc_plots[target]['data']));
+  // Large heatmaps are split into tiles, which are only drawn when zoomed in
+  if(mqc_plots[target]['tiles'] !== undefined){
+    return plot_heatmap_tiled(target);
+  }
+
+  // Make the points from the values, so that we can mess with them
+  var data = heatmap_cells(mqc_plots[target]['values'], mqc_plots[target]['cols'], 0, 0);
   var xcats = JSON.parse(JSON.stringify(mqc_plots[target]['xcats']));
   var ycats = JSON.parse(JSON.stringify(mqc_plots[target]['ycats']));
 
@@ -1209,7 +1696,7 @@ function plot_heatmap(target, ds){
         });
       }
       // Reshape the data - needs deepcopy as indexes are updated
-      var newdata = JSON.parse(JSON.stringify(mqc_plots[target]['data']));
+      var newdata = heatmap_cells(mqc_plots[target]['values'], mqc_plots[target]['cols'], 0, 0);
       var new_xcats = [], new_ycats = [];
       var xidx = 0, yidx = 0;
       for (hl = window.mqc_highlight_f_texts.length; hl >= 0; hl--){
@@ -1374,39 +1861,12 @@ function plot_heatmap(target, ds){
     if(config['min'] === undefined){ config['min'] = dmin; }
     if(config['max'] === undefined){ config['max'] = dmax; }
   }
-  if(config['colstops'] === undefined){
-    config['colstops'] = [
-      [0, '#313695'],
-      [0.1, '#4575b4'],
-      [0.2, '#74add1'],
-      [0.3, '#abd9e9'],
-      [0.4, '#e0f3f8'],
-      [0.5, '#ffffbf'],
-      [0.6, '#fee090'],
-      [0.7, '#fdae61'],
-      [0.8, '#f46d43'],
-      [0.9, '#d73027'],
-      [1, '#a50026'],
-    ];
-  }
-  if(config['reverseColors'] === undefined){ config['reverseColors'] = false; }
-  if(config['decimalPlaces'] === undefined){ config['decimalPlaces'] = 2; }
-  if(config['legend'] === undefined){ config['legend'] = true; }
-  if(config['borderWidth'] === undefined){ config['borderWidth'] = 0; }
   var datalabels = config['datalabels'];
   if(datalabels === undefined){
     if(data.length < 20){ datalabels = true; }
     else { datalabels = false; }
   }
-  // Clone the colstops before we mess around with them
-  var colstops = JSON.parse(JSON.stringify(config['colstops']));
-  // Reverse the colour scale if the axis is reversed
-  if(config['reverseColors']){
-    for(var i = 0; i < colstops.length; i++){
-      colstops[i][0] = 1 - colstops[i][0];
-    }
-    colstops.reverse();
-  }
+  var colstops = heatmap_colstops(config);
 
   // Make the highcharts plot
   Highcharts.chart(target, {
@@ -1531,6 +1991,219 @@ function plot_heatmap(target, ds){
 
 }
 
+// Set the default colours for a heatmap, returning the colour stops to use
+function heatmap_colstops(config){
+  if(config['colstops'] === undefined){
+    config['colstops'] = [
+      [0, '#313695'],
+      [0.1, '#4575b4'],
+      [0.2, '#74add1'],
+      [0.3, '#abd9e9'],
+      [0.4, '#e0f3f8'],
+      [0.5, '#ffffbf'],
+      [0.6, '#fee090'],
+      [0.7, '#fdae61'],
+      [0.8, '#f46d43'],
+      [0.9, '#d73027'],
+      [1, '#a50026'],
+    ];
+  }
+  if(config['reverseColors'] === undefined){ config['reverseColors'] = false; }
+  if(config['decimalPlaces'] === undefined){ config['decimalPlaces'] = 2; }
+  if(config['legend'] === undefined){ config['legend'] = true; }
+  if(config['borderWidth'] === undefined){ config['borderWidth'] = 0; }
+  // Clone the colstops before we mess around with them
+  var colstops = JSON.parse(JSON.stringify(config['colstops']));
+  // Reverse the colour scale if the axis is reversed
+  if(config['reverseColors']){
+    for(var i = 0; i < colstops.length; i++){
+      colstops[i][0] = 1 - colstops[i][0];
+    }
+    colstops.reverse();
+  }
+  return colstops;
+}
+
+// [x, y, value] points for a block of row-major heatmap values, starting at row r0, column c0
+function heatmap_cells(values, ncols, r0, c0){
+  var cells = new Array(values.length);
+  for (var n = 0; n < values.length; n++){
+    cells[n] = [c0 + (n % ncols), r0 + Math.floor(n / ncols), values[n]];
+  }
+  return cells;
+}
+
+// Heatmap too large to draw every cell. Shows an overview of block means
+// until zoomed in far enough, then makes points for the visible tiles only.
+function plot_heatmap_tiled(target){
+  var plot = mqc_plots[target];
+  var config = plot['config'];
+  var xcats = plot['xcats'].slice();
+  var ycats = plot['ycats'].slice();
+
+  // Rename samples
+  if(window.mqc_rename_f_texts.length > 0){
+    $.each([xcats, ycats], function(c, cats){
+      for (var i = 0; i < cats.length; i++) {
+        $.each(window.mqc_rename_f_texts, function(idx, f_text){
+          if(window.mqc_rename_regex_mode){
+            var re = new RegExp(f_text,"g");
+            cats[i] = cats[i].replace(re, window.mqc_rename_t_texts[idx]);
+          } else {
+            cats[i] = cats[i].replace(f_text, window.mqc_rename_t_texts[idx]);
+          }
+        });
+      }
+    });
+  }
+
+  // Sorting by highlight and hiding samples need every value, so can't be done here
+  $('.mqc_heatmap_sortHighlight[data-target="#'+target+'"]').attr('disabled', true);
+  $('#'+target).closest('.hc-plot-wrapper').parent().find('.samples-hidden-warning').remove();
+  if(window.mqc_hide_f_texts.length > 0){
+    var alert = '<div class="samples-hidden-warning alert alert-warning"><span class="glyphicon glyphicon-info-sign"></span> <strong>Warning:</strong> This heatmap is too large to hide samples from. <a href="#mqc_hidesamples" class="alert-link" onclick="mqc_toolbox_openclose(\'#mqc_hidesamples\', true); return false;">See toolbox.</a></div>';
+    $('#'+target).closest('.hc-plot-wrapper').before(alert);
+  }
+
+  var colstops = heatmap_colstops(config);
+  var overview = plot['overview'];
+  var factor = overview['factor'];
+  var ts = plot['tile_size'];
+
+  // Points for the visible part of the heatmap
+  var shown = null;
+  function visible_cells(xmin, xmax, ymin, ymax){
+    xmin = Math.max(0, Math.floor(xmin));
+    ymin = Math.max(0, Math.floor(ymin));
+    xmax = Math.min(plot['cols'] - 1, Math.ceil(xmax));
+    ymax = Math.min(plot['rows'] - 1, Math.ceil(ymax));
+    if((xmax - xmin + 1) * (ymax - ymin + 1) > plot['max_cells']){
+      var data = [];
+      for (var n = 0; n < overview['values'].length; n++){
+        var r = Math.floor(n / overview['cols']);
+        var c = n % overview['cols'];
+        data.push({ x: c * factor + (factor - 1) / 2, y: r * factor + (factor - 1) / 2, value: overview['values'][n], r: r, c: c });
+      }
+      return { key: 'overview', size: factor, data: data };
+    }
+    var tr0 = Math.floor(ymin / ts), tr1 = Math.floor(ymax / ts);
+    var tc0 = Math.floor(xmin / ts), tc1 = Math.floor(xmax / ts);
+    var data = [];
+    for (var tr = tr0; tr <= tr1; tr++){
+      for (var tc = tc0; tc <= tc1; tc++){
+        var width = Math.min(ts, plot['cols'] - tc * ts);
+        data = data.concat(heatmap_cells(plot['tiles'][tr][tc], width, tr * ts, tc * ts));
+      }
+    }
+    return { key: [tr0, tr1, tc0, tc1].join('_'), size: 1, data: data };
+  }
+  function update_cells(chart){
+    var xe = chart.xAxis[0].getExtremes();
+    var ye = chart.yAxis[0].getExtremes();
+    var cells = visible_cells(xe.min, xe.max, ye.min, ye.max);
+    if(shown == cells['key']){ return; }
+    shown = cells['key'];
+    chart.series[0].update({ colsize: cells['size'], rowsize: cells['size'], data: cells['data'] });
+  }
+  function cat_range(cats, idx, n){
+    var last = Math.min((idx + 1) * factor, n) - 1;
+    return cats[idx * factor] + ' - ' + cats[last];
+  }
+
+  var initial = visible_cells(0, plot['cols'] - 1, 0, plot['rows'] - 1);
+  shown = initial['key'];
+  var axis_events = {
+    afterSetExtremes: function(){
+      var chart = this.chart;
+      setTimeout(function(){ update_cells(chart); }, 0);
+    }
+  };
+
+  Highcharts.chart(target, {
+    chart: {
+      type: 'heatmap',
+      zoomType: 'xy',
+      height: config['square'] ? 500 : undefined,
+      width: config['square'] ? 530 : undefined,
+      marginTop: config['title'] ? 60 : 50
+    },
+    title: {
+      text: config['title'],
+    },
+    xAxis: {
+      endOnTick: false,
+      maxPadding: 0,
+      min: 0,
+      max: plot['cols'] - 1,
+      categories: xcats,
+      title: { enabled: true, text: config['xTitle'] },
+      labels: {
+        formatter: function(){
+          try { return this.value.substr(0, 20); }
+          catch(err) { return this.value; }
+        }
+      },
+      events: axis_events
+    },
+    yAxis: {
+      endOnTick: false,
+      maxPadding: 0,
+      min: 0,
+      max: plot['rows'] - 1,
+      categories: ycats,
+      reversed: true,
+      opposite: true,
+      title: config['yTitle'],
+      labels: {
+        formatter: function(){
+          try { return this.value.substr(0, 20); }
+          catch(err) { return this.value; }
+        }
+      },
+      events: axis_events
+    },
+    colorAxis: {
+      reversed: config['reverseColors'],
+      stops: colstops,
+      min: config['min'],
+      max: config['max'],
+    },
+    legend: {
+      align: 'right',
+      layout: 'vertical',
+      margin: 0,
+      verticalAlign: 'top',
+      y: 25,
+      symbolHeight: 280,
+      enabled: config['legend']
+    },
+    tooltip: {
+      useHTML: true,
+      formatter: function () {
+        var x = this.series.xAxis.categories[this.point.x];
+        var y = this.series.yAxis.categories[this.point.y];
+        var label = '';
+        if(this.point.r !== undefined){
+          x = cat_range(xcats, this.point.c, plot['cols']);
+          y = cat_range(ycats, this.point.r, plot['rows']);
+          label = ' (mean - zoom in for each value)';
+        }
+        return 'X: <span style="font-weight:bold; font-family:monospace;">' + x + '</span><br>' +
+        'Y: <span style="font-weight:bold; font-family:monospace;">' + y + '</span><br>' +
+        '<div style="background-color:'+this.point.color+'; display:inline-block; height: 10px; width: 10px; border:1px solid #333;"></div> ' +
+        '<span style="font-weight: bold; text-decoration:underline;">' + Highcharts.numberFormat(this.point.value, config['decimalPlaces']) + '</span>' + label;
+      }
+    },
+    series: [{
+      turboThreshold: 0,
+      borderWidth: config['borderWidth'],
+      colsize: initial['size'],
+      rowsize: initial['size'],
+      data: initial['data']
+    }]
+  });
+}
+
 // Highlight text with a fadeout background colour highlight
 function highlight_fade_text(obj){
   var orig_col = $(obj).css('color');
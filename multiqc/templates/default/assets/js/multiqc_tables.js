@@ -8,6 +8,9 @@ var brewer_scales = ['YlOrRd', 'YlOrBr', 'YlGnBu', 'YlGn', 'Reds', 'RdPu',
   'Paired', 'Dark2', 'Accent', 'Spectral', 'RdYlGn', 'RdYlBu', 'RdGy', 'RdBu',
   'PuOr', 'PRGn', 'PiYG', 'BrBG'];
 
+// Data and display state for tables with rows built on the fly
+window.mqc_vtables = {};
+
 // Execute when page load has finished loading
 $(function () {
 
@@ -17,16 +20,26 @@ $(function () {
     var strip_non_numeric = function(node){
       return node.innerText.replace(/[^\d.-]/g, '');
     }
-    $('.mqc_table').tablesorter({sortInitialOrder: 'desc', textExtraction: strip_non_numeric});
+    $('.mqc_table:not(.mqc_table_virtual)').tablesorter({sortInitialOrder: 'desc', textExtraction: strip_non_numeric});
+
+    // Set up virtual tables once the plot data has been decompressed
+    $(document).on('mqc_plotdata_loaded', function(){
+      $('.mqc_table_virtual').each(function(){
+        mqc_vtable_init($(this).attr('id'));
+      });
+    });
 
     // Update tablesorter if samples renamed
     $(document).on('mqc_renamesamples', function(e, f_texts, t_texts, regex_mode){
-      $('.mqc_table').trigger('update');
+      $('.mqc_table:not(.mqc_table_virtual)').trigger('update');
     });
 
     // Copy table contents to clipboard
-    var clipboard = new Clipboard('.mqc_table_copy_btn');
+    var clipboard = new Clipboard('.mqc_table_copy_btn:not(.mqc_vtable_copy_btn)');
     clipboard.on('success', function(e) { e.clearSelection(); });
+    new Clipboard('.mqc_vtable_copy_btn', {
+      text: function(trigger) { return mqc_vtable_tsv($(trigger).data('target').replace(/^#/, '')); }
+    });
     $('.mqc_table_copy_btn').click(function(){
       var btn = $(this);
       btn.addClass('active').html('<span class="glyphicon glyphicon-copy"></span> Copied!');
@@ -80,6 +93,15 @@ $(function () {
           $(target+'_configModal_table .'+cclass).addClass('text-muted');
         }
       });
+      // Virtual tables work out empty rows from the data
+      if($(target).hasClass('mqc_table_virtual')){
+        var vt = mqc_vtables[target.replace(/^#/, '')];
+        if(vt !== undefined){
+          vt.hide_empty = true;
+          mqc_vtable_update(vt);
+        }
+        return;
+      }
       // Hide empty rows
       $(target+' tbody tr').show();
       $(target+' tbody tr').each(function(){
@@ -120,8 +142,8 @@ $(function () {
     // highlight samples
     $(document).on('mqc_highlights', function(e, f_texts, f_cols, regex_mode){
       $('.mqc_table_sortHighlight').hide();
-      $('.mqc_table tbody th').removeClass('highlighted').removeData('highlight');
-      $('.mqc_table tbody th').each(function(i){
+      $('.mqc_table:not(.mqc_table_virtual) tbody th').removeClass('highlighted').removeData('highlight');
+      $('.mqc_table:not(.mqc_table_virtual) tbody th').each(function(i){
         var th = $(this);
         var thtext = $(this).text();
         var thiscol = '#333';
@@ -134,12 +156,33 @@ $(function () {
         });
         $(this).css('color', thiscol);
       });
+      $.each(mqc_vtables, function(tid, vt){
+        vt.highlight = [];
+        $.each(vt.names, function(i, s_name){
+          vt.highlight[i] = undefined;
+          $.each(f_texts, function(idx, f_text){
+            if((regex_mode && s_name.match(f_text)) || (!regex_mode && s_name.indexOf(f_text) > -1)){
+              vt.highlight[i] = idx;
+            }
+          });
+          if(vt.highlight[i] !== undefined){
+            $('.mqc_table_sortHighlight[data-target="#'+tid+'"]').show();
+          }
+        });
+        vt.highlight_cols = f_cols;
+        mqc_vtable_render(vt);
+      });
     });
 
     // Sort MultiQC tables by highlight
     $('.mqc_table_sortHighlight').click(function(e){
       e.preventDefault();
       var target = $(this).data('target');
+      if($(target).hasClass('mqc_table_virtual')){
+        mqc_vtable_sortHighlight(mqc_vtables[target.replace(/^#/, '')], $(this).data('direction'));
+        $(this).data('direction', $(this).data('direction') == 'desc' ? 'asc' : 'desc');
+        return;
+      }
       // collect highlighted rows
       var hrows = $(target+' tbody th.highlighted').parent().detach();
       hrows = hrows.sort(function (a, b) {
@@ -157,7 +200,21 @@ $(function () {
 
     // Rename samples
     $(document).on('mqc_renamesamples', function(e, f_texts, t_texts, regex_mode){
-      $(".mqc_table tbody th").each(function(){
+      $.each(mqc_vtables, function(tid, vt){
+        vt.names = $.map(vt.data.samples, function(s_name){
+          $.each(f_texts, function(idx, f_text){
+            if(regex_mode){
+              var re = new RegExp(f_text,"g");
+              s_name = s_name.replace(re, t_texts[idx]);
+            } else {
+              s_name = s_name.replace(f_text, t_texts[idx]);
+            }
+          });
+          return s_name;
+        });
+        mqc_vtable_render(vt);
+      });
+      $(".mqc_table:not(.mqc_table_virtual) tbody th").each(function(){
         var s_name = $(this).data('original-sn');
         $.each(f_texts, function(idx, f_text){
           if(regex_mode){
@@ -174,8 +231,22 @@ $(function () {
     // Hide samples
     $(document).on('mqc_hidesamples', function(e, f_texts, regex_mode){
 
+      // Hide rows in virtual tables
+      $.each(mqc_vtables, function(tid, vt){
+        vt.hidden = $.map(vt.names, function(s_name){
+          var match = false;
+          $.each(f_texts, function(idx, f_text){
+            if((regex_mode && s_name.match(f_text)) || (!regex_mode && s_name.indexOf(f_text) > -1)){
+              match = true;
+            }
+          });
+          return window.mqc_hide_mode == 'show' ? !match : match;
+        });
+        mqc_vtable_update(vt);
+      });
+
       // Hide rows in MultiQC tables
-      $(".mqc_table tbody th").each(function(){
+      $(".mqc_table:not(.mqc_table_virtual) tbody th").each(function(){
         var match = false;
         var hfilter = $(this).text();
         $.each(f_texts, function(idx, f_text){
@@ -194,11 +265,13 @@ $(function () {
       });
       $('.mqc_table_numrows').each(function(){
         var tid = $(this).attr('id').replace('_numrows','');
-        $(this).text( $('#'+tid+' tbody tr:visible').length );
+        if(mqc_vtables[tid] === undefined){
+          $(this).text( $('#'+tid+' tbody tr:visible').length );
+        }
       });
 
       // Hide empty columns
-      $('.mqc_table').each(function(){
+      $('.mqc_table:not(.mqc_table_virtual)').each(function(){
         var table = $(this);
         var gsthidx = 0;
         table.find("thead th, tbody tr td").show();
@@ -281,7 +354,21 @@ $(function () {
         },
         'datasets': [[]]
       };
-      $(tid+' tbody tr').each(function(e){
+      if($(tid).hasClass('mqc_table_virtual')){
+        var vt = mqc_vtables[tid.replace(/^#/, '')];
+        $.each(vt.rows, function(i, sidx){
+          var val_1 = vt.data.columns[col1]['nums'][sidx];
+          var val_2 = vt.data.columns[col2]['nums'][sidx];
+          if(val_1 !== null && val_2 !== null){
+            mqc_plots['tableScatterPlot']['datasets'][0].push({
+              'name': vt.names[sidx],
+              'x': val_1,
+              'y': val_2
+            });
+          }
+        });
+      }
+      $(tid+':not(.mqc_table_virtual) tbody tr').each(function(e){
         var s_name = $(this).children('th.rowheader').text();
         var val_1 = $(this).children('td.'+col1).text().replace(/[^\d\.]/g,'');
         var val_2 = $(this).children('td.'+col2).text().replace(/[^\d\.]/g,'');
@@ -327,7 +414,7 @@ function change_mqc_table_col_order(table){
     classes.push($(this).attr('class'));
   });
   // Go through each row
-  $('#'+target+' tr').each(function(){
+  $('#'+target+' tr:not(.mqc_vtable_spacer)').each(function(){
     var cols = {};
     var row = $(this);
     // Detach any cell that matches a known class from above
@@ -348,3 +435,226 @@ function change_mqc_table_col_order(table){
     }
   });
 }
+
+
+////////////////////////////////////////////////
+// Virtual tables
+// Only the rows scrolled into view exist in the page. Sorting,
+// highlighting and hiding work on the column arrays in mqc_plots.
+////////////////////////////////////////////////
+
+// Number of rows to build above and below the visible area
+var mqc_vtable_buffer = 20;
+
+function mqc_vtable_init(tid){
+  if(mqc_plots[tid] === undefined || mqc_plots[tid]['plot_type'] !== 'table'){ return false; }
+  var vt = {
+    'tid': tid,
+    'data': mqc_plots[tid],
+    'table': $('#'+tid),
+    'container': $('#'+tid).closest('.mqc-table-responsive'),
+    'names': mqc_plots[tid]['samples'].slice(),
+    'order': [],
+    'hidden': [],
+    'highlight': [],
+    'highlight_cols': [],
+    'hide_empty': false,
+    'row_height': 30,
+    'sort_col': undefined,
+    'sort_dir': undefined,
+    'rows': [],
+    'pending': false
+  };
+  for (var i = 0; i < vt.names.length; i++){
+    vt.order.push(i);
+    vt.hidden.push(false);
+  }
+  mqc_vtables[tid] = vt;
+
+  // Rebuild rows when scrolled, at most once per frame
+  vt.container.scroll(function(){
+    if(!vt.pending){
+      vt.pending = true;
+      window.requestAnimationFrame(function(){
+        vt.pending = false;
+        mqc_vtable_render(vt);
+      });
+    }
+  });
+
+  // Sort on the column arrays when a header is clicked
+  vt.table.find('thead th').click(function(){
+    var col = $(this).hasClass('rowheader') ? null : $(this).attr('id').replace(/^header_/, '');
+    var dir = 'desc';
+    if(vt.sort_col === col && vt.sort_dir == 'desc'){ dir = 'asc'; }
+    vt.table.find('thead th').removeClass('headerSortUp headerSortDown');
+    $(this).addClass(dir == 'desc' ? 'headerSortUp' : 'headerSortDown');
+    mqc_vtable_sort(vt, col, dir);
+  });
+
+  mqc_vtable_update(vt);
+}
+
+// Work out which rows are shown, then rebuild the visible part of the table
+function mqc_vtable_update(vt){
+  var columns = vt.data.columns;
+  var visible_cols = mqc_vtable_visible_cols(vt);
+  vt.rows = [];
+  $.each(vt.order, function(i, sidx){
+    if(vt.hidden[sidx]){ return true; }
+    if(vt.hide_empty){
+      var hasVal = false;
+      $.each(visible_cols, function(j, rid){
+        if(columns[rid]['vals'][sidx] !== null && columns[rid]['vals'][sidx] !== ''){
+          hasVal = true;
+          return false;
+        }
+      });
+      if(!hasVal){ return true; }
+    }
+    vt.rows.push(sidx);
+  });
+
+  // Hide columns with no values in any of the shown rows
+  $.each(columns, function(rid, col){
+    var th = vt.table.find('#header_'+rid);
+    var empty = vt.rows.length > 0;
+    $.each(vt.rows, function(i, sidx){
+      if(col['vals'][sidx] !== null && col['vals'][sidx] !== ''){
+        empty = false;
+        return false;
+      }
+    });
+    th.toggle(!empty);
+  });
+
+  $('#'+vt.tid+'_numrows').text(vt.rows.length);
+  $('#'+vt.tid+'_numcols').text(vt.table.find('thead th:visible').length - 1);
+  mqc_vtable_render(vt);
+}
+
+// Column IDs in their current order, skipping hidden columns
+function mqc_vtable_visible_cols(vt){
+  var cols = [];
+  vt.table.find('thead th').each(function(){
+    var th_id = $(this).attr('id');
+    if(th_id !== undefined && !$(this).hasClass('hidden') && $(this).css('display') != 'none'){
+      cols.push(th_id.replace(/^header_/, ''));
+    }
+  });
+  return cols;
+}
+
+// Build the rows that are in view, with spacers standing in for the rest
+function mqc_vtable_render(vt){
+  var columns = vt.data.columns;
+  var cols = mqc_vtable_visible_cols(vt);
+  var nrows = vt.rows.length;
+  var first = Math.max(0, Math.floor(vt.container.scrollTop() / vt.row_height) - mqc_vtable_buffer);
+  var last = Math.min(nrows, first + Math.ceil(vt.container.height() / vt.row_height) + (2 * mqc_vtable_buffer));
+  var spacer = function(height){
+    if(height <= 0){ return ''; }
+    return '<tr class="mqc_vtable_spacer"><td colspan="'+(cols.length+1)+'" style="height:'+height+'px; padding:0; border:0;"></td></tr>';
+  };
+  var html = [ spacer(first * vt.row_height) ];
+  for (var r = first; r < last; r++){
+    var sidx = vt.rows[r];
+    var hl = '';
+    if(vt.highlight[sidx] !== undefined){
+      hl = ' highlighted" style="color:'+vt.highlight_cols[vt.highlight[sidx]]+';';
+    }
+    html.push('<tr><th class="rowheader'+hl+'" data-original-sn="'+vt.data.samples[sidx]+'">'+vt.names[sidx]+'</th>');
+    for (var c = 0; c < cols.length; c++){
+      var col = columns[cols[c]];
+      var val = col['vals'][sidx];
+      if(val === null){
+        html.push('<td class="data-coloured '+cols[c]+'"></td>');
+      } else if(!col['scale']){
+        html.push('<td class="'+cols[c]+'">'+val+'</td>');
+      } else {
+        var percentage = 0;
+        var num = col['nums'][sidx];
+        if(num !== null && col['dmax'] != col['dmin']){
+          percentage = Math.min(Math.max(((num - col['dmin']) / (col['dmax'] - col['dmin'])) * 100, 0), 100);
+        }
+        var colour = col['colours'][sidx] === null ? '' : ' background-color:'+col['palette'][col['colours'][sidx]]+';';
+        html.push('<td class="data-coloured '+cols[c]+'"><div class="wrapper"><span class="bar" style="width:'+percentage+'%;'+colour+'"></span>'+
+          '<span class="val">'+val+col['suffix']+'</span></div></td>');
+      }
+    }
+    html.push('</tr>');
+  }
+  html.push(spacer((nrows - last) * vt.row_height));
+  vt.table.find('tbody').html(html.join(''));
+
+  // Spacer heights assume a row height, fix it up if the real one differs
+  var row_height = vt.table.find('tbody tr:not(.mqc_vtable_spacer)').first().outerHeight();
+  if(row_height > 0 && Math.abs(row_height - vt.row_height) > 0.5){
+    vt.row_height = row_height;
+    mqc_vtable_render(vt);
+  }
+}
+
+// Sort rows by a column, or by sample name if col is null
+function mqc_vtable_sort(vt, col, dir){
+  var sign = dir == 'desc' ? -1 : 1;
+  var keys;
+  if(col === null){
+    keys = vt.names;
+  } else {
+    var nums = vt.data.columns[col]['nums'];
+    var vals = vt.data.columns[col]['vals'];
+    keys = [];
+    for (var i = 0; i < vals.length; i++){
+      keys.push(nums[i] !== null ? nums[i] : vals[i]);
+    }
+  }
+  vt.order.sort(function(a, b){
+    var ka = keys[a], kb = keys[b];
+    // Missing values always go to the bottom
+    if(ka === null || ka === undefined){ return (kb === null || kb === undefined) ? a - b : 1; }
+    if(kb === null || kb === undefined){ return -1; }
+    if(typeof ka !== typeof kb){ ka = String(ka); kb = String(kb); }
+    if(ka < kb){ return -1 * sign; }
+    if(ka > kb){ return sign; }
+    return a - b;
+  });
+  vt.sort_col = col;
+  vt.sort_dir = dir;
+  mqc_vtable_update(vt);
+}
+
+// Move highlighted rows to the top (desc) or bottom (asc) of the table
+function mqc_vtable_sortHighlight(vt, dir){
+  var hrows = [];
+  var others = [];
+  $.each(vt.order, function(i, sidx){
+    if(vt.highlight[sidx] !== undefined){ hrows.push(sidx); }
+    else { others.push(sidx); }
+  });
+  hrows.sort(function(a, b){ return vt.highlight[a] - vt.highlight[b]; });
+  if(dir == 'desc'){
+    vt.order = hrows.reverse().concat(others);
+  } else {
+    vt.order = others.concat(hrows);
+  }
+  mqc_vtable_update(vt);
+}
+
+// Tab-separated text of the shown rows and columns, for the copy button
+function mqc_vtable_tsv(tid){
+  var vt = mqc_vtables[tid];
+  if(vt === undefined){ return ''; }
+  var strip = function(s){ return $('<div>'+s+'</div>').text(); };
+  var cols = mqc_vtable_visible_cols(vt);
+  var lines = [ $.map(vt.table.find('thead th:visible'), function(th){ return $(th).text(); }).join('\t') ];
+  $.each(vt.rows, function(i, sidx){
+    var line = [ vt.names[sidx] ];
+    $.each(cols, function(j, rid){
+      var col = vt.data.columns[rid];
+      line.push(col['vals'][sidx] === null ? '' : strip(col['vals'][sidx] + col['suffix']));
+    });
+    lines.push(line.join('\t'));
+  });
+  return lines.join('\n');
+}
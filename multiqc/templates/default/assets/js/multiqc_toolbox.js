@@ -288,6 +288,29 @@ $(function () {
               var blob = new Blob([datastring], {type: "text/plain;charset=utf-8"});
               saveAs(blob, fname);
             }
+            // Summarised beeswarm plots - export the quantiles for each category
+            else if(mqc_plots[target]['plot_type'] == 'beeswarm_summary'){
+              datastring = ['Category', 'Samples', 'Min', '5%', '25%', 'Median', '75%', '95%', 'Max', 'Outliers'].join(sep)+"\n";
+              for(var j=0; j<mqc_plots[target]['categories'].length; j++){
+                var summary = mqc_plots[target]['summaries'][j];
+                var row = [mqc_plots[target]['categories'][j]['description'], summary['n']];
+                row = row.concat(summary['quantiles'].length > 0 ? summary['quantiles'] : ['', '', '', '', '', '', '']);
+                row.push(summary['outliers'].length);
+                datastring += row.join(sep)+"\n";
+              }
+              var blob = new Blob([datastring], {type: "text/plain;charset=utf-8"});
+              saveAs(blob, fname);
+            }
+            // Binned scatter plots - export the centre and count of each cell
+            else if(mqc_plots[target]['plot_type'] == 'scatter_density'){
+              datastring = ['X', 'Y', 'Count'].join(sep)+"\n";
+              var cells = mqc_plots[target]['datasets'][0]['cells'];
+              for(var j=0; j<cells.length; j++){
+                datastring += cells[j].join(sep)+"\n";
+              }
+              var blob = new Blob([datastring], {type: "text/plain;charset=utf-8"});
+              saveAs(blob, fname);
+            }
             // Normal plot - use HighCharts plugin to get the data from the plot
             else if(ft == 'tsv' || ft == 'csv'){
               var hc = $('#'+target).highcharts();
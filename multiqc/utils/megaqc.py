@@ -10,18 +10,9 @@ import os
 import requests
 
 from multiqc import config
+from multiqc.utils import mqc_json
 log = config.logger
 
-# Custom encoder to handle lambda functions
-class MQCJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if callable(obj):
-            try:
-                return obj(1)
-            except:
-                return None
-        return json.JSONEncoder.default(self, obj)
-
 def multiqc_dump_json(report):
     exported_data = dict()
     export_vars = {
@@ -54,9 +45,8 @@ def multiqc_dump_json(report):
                     d = {'{}_{}'.format(s, k): getattr(config, k)}
                 elif s == 'report':
                     d = {'{}_{}'.format(s, k): getattr(report, k)}
-                json.dumps(d, cls=MQCJSONEncoder, ensure_ascii=False) # Test that exporting to JSON works
                 exported_data.update(d)
-            except (TypeError, KeyError, AttributeError):
+            except (KeyError, AttributeError):
                 log.warn("Couldn't export data key '{}.{}'".format(s, k))
         # Get the absolute paths of analysis directories
         exported_data['config_analysis_dir_abs'] = list()
@@ -72,13 +62,11 @@ def multiqc_api_post(exported_data):
     headers = { 'Content-Type': 'application/json', 'content-encoding': 'gzip' }
     if config.megaqc_access_token is not None:
         headers['access_token'] = config.megaqc_access_token
-    post_data = json.dumps({'data': exported_data}, cls=MQCJSONEncoder, ensure_ascii=False, indent=2)
-    post_data = post_data.encode('utf-8', 'ignore')
 
     # Gzip the JSON for massively decreased filesize
     sio_obj = io.BytesIO()
     gzfh = gzip.GzipFile(fileobj=sio_obj, mode='w')
-    gzfh.write(post_data)
+    mqc_json.dump({'data': exported_data}, gzfh, indent=True)
     gzfh.close()
     request_body = sio_obj.getvalue()
 
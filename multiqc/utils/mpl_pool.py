@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+""" MultiQC code to render flat MatPlotLib plots in a pool of worker
+processes. The plotting functions describe each figure as a spec dict,
+which is drawn either straight away or by a worker, in which case a
+placeholder goes into the report HTML until the image is ready. """
+
+from __future__ import print_function
+from collections import OrderedDict
+import logging
+import multiprocessing
+import pickle
+import re
+
+from multiqc.utils import config, plot_cache
+
+logger = logging.getLogger(__name__)
+
+placeholder_re = re.compile(r'mqc_mpl_placeholder_\d+')
+
+# Worker pool, created when the first flat plot is rendered
+pool = None
+pool_failed = False
+
+# Placeholder string: (pickled function and spec, cache key, output locations, pending result)
+jobs = OrderedDict()
+
+def num_processes():
+    """ Number of processes to render flat plots with. 1 means no pool,
+    None means one per CPU up to 8 """
+    nprocs = config.plots_flat_processes
+    if nprocs is None:
+        try:
+            nprocs = min(multiprocessing.cpu_count(), 8)
+        except NotImplementedError:
+            nprocs = 1
+    return nprocs
+
+def init_worker():
+    """ Each worker process has its own MatPlotLib, without any display """
+    import matplotlib
+    matplotlib.use('Agg')
+
+def run_job(payload):
+    """ Draw a figure from a pickled (function, spec) pair """
+    func, spec = pickle.loads(payload)
+    return func(spec)
+
+def render(func, spec):
+    """ Draw a flat plot.
+    :param func: Module-level function that draws the figure from the spec
+    :param spec: Picklable dict with everything needed to draw the figure
+    :return: The result of func(spec), or a placeholder string to be
+             swapped for it by finish() if it is running in the pool
+    """
+    global pool, pool_failed
+
+    # Use the images from the cache if we've drawn this figure before
+    cache_key, result = plot_cache.load(func, spec)
+    if result is not False:
+        return result
+
+    if pool_failed or num_processes() <= 1:
+        return render_inline(func, spec, cache_key)
+    try:
+        # Pickle now so that later changes to the plot data don't leak into the figure
+        payload = pickle.dumps((func, spec), pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        logger.debug("Could not pickle flat plot, drawing in main process: {}".format(e))
+        return render_inline(func, spec, cache_key)
+    if pool is None:
+        try:
+            pool = multiprocessing.Pool(num_processes(), init_worker)
+        except Exception as e:
+            logger.warning("Could not start processes to draw flat plots, drawing them one at a time: {}".format(e))
+            pool_failed = True
+            return render_inline(func, spec, cache_key)
+    placeholder = 'mqc_mpl_placeholder_{}'.format(len(jobs))
+    location = dict([ (k, spec.get(k)) for k in plot_cache.location_keys ])
+    jobs[placeholder] = (payload, cache_key, location, pool.apply_async(run_job, (payload,)))
+    return placeholder
+
+def render_inline(func, spec, cache_key):
+    """ Draw a flat plot in this process and add it to the cache """
+    result = func(spec)
+    plot_cache.save(cache_key, spec, result)
+    return result
+
+def finish(report):
+    """ Wait for any flat plots still being drawn and put
+    them into the HTML of the report modules and sections """
+    global pool
+    if len(jobs) == 0:
+        plot_cache.tidy()
+        return
+    logger.debug("Waiting for {} flat plots".format(len(jobs)))
+    results = dict()
+    for placeholder, (payload, cache_key, location, job) in jobs.items():
+        try:
+            results[placeholder] = job.get()
+        except Exception as e:
+            logger.debug("Flat plot failed in worker process, trying again: {}".format(e))
+            try:
+                results[placeholder] = run_job(payload)
+            except Exception as e:
+                logger.error("############### Error making MatPlotLib figure! {}".format(e))
+                results[placeholder] = ''
+                continue
+        plot_cache.save(cache_key, location, results[placeholder])
+    jobs.clear()
+    pool.close()
+    pool.join()
+    pool = None
+
+    def fill(html):
+        try:
+            return placeholder_re.sub(lambda m: results.get(m.group(0)) or '', html)
+        except TypeError:
+            return html
+
+    for mod in getattr(report, 'modules_output', []):
+        mod.intro = fill(getattr(mod, 'intro', None))
+        mod.comment = fill(getattr(mod, 'comment', None))
+        for s in mod.sections:
+            for k in s:
+                s[k] = fill(s[k])
+    report.general_stats_html = fill(report.general_stats_html)
+    plot_cache.tidy()
@@ -16,6 +16,9 @@ logger = logging.getLogger(__name__)
 class mqc_colour_scale(object):
 	""" Class to hold a colour scheme. """
 
+	# Number of steps in the precomputed colour lookup table
+	lut_steps = 1024
+
 	def __init__(self, name='GnBu', minval=0, maxval=100):
 		""" Initialise class with a colour scale """
 
@@ -31,38 +34,78 @@ class mqc_colour_scale(object):
 		if float(minval) == float(maxval):
 			self.minval = float(minval)
 			self.maxval = float(minval) + 1.0
-		elif minval > maxval:
+		elif float(minval) > float(maxval):
 			self.minval = float(maxval)
 			self.maxval = float(minval)
 		else:
 			self.minval = float(minval)
 			self.maxval = float(maxval)
 
+		self.lut = self.build_lut()
+
+	def build_lut(self):
+		""" Precompute the hex colours for evenly spaced steps across the scale,
+		blending in RGB the same way as spectra.scale() does """
+		scale_rgb = np.array([spectra.html(c).rgb for c in self.colours])
+		domain = np.linspace(0, 1, len(self.colours))
+		steps = np.linspace(0, 1, self.lut_steps)
+		rgb = np.column_stack([ np.interp(steps, domain, scale_rgb[:,i]) for i in range(3) ])
+
+		# Weird, I know. I ported this from the original JavaScript for continuity
+		# Seems to work better than adjusting brightness / saturation / luminosity
+		rgb = np.clip(1 + ((rgb - 1) * 0.3), 0, 1)
+		rgb = np.floor(0.5 + rgb * 255).astype(int)
+		return np.array([ '#{:02x}{:02x}{:02x}'.format(*c) for c in rgb ])
+
+	def clean_value(self, val):
+		""" Turn a table value into a float, stripping any non-numeric characters """
+		if isinstance(val, (int, float)) and not isinstance(val, bool) and np.isfinite(val):
+			return float(val)
+		val = re.sub("[^-0-9\.]", "", str(val))
+		if val == '':
+			return self.minval
+		return float(val)
+
 	def get_colour(self, val, colformat='hex'):
 		""" Given a value, return a colour within the colour scale """
 		try:
-			# Sanity checks
-			val = re.sub("[^-0-9\.]", "", str(val))
-			if val == '':
-				val = self.minval
-			val = float(val)
-			val = max(val, self.minval)
-			val = min(val, self.maxval)
-
-			domain_nums = list( np.linspace(self.minval, self.maxval, len(self.colours)) )
-			my_scale = spectra.scale(self.colours).domain(domain_nums)
-
-			# Weird, I know. I ported this from the original JavaScript for continuity
-			# Seems to work better than adjusting brightness / saturation / luminosity
-			rgb_converter = lambda x: max(0, min(1, 1+((x-1)*0.3)))
-			thecolour = spectra.rgb( *[rgb_converter(v) for v in my_scale(val).rgb] )
-
-			return thecolour.hexcode
-
+			return self.get_colours_for_values([val])[0]
 		except:
 			# Shouldn't crash all of MultiQC just for colours
 			return ''
 
+	def clean_values(self, vals, values=None, mask=None):
+		""" Run clean_value() on a list of values, with NaN for anything that
+		can't be cleaned. If the values are also given as a float array, with
+		a mask of those that are plain ints or floats, only the others are
+		cleaned one at a time. """
+		if values is None or mask is None:
+			fvals = np.empty(len(vals))
+			todo = range(len(vals))
+		else:
+			fvals = np.where(np.isfinite(values), values, self.minval)
+			todo = np.flatnonzero(~mask)
+		for i in todo:
+			try:
+				fvals[i] = self.clean_value(vals[i])
+			except ValueError:
+				fvals[i] = np.nan
+		return fvals
+
+	def get_colours_for_values(self, vals, values=None, mask=None):
+		""" Given a list of values, return a list of hex colours
+		within the colour scale. Uses the lookup table, so a
+		whole column of values is coloured in one go. The values
+		can also be given as a float array, see clean_values() """
+		fvals = self.clean_values(vals, values, mask)
+		missing = np.isnan(fvals)
+		fvals = np.clip(fvals, self.minval, self.maxval)
+		idx = np.rint((fvals - self.minval) / (self.maxval - self.minval) * (self.lut_steps - 1))
+		idx[missing] = 0
+		colours = self.lut[idx.astype(int)]
+		colours[missing] = ''
+		return colours.tolist()
+
 
 	def get_colours(self, name='GnBu'):
 		""" Function to get a colour scale by name
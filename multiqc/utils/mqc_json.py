@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+""" MultiQC code to write report data as JSON. Used for the compressed
+plot data in the report, the data files and the MegaQC export. Handles
+NaN and infinity (written as null, which JavaScript can parse), lambda
+functions, NumPy scalars and arrays and OrderedDicts in one pass. Dict
+keys that JSON can't hold, such as tuples, are written as strings.
+Uses orjson if it is installed, which is much faster. """
+
+from __future__ import print_function
+import json
+import logging
+import re
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    # Characters outside the basic multilingual plane, which lzstring
+    # can't compress the same way as JavaScript does
+    astral_re = re.compile(u'[\U00010000-\U0010FFFF]')
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Types that we've already warned about not being able to save
+unsaveable_types = set()
+
+def default(obj):
+    """ Turn objects that JSON can't handle into things that it can """
+    # Header 'modify' lambda functions etc.
+    if callable(obj):
+        try:
+            return obj(1)
+        except:
+            return None
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    type_name = type(obj).__name__
+    if type_name not in unsaveable_types:
+        unsaveable_types.add(type_name)
+        logger.warning("Couldn't save data of type '{}' as JSON, saving as null".format(type_name))
+    return None
+
+try:
+    key_types = (basestring, int, long, float)
+except NameError:
+    key_types = (str, int, float)
+
+def str_keys(obj):
+    """ Copy of obj with any dict keys that JSON can't hold, such as tuples or
+    frozensets, made into strings. Lists of plain values are kept as they are. """
+    if isinstance(obj, dict):
+        return OrderedDict([ (k if k is None or isinstance(k, key_types) else str(k), str_keys(v)) for k, v in obj.items() ])
+    if isinstance(obj, (list, tuple)):
+        return [ str_keys(v) if isinstance(v, (dict, list, tuple)) else v for v in obj ]
+    return obj
+
+def has_odd_keys(obj):
+    """ Whether obj or anything in it is a dict with a key that JSON can't hold """
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, dict):
+            for k in o:
+                if not (k is None or isinstance(k, key_types)):
+                    return True
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+    return False
+
+INFINITY = float('inf')
+nonfinite_re = re.compile(r'"(?:[^"\\]|\\.)*"|-?Infinity|NaN')
+
+def floatstr(o):
+    """ Floats as JSON, with null for NaN and infinity """
+    if o != o or o == INFINITY or o == -INFINITY:
+        return 'null'
+    return float.__repr__(o)
+
+def nonfinite_null(m):
+    """ Swap a NaN or Infinity token for null, leaving strings alone """
+    token = m.group(0)
+    return token if token[0] == '"' else 'null'
+
+class MQCJSONEncoder(json.JSONEncoder):
+    """ Pure Python JSON encoder, used to stream JSON to a
+    file when orjson isn't installed """
+    def default(self, obj):
+        return default(obj)
+
+    def iterencode(self, o, _one_shot=False):
+        if self.check_circular:
+            markers = {}
+        else:
+            markers = None
+        if self.ensure_ascii:
+            _encoder = json.encoder.encode_basestring_ascii
+        else:
+            _encoder = json.encoder.encode_basestring
+        _iterencode = json.encoder._make_iterencode(
+            markers, self.default, _encoder, self.indent, floatstr,
+            self.key_separator, self.item_separator, self.sort_keys,
+            self.skipkeys, _one_shot)
+        return _iterencode(o, 0)
+
+def orjson_option(indent):
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return option
+
+def dumps(data, indent=False, ascii=False):
+    """ Convert data to a JSON string
+    :param data: Data to convert
+    :param indent: Pretty-print with two spaces
+    :param ascii: Escape characters that lzstring can't compress like
+                  the browser does, for plot data in the report
+    :return: JSON string
+    """
+    try:
+        return encode(data, indent, ascii)
+    except TypeError as e:
+        # Dict keys that aren't strings or numbers
+        logger.debug("Couldn't convert data to JSON, making its keys strings: {}".format(e))
+        return encode(str_keys(data), indent, ascii)
+
+def encode(data, indent, ascii):
+    """ JSON string for dumps(), with orjson or Python JSON """
+    if orjson is not None:
+        try:
+            json_string = orjson.dumps(data, default=default, option=orjson_option(indent)).decode('utf-8')
+            if ascii:
+                json_string = astral_re.sub(escape_astral, json_string)
+            return json_string
+        except (TypeError, ValueError) as e:
+            # eg. integers too big for 64 bits or broken unicode - let Python try
+            logger.debug("orjson couldn't convert data, using Python JSON: {}".format(e))
+    kwargs = {
+        'indent': 2 if indent else None,
+        'ensure_ascii': ascii,
+    }
+    # C encoder - fast, but writes NaN and Infinity, which JavaScript can't parse
+    json_string = json.dumps(data, default=default, **kwargs)
+    if 'NaN' in json_string or 'Infinity' in json_string:
+        json_string = nonfinite_re.sub(nonfinite_null, json_string)
+    return json_string
+
+def dump(data, fh, indent=False, chunk_size=1048576):
+    """ Write data as UTF-8 encoded JSON to a binary file handle. With
+    orjson the JSON is made in one go, otherwise it is streamed in chunks.
+    :param data: Data to write
+    :param fh: Anything with a write() method that takes bytes, such as a
+               file opened in 'wb' mode or a gzip.GzipFile
+    :param indent: Pretty-print with two spaces
+    """
+    if orjson is not None:
+        try:
+            fh.write(orjson.dumps(data, default=default, option=orjson_option(indent)))
+            return
+        except (TypeError, ValueError) as e:
+            logger.debug("orjson couldn't convert data, using Python JSON: {}".format(e))
+    # Written JSON can't be taken back if a key turns out to be a tuple
+    # half way through, so check the keys first
+    if has_odd_keys(data):
+        data = str_keys(data)
+    encoder = MQCJSONEncoder(indent=2 if indent else None, ensure_ascii=False)
+    chunks = list()
+    size = 0
+    for chunk in encoder.iterencode(data):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            fh.write(''.join(chunks).encode('utf-8', 'ignore'))
+            chunks = list()
+            size = 0
+    fh.write(''.join(chunks).encode('utf-8', 'ignore'))
+
+def escape_astral(m):
+    """ JSON escape for a character outside the BMP, as a surrogate pair """
+    c = ord(m.group(0)) - 0x10000
+    return '\\u{:04x}\\u{:04x}'.format(0xD800 + (c >> 10), 0xDC00 + (c & 0x3FF))
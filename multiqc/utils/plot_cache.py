@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+""" MultiQC code to cache rendered flat plot images between runs.
+Entries are keyed by a hash of the figure spec, the output format and
+the MatPlotLib and MultiQC versions, so a figure with the same data and
+config can be copied from the cache instead of being drawn again. """
+
+from __future__ import print_function
+import hashlib
+import io
+import logging
+import os
+import pickle
+import re
+import time
+
+from multiqc import __version__
+from multiqc.utils import config
+
+logger = logging.getLogger(__name__)
+
+# Spec keys that only say where the output goes, not what it looks like
+location_keys = ['pid', 'plots_dir', 'export_plot_formats', 'base64_plots']
+
+# Cache entries (<sha1>.<format> or <sha1>.b64), and the temporary files they
+# are written to. Nothing else in the cache directory is touched.
+entry_re = re.compile(r'^[0-9a-f]{40}\.[A-Za-z0-9]+$')
+tmp_re = re.compile(r'^[0-9a-f]{40}\.[A-Za-z0-9]+\.\d+\.tmp$')
+
+# Temporary files older than this (seconds) were left by a run that died
+stale_tmp_age = 6 * 60 * 60
+
+hits = 0
+misses = 0
+
+def cache_dir():
+    d = config.plots_cache_dir
+    if d is None:
+        return None
+    return os.path.expanduser(d)
+
+def spec_key(func, spec):
+    """ Hash everything that affects how a figure looks """
+    try:
+        import matplotlib
+        mpl_version = matplotlib.__version__
+    except ImportError:
+        mpl_version = None
+    contents = dict([ (k, v) for k, v in spec.items() if k not in location_keys ])
+    try:
+        pickled = pickle.dumps((func.__module__, func.__name__, contents, mpl_version, __version__), 2)
+    except Exception as e:
+        logger.debug("Could not hash flat plot for the cache: {}".format(e))
+        return None
+    return hashlib.sha1(pickled).hexdigest()
+
+def entry_paths(key, spec):
+    """ Cache file for each output of a figure: ( cache path, output path or None for base64 ) """
+    paths = list()
+    for fformat in spec['export_plot_formats']:
+        plot_fn = os.path.join(spec['plots_dir'], fformat, '{}.{}'.format(spec['pid'], fformat))
+        paths.append( (os.path.join(cache_dir(), '{}.{}'.format(key, fformat)), plot_fn) )
+    if spec['base64_plots']:
+        paths.append( (os.path.join(cache_dir(), '{}.b64'.format(key)), None) )
+    return paths
+
+def load(func, spec):
+    """ Copy a figure's outputs from the cache if they are all there.
+    :return: ( key, result ) - result is the base64 PNG string or None.
+             key is None if the figure can't be cached, result is False on a miss.
+    """
+    global hits, misses
+    if cache_dir() is None:
+        return None, False
+    key = spec_key(func, spec)
+    if key is None:
+        return None, False
+    paths = entry_paths(key, spec)
+    if not all([ os.path.isfile(c_fn) for c_fn, _ in paths ]):
+        misses += 1
+        return key, False
+
+    result = None
+    try:
+        for c_fn, plot_fn in paths:
+            if plot_fn is None:
+                with io.open(c_fn, 'r', encoding='utf-8') as f:
+                    result = f.read()
+            else:
+                if not os.path.exists(os.path.dirname(plot_fn)):
+                    os.makedirs(os.path.dirname(plot_fn))
+                with io.open(c_fn, 'rb') as f_in, io.open(plot_fn, 'wb') as f_out:
+                    f_out.write(f_in.read())
+            # Touch the entry so that eviction drops the least recently used first
+            os.utime(c_fn, None)
+    except (OSError, IOError) as e:
+        logger.debug("Could not read flat plot from the cache: {}".format(e))
+        misses += 1
+        return key, False
+    hits += 1
+    return key, result
+
+def save(key, spec, result):
+    """ Add a freshly drawn figure's outputs to the cache """
+    if key is None or cache_dir() is None:
+        return
+    try:
+        if not os.path.exists(cache_dir()):
+            os.makedirs(cache_dir())
+        for c_fn, plot_fn in entry_paths(key, spec):
+            # Write to a temporary name first, so that other runs never see half a file
+            tmp_fn = '{}.{}.tmp'.format(c_fn, os.getpid())
+            if plot_fn is None:
+                with io.open(tmp_fn, 'w', encoding='utf-8') as f:
+                    f.write(result)
+            else:
+                with io.open(plot_fn, 'rb') as f_in, io.open(tmp_fn, 'wb') as f_out:
+                    f_out.write(f_in.read())
+            os.rename(tmp_fn, c_fn)
+    except (OSError, IOError) as e:
+        logger.debug("Could not save flat plot to the cache: {}".format(e))
+
+def tidy():
+    """ Log the hit rate and evict the least recently used entries until the
+    cache fits within plots_cache_size. Temporary files are only removed once
+    they are old enough that the run writing them must have died. """
+    global hits, misses
+    if cache_dir() is None or not os.path.isdir(cache_dir()):
+        return
+    if hits + misses > 0:
+        logger.info("Plot cache  : {} hits, {} misses".format(hits, misses))
+    hits = 0
+    misses = 0
+
+    entries = list()
+    now = time.time()
+    for fn in os.listdir(cache_dir()):
+        path = os.path.join(cache_dir(), fn)
+        try:
+            st = os.stat(path)
+            if tmp_re.match(fn) and now - st.st_mtime > stale_tmp_age:
+                os.remove(path)
+            elif entry_re.match(fn):
+                entries.append( (st.st_mtime, st.st_size, path) )
+        except OSError:
+            continue
+    total_size = sum([ e[1] for e in entries ])
+    max_size = config.plots_cache_size
+    if max_size is None or total_size <= max_size:
+        return
+    num_removed = 0
+    for mtime, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+            num_removed += 1
+        except OSError:
+            pass
+    logger.debug("Removed {} old files from the plot cache".format(num_removed))
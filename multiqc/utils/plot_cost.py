@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+""" MultiQC code to choose between an interactive HighCharts plot and a
+flat MatPlotLib image, from an estimate of what the interactive plot would
+cost the browser: the number of series and points drawn at once, and the
+number of bytes of JSON added to the report. Every choice is remembered so
+that the report can say which plots were made flat and why. """
+
+from __future__ import print_function
+from collections import OrderedDict
+import logging
+
+from multiqc.utils import config, util_functions
+
+logger = logging.getLogger(__name__)
+
+# Rough JSON bytes per point for each plot type, as written to the report
+point_bytes = {
+    'xy_line': 18,
+    'bar_graph': 8,
+    'scatter': 60,
+    'scatter_density': 20,
+    'heatmap': 8,
+    'beeswarm': 30,
+    'beeswarm_summary': 8,
+}
+series_bytes = 60
+
+# Line graph points are corners of one SVG path, all other points are
+# SVG elements of their own, which cost the browser a lot more to draw
+point_weight = {
+    'xy_line': 1,
+}
+default_point_weight = 5
+
+# One dict for every plot that the cost model looked at, in report order
+choices = list()
+
+def estimate(plot_type, datasets):
+    """ Estimate the cost of an interactive plot
+    :param plot_type: plot_type as in report.plot_data
+    :param datasets: list of (number of series, number of points) for
+                     each dataset. Only one is drawn at a time, but
+                     all of them are written to the report.
+    :return: dict with the series, weighted points and JSON bytes
+    """
+    if len(datasets) == 0:
+        datasets = [(0, 0)]
+    weight = point_weight.get(plot_type, default_point_weight)
+    return {
+        'series': max([ int(s) for s, p in datasets ]),
+        'points': max([ int(p) * weight for s, p in datasets ]),
+        'bytes': sum([ int(s) * series_bytes + int(p) * point_bytes.get(plot_type, 20) for s, p in datasets ]),
+    }
+
+def use_flat(pconfig, plot_type, datasets):
+    """ Decide whether to draw a plot as a flat image
+    :param pconfig: plot config dict, for the ID and any per-plot budgets
+    :param plot_type: plot_type of the interactive version of the plot
+    :param datasets: list of (number of series, number of points), see estimate()
+    :return: True if the plot should be flat
+    """
+    cost = estimate(plot_type, datasets)
+    reasons = list()
+    if config.plots_force_flat:
+        reasons.append('forced flat')
+    elif not config.plots_force_interactive:
+        for key, budget_key in [('series', 'plots_flat_numseries'), ('points', 'plots_flat_points'), ('bytes', 'plots_flat_bytes')]:
+            budget = pconfig.get(budget_key.replace('plots_', ''), getattr(config, budget_key, None))
+            if budget is not None and cost[key] > budget:
+                reasons.append('{} {} > {}'.format(key, cost[key], budget))
+    flat = len(reasons) > 0
+
+    choice = OrderedDict([
+        ('id', pconfig.get('id')),
+        ('title', pconfig.get('title')),
+        ('plot_type', plot_type),
+        ('series', cost['series']),
+        ('points', cost['points']),
+        ('bytes', cost['bytes']),
+        ('flat', flat),
+        ('reason', '; '.join(reasons)),
+    ])
+    choices.append(choice)
+    if flat and not config.plots_force_flat:
+        logger.debug("Drawing plot {} as a flat image: {}".format(pconfig.get('id'), choice['reason']))
+    return flat
+
+def summarise():
+    """ Log the plots that were made flat because of their cost and
+    write every choice to multiqc_data/multiqc_plot_choices """
+    if len(choices) == 0:
+        return
+    flat = [ c for c in choices if c['flat'] ]
+    if len(flat) > 0 and not config.plots_force_flat:
+        logger.info("Drew {} of {} plots as flat images, as they were too big to be interactive".format(len(flat), len(choices)))
+        for c in flat:
+            logger.debug("  {}: {}".format(c['id'], c['reason']))
+    if config.data_dir is None:
+        return
+    fdata = OrderedDict()
+    for i, c in enumerate(choices):
+        key = c['id'] if c['id'] is not None and c['id'] not in fdata else 'plot_{}'.format(i+1)
+        fdata[key] = OrderedDict([ (k, v) for k, v in c.items() if k != 'id' ])
+    util_functions.write_data_file(fdata, 'multiqc_plot_choices')
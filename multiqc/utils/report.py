@@ -9,7 +9,6 @@ from collections import defaultdict, OrderedDict
 import click
 import fnmatch
 import io
-import json
 import lzstring
 import mimetypes
 import os
@@ -17,6 +16,7 @@ import re
 import yaml
 
 from multiqc import config
+from multiqc.utils import mqc_json, util_functions
 logger = config.logger
 
 # Treat defaultdict and OrderedDict as normal dicts for YAML output
@@ -61,7 +61,7 @@ def get_filelist(run_module_names):
             sps = [sps]
 
         # Warn if we have any unrecognised search pattern keys
-        unrecognised_keys = [y for x in sps for y in x.keys() if y not in ['fn', 'fn_re', 'contents', 'contents_re', 'num_lines', 'shared', 'max_filesize']]
+        unrecognised_keys = [y for x in sps for y in x.keys() if y not in ['fn', 'fn_re', 'contents', 'contents_re', 'num_lines', 'shared', 'max_filesize', 'compressed']]
         if len(unrecognised_keys) > 0:
             logger.warn("Unrecognised search pattern keys for '{}': {}".format(key, ', '.join(unrecognised_keys)))
 
@@ -174,10 +174,12 @@ def search_file (pattern, f):
     fn_matched = False
     contents_matched = False
 
-    # Use mimetypes to exclude binary files where possible
+    # Use mimetypes to exclude binary files where possible. Compressed
+    # files are only searched if the pattern says they can be read.
     (ftype, encoding) = mimetypes.guess_type(os.path.join(f['root'], f['fn']))
     if encoding is not None:
-        return False
+        if not pattern.get('compressed') or encoding not in util_functions.decompressors:
+            return False
     if ftype is not None and ftype.startswith('image'):
         return False
 
@@ -203,9 +205,9 @@ def search_file (pattern, f):
     # Search by file contents
     if pattern.get('contents') is not None or pattern.get('contents_re') is not None:
         try:
-            with io.open (os.path.join(f['root'],f['fn']), "r", encoding='utf-8') as f:
+            with util_functions.open_file(os.path.join(f['root'],f['fn'])) as fh:
                 l = 1
-                for line in f:
+                for line in fh:
                     # Search by file contents (string)
                     if pattern.get('contents') is not None:
                         if pattern['contents'] in line:
@@ -224,7 +226,7 @@ def search_file (pattern, f):
                     if pattern.get('num_lines') and l >= pattern.get('num_lines'):
                         break
                     l += 1
-        except (IOError, OSError, ValueError, UnicodeDecodeError):
+        except util_functions.decompress_errors + (ValueError, UnicodeDecodeError):
             if config.report_readerrors:
                 logger.debug("Couldn't read file when looking for output: {}".format(f['fn']))
                 return False
@@ -235,7 +237,7 @@ def data_sources_tofile ():
     fn = 'multiqc_sources.{}'.format(config.data_format_extensions[config.data_format])
     with io.open (os.path.join(config.data_dir, fn), 'w', encoding='utf-8') as f:
         if config.data_format == 'json':
-            jsonstr = json.dumps(data_sources, indent=4, ensure_ascii=False)
+            jsonstr = mqc_json.dumps(data_sources, indent=True)
             print( jsonstr.encode('utf-8', 'ignore').decode('utf-8'), file=f)
         elif config.data_format == 'yaml':
             yaml.dump(data_sources, f, default_flow_style=False)
@@ -277,8 +279,7 @@ def save_htmlid(html_id):
 
 def compress_json(data):
     """ Take a Python data object. Convert to JSON and compress using lzstring """
-    json_string = json.dumps(data).encode('utf-8', 'ignore').decode('utf-8')
-    # JSON.parse() doesn't handle `NaN`, but it does handle `null`.
-    json_string = json_string.replace('NaN', 'null');
+    # NaN goes in as null, as JSON.parse() doesn't handle `NaN`
+    json_string = mqc_json.dumps(data, ascii=True)
     x = lzstring.LZString()
     return x.compressToBase64(json_string)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+""" MultiQC code to account for the bytes that make up a report and
+warn when plots or the whole report grow beyond the configured budgets """
+
+from __future__ import print_function
+from collections import OrderedDict
+import lzstring
+import re
+
+from multiqc import config
+from multiqc.utils import mqc_json, plot_cost
+log = config.logger
+
+# Sizes of the template files pulled in with include_file(), filled in by the core script
+asset_sizes = OrderedDict()
+
+b64_img_re = re.compile(r'data:image/[a-z+]+;base64,([A-Za-z0-9+/=]+)')
+table_re = re.compile(r'<table\b.*?</table>', re.DOTALL)
+
+def nbytes(s):
+    """ Length of a string once written to the UTF-8 encoded report """
+    if s is None:
+        return 0
+    try:
+        return len(s.encode('utf-8', 'ignore'))
+    except AttributeError:
+        return len(s)
+
+def record_asset(name, contents):
+    """ Remember the size of a template file included in the report """
+    asset_sizes[name] = asset_sizes.get(name, 0) + nbytes(contents)
+
+def html_breakdown(html):
+    """ Split a chunk of HTML into table markup, base64 flat images and the rest """
+    table_bytes = sum([nbytes(t) for t in table_re.findall(html)])
+    image_bytes = sum([len(i) for i in b64_img_re.findall(html)])
+    return {
+        'bytes': nbytes(html),
+        'table_html_bytes': table_bytes,
+        'flat_image_bytes': image_bytes,
+    }
+
+def plot_breakdown(plot_data):
+    """ Size of each plot's JSON, both raw and lzstring compressed
+    as it would be on its own in the report """
+    x = lzstring.LZString()
+    plots = OrderedDict()
+    for pid in sorted(plot_data.keys()):
+        pdata = plot_data[pid]
+        json_string = mqc_json.dumps(pdata, ascii=True)
+        plots[pid] = {
+            'plot_type': pdata.get('plot_type'),
+            'raw_json_bytes': nbytes(json_string),
+            'compressed_bytes': len(x.compressToBase64(json_string)),
+        }
+    return plots
+
+def size_breakdown(report, report_output):
+    """ Build a nested dict with the number of bytes contributed by every
+    module, section, plot, table and template asset in a rendered report
+    :param report: The MultiQC report module
+    :param report_output: The rendered report HTML
+    :return: dict, ready to be written to multiqc_size_report.json
+    """
+    plots = plot_breakdown(report.plot_data)
+    plot_id_attrs = {pid: 'id="{}"'.format(pid) for pid in plots}
+
+    modules = OrderedDict()
+    for mod in report.modules_output:
+        m = {
+            'name': mod.name,
+            'bytes': nbytes(getattr(mod, 'intro', '')) + nbytes(getattr(mod, 'comment', '')),
+            'sections': OrderedDict()
+        }
+        for s in mod.sections:
+            html = ''.join([s.get(k) or '' for k in ['description', 'comment', 'helptext', 'plot', 'content']])
+            sec = html_breakdown(html)
+            sec['plots'] = [pid for pid, needle in plot_id_attrs.items() if needle in html]
+            sec['plot_compressed_bytes'] = sum([plots[pid]['compressed_bytes'] for pid in sec['plots']])
+            m['sections'][s['anchor']] = sec
+            m['bytes'] += sec['bytes']
+        modules[mod.anchor] = m
+
+    general_stats = html_breakdown(report.general_stats_html)
+    general_stats['plots'] = [pid for pid, needle in plot_id_attrs.items() if needle in report.general_stats_html]
+
+    return OrderedDict([
+        ('total_bytes', nbytes(report_output)),
+        ('plot_data_compressed_bytes', nbytes(getattr(report, 'plot_compressed_json', ''))),
+        ('template_assets_bytes', sum(asset_sizes.values())),
+        ('template_assets', asset_sizes),
+        ('general_stats', general_stats),
+        ('modules', modules),
+        ('plots', plots),
+        ('plot_choices', plot_cost.choices),
+    ])
+
+def log_breakdown(breakdown):
+    """ Log the report size and the size of each module, for when there is
+    no data directory to write multiqc_size_report.json to """
+    log.info("Report size : {:,} bytes, {:,} bytes of compressed plot data, {:,} bytes of template assets".format(
+        breakdown['total_bytes'], breakdown['plot_data_compressed_bytes'], breakdown['template_assets_bytes']))
+    for anchor, m in sorted(breakdown['modules'].items(), key=lambda m: m[1]['bytes'], reverse=True):
+        log.info("  {}: {:,} bytes".format(anchor, m['bytes']))
+
+def check_budgets(breakdown):
+    """ Log a warning for every plot, and for the report as a whole,
+    that is bigger than the configured byte budget """
+    plot_budget = getattr(config, 'report_size_plot_budget', None)
+    if plot_budget:
+        for pid, p in breakdown['plots'].items():
+            if p['compressed_bytes'] > plot_budget:
+                log.warning("Plot '{}' is {:,} bytes compressed, over the budget of {:,} bytes".format(pid, p['compressed_bytes'], plot_budget))
+    report_budget = getattr(config, 'report_size_budget', None)
+    if report_budget and breakdown['total_bytes'] > report_budget:
+        log.warning("Report is {:,} bytes, over the budget of {:,} bytes".format(breakdown['total_bytes'], report_budget))
+        biggest = sorted(breakdown['modules'].items(), key=lambda m: m[1]['bytes'], reverse=True)[:3]
+        for anchor, m in biggest:
+            log.warning("  {}: {:,} bytes".format(anchor, m['bytes']))
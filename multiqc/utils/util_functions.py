@@ -3,8 +3,10 @@
 """ MultiQC Utility functions, used in a variety of places. """
 
 from __future__ import print_function
+import bz2
+import gzip
 import io
-import json
+import mimetypes
 import os
 import yaml
 import time
@@ -12,6 +14,27 @@ import shutil
 import sys
 
 from multiqc import config
+from multiqc.utils import mqc_json
+
+try:
+    import lzma
+except ImportError:
+    # Python 2
+    lzma = None
+
+# Functions to open a compressed file for reading as bytes, by mimetypes encoding
+decompressors = {
+    'gzip': lambda path: gzip.open(path, 'rb'),
+    'bzip2': lambda path: bz2.BZ2File(path, 'rb'),
+}
+if lzma is not None:
+    decompressors['xz'] = lambda path: lzma.open(path, 'rb')
+
+# Errors from reading a corrupt or mislabelled compressed file. gzip and bz2
+# raise OSError or EOFError, but lzma has its own error class.
+decompress_errors = (IOError, OSError, EOFError)
+if lzma is not None:
+    decompress_errors += (lzma.LZMAError,)
 
 def robust_rmtree(path, logger=None, max_retries=10):
     """Robustly tries to delete paths.
@@ -37,6 +60,31 @@ def robust_rmtree(path, logger=None, max_retries=10):
     shutil.rmtree(path)
 
 
+def compression(path):
+    """ The compression of a file, from its file name
+    :return: mimetypes encoding, eg. 'gzip', or None if the file isn't compressed
+    """
+    return mimetypes.guess_type(path)[1]
+
+def open_file(path, mode='r'):
+    """ Open a file for reading, decompressing it as it is read if it
+    is gzip, bzip2 or xz compressed. Nothing is written to disk.
+    :param mode: 'r' for UTF-8 text, 'rb' for bytes
+    :return: file object
+    :raises ValueError: if the file is compressed in a way that can't be read
+    """
+    encoding = compression(path)
+    if encoding is None:
+        if mode == 'rb':
+            return io.open(path, 'rb')
+        return io.open(path, 'r', encoding='utf-8')
+    if encoding not in decompressors:
+        raise ValueError("Can't read {} compressed file: {}".format(encoding, path))
+    fh = decompressors[encoding](path)
+    if mode == 'rb':
+        return fh
+    return io.TextIOWrapper(fh, encoding='utf-8')
+
 def write_data_file(data, fn, sort_cols=False, data_format=None):
     """ Write a data file to the report directory. Will not do anything
     if config.data_dir is not set.
@@ -54,31 +102,27 @@ def write_data_file(data, fn, sort_cols=False, data_format=None):
             data_format = config.data_format
         fn = '{}.{}'.format(fn, config.data_format_extensions[data_format])
 
-        # JSON encoder class to handle lambda functions
-        class MQCJSONEncoder(json.JSONEncoder):
-            def default(self, obj):
-                if callable(obj):
-                    try:
-                        return obj(1)
-                    except:
-                        return None
-                return json.JSONEncoder.default(self, obj)
+        # JSON goes straight to the file as UTF-8 bytes
+        if data_format == 'json':
+            with io.open (os.path.join(config.data_dir, fn), 'wb') as f:
+                mqc_json.dump(data, f, indent=True)
+                f.write(b'\n')
+            return
 
         # Save file
         with io.open (os.path.join(config.data_dir, fn), 'w', encoding='utf-8') as f:
-            if data_format == 'json':
-                jsonstr = json.dumps(data, indent=4, cls=MQCJSONEncoder, ensure_ascii=False)
-                print( jsonstr.encode('utf-8', 'ignore').decode('utf-8'), file=f)
-            elif data_format == 'yaml':
+            if data_format == 'yaml':
                 yaml.dump(data, f, default_flow_style=False)
             else:
                 # Default - tab separated output
                 # Get all headers
                 h = ['Sample']
+                seen = set(h)
                 for sn in sorted(data.keys()):
                     for k in data[sn].keys():
-                        if type(data[sn][k]) is not dict and k not in h:
+                        if type(data[sn][k]) is not dict and str(k) not in seen:
                             h.append(str(k))
+                            seen.add(str(k))
                 if sort_cols:
                     h = sorted(h)
 
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+""" Benchmark for preparing bar graph data (multiqc.plots.bargraph.plot)
+with many samples. Default: 20,000 samples x 50 categories, with some
+missing values, empty samples, an empty category and an all-zero category. """
+
+from __future__ import print_function
+import click
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from multiqc.utils import config, report
+from multiqc.plots import bargraph
+
+def make_data(samples, cats, empty, seed):
+    """ Random values in a dict of samples to dicts of categories """
+    r = random.Random(seed)
+    data = dict()
+    for i in range(samples):
+        s_name = 'sample_{:05d}'.format(i)
+        if r.random() < empty:
+            data[s_name] = dict()
+            continue
+        # ~5% of values missing, no values for cat_3 and all zeros for cat_4
+        data[s_name] = dict([ ('cat_{}'.format(c), r.random() * 100) for c in range(cats) if r.random() > 0.05 and c != 3 ])
+        if 'cat_4' in data[s_name]:
+            data[s_name]['cat_4'] = 0
+    return data
+
+@click.command()
+@click.option('--samples', default=20000, help='Number of samples')
+@click.option('--cats', default=50, help='Number of categories')
+@click.option('--empty', default=0.1, help='Fraction of samples with no data')
+@click.option('--seed', default=5, help='Random seed')
+def main(samples, cats, empty, seed):
+    config.data_dir = None
+    # Time the interactive plot data, not drawing a flat image
+    config.plots_force_interactive = True
+    data = make_data(samples, cats, empty, seed)
+    t0 = time.time()
+    bargraph.plot(data, None, {'id': 'bench_bargraph'})
+    print("{} samples x {} categories, {:.0f}% empty: bargraph.plot {:.2f}s".format(
+        samples, cats, empty * 100, time.time() - t0))
+
+if __name__ == '__main__':
+    main()
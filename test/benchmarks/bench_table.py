@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+""" Benchmark for building table HTML (multiqc.plots.table.make_table)
+with a large table of random values. Default: 10,000 rows x 100 columns. """
+
+from __future__ import print_function
+import click
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from multiqc.utils import config
+from multiqc.plots import table, table_object
+
+def make_data(rows, cols, seed):
+    """ Random values in a dict of samples to dicts of columns """
+    r = random.Random(seed)
+    return dict([ ('sample_{:05d}'.format(i), dict([ ('col_{}'.format(j), r.uniform(0, 1000)) for j in range(cols) ]))
+        for i in range(rows) ])
+
+@click.command()
+@click.option('--rows', default=10000, help='Number of rows (samples)')
+@click.option('--cols', default=100, help='Number of columns')
+@click.option('--seed', default=1, help='Random seed')
+def main(rows, cols, seed):
+    config.data_dir = None
+    data = make_data(rows, cols, seed)
+    t0 = time.time()
+    dt = table_object.datatable(data, None, {'id': 'bench_table'})
+    t1 = time.time()
+    html = table.make_table(dt)
+    t2 = time.time()
+    print("{} rows x {} columns: datatable {:.2f}s, make_table {:.2f}s, {:.1f} MB of HTML".format(
+        rows, cols, t1 - t0, t2 - t1, len(html) / 1e6))
+
+if __name__ == '__main__':
+    main()
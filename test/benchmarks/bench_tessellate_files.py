@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+""" Benchmark for parsing many Tessellate files, in the main process or in
+a pool of worker processes. Default: 5,000 synthetic PDB scan files. """
+
+from __future__ import print_function
+import click
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from multiqc.modules.montage_tessellate import montage_tessellate
+
+conformers = ['4C1', '1C4', 'E3', '3E', 'B25', 'S35', 'T2', 'P1', 'UAP']
+
+def write_campaign(c_dir, files, seed):
+    """ Write Tessellate PDB scan JSON files with 20 - 400 random rings each """
+    r = random.Random(seed)
+    if not os.path.exists(c_dir):
+        os.makedirs(c_dir)
+    for i in range(files):
+        rings = [ { 'conformer': conformers[r.randrange(len(conformers))], 'ringsize': r.choice([5, 6, 6, 6, 7, 8]),
+            'numeric': float(r.randrange(38)), 'pdbid': '{:04x}'.format(r.randrange(64)), 'macro': None }
+            for j in range(r.randint(20, 400)) ]
+        with io.open(os.path.join(c_dir, 'pdb{:04d}.json'.format(i)), 'w', encoding='utf-8') as fh:
+            fh.write(u'tessellate 0.1 json pdb\n')
+            fh.write(u'{}\n'.format(json.dumps(rings)))
+
+def digest(results):
+    """ Hash of the conformer counts, to check every run gives the same results """
+    counts = [ sorted([ (section, sorted(c.items())) for section, c in result['counts'].items() ]) for result in results ]
+    return hashlib.md5(json.dumps(counts).encode('utf-8')).hexdigest()
+
+@click.command()
+@click.option('--files', default=5000, help='Number of files')
+@click.option('--processes', default='1,2,4', help='Comma separated numbers of processes to try')
+@click.option('--path', default=None, help='Keep the files in this directory, and reuse them if it exists')
+@click.option('--seed', default=0, help='Random seed')
+def main(files, processes, path, seed):
+    tmp_dir = None
+    if path is None:
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'campaign')
+    try:
+        if not os.path.exists(path):
+            t0 = time.time()
+            write_campaign(path, files, seed)
+            print("Wrote {} files to {} in {:.1f}s".format(files, path, time.time() - t0))
+        paths = sorted([ os.path.join(path, fn) for fn in os.listdir(path) if fn.endswith('.json') ])
+        for nprocs in [ int(n) for n in processes.split(',') ]:
+            t0 = time.time()
+            results = list(montage_tessellate.parse_tessellate_files(paths, processes=nprocs))
+            t = time.time() - t0
+            print("{} files, {} processes: {:.2f}s, {:.0f} files/s, results {}".format(
+                len(paths), nprocs, t, len(paths) / t, digest(results)))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+""" Benchmark for reading a Tessellate text file, in lines per second.
+Default: a synthetic file of 10 million frames. """
+
+from __future__ import print_function
+import click
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from multiqc.modules.montage_tessellate import montage_tessellate
+
+conformers = ['4C1', '1C4', 'E3', '3E', 'B25', 'S35', 'T2', 'P1', 'UAP']
+
+def write_txt(path, lines, seed):
+    """ Write a Tessellate text file with random conformers """
+    r = random.Random(seed)
+    with io.open(path, 'w', encoding='utf-8') as fh:
+        fh.write(u'tessellate 0.1 txt\n')
+        for start in range(0, lines, 100000):
+            fh.write(u''.join([ u"{} ('{}', {})\n".format(i, conformers[r.randrange(len(conformers))], r.randrange(38))
+                for i in range(start, min(start + 100000, lines)) ]))
+
+@click.command()
+@click.option('--lines', default=10000000, help='Number of frames in the file')
+@click.option('--path', default=None, help='Keep the file here, and reuse it if it exists')
+@click.option('--seed', default=0, help='Random seed')
+def main(lines, path, seed):
+    tmp_dir = None
+    if path is None:
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'bench.txt')
+    try:
+        if not os.path.exists(path):
+            t0 = time.time()
+            write_txt(path, lines, seed)
+            print("Wrote {} ({:.0f} MB) in {:.1f}s".format(path, os.path.getsize(path) / 1e6, time.time() - t0))
+        t0 = time.time()
+        result = montage_tessellate.read_tessellate_file(path)
+        t = time.time() - t0
+        num_frames = sum([ len(cols['conformer']) for cols in result['frames']['rings'].values() ])
+        print("{} frames: read_tessellate_file {:.2f}s, {:.2f}M lines/s".format(num_frames, t, num_frames / t / 1e6))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()